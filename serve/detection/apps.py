@@ -1,6 +1,38 @@
+import multiprocessing
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def _is_serving_process():
+    """
+    True, если процесс будет обслуживать запросы: его запустили через wsgi.py/asgi.py
+    (они выставляют переменную окружения DETECTION_SERVING=1) или это дочерний процесс runserver.
+    Любой другой запуск (manage.py migrate/test, скрипты, celery и т.п.) модели не загружает.
+    """
+    # Дочерние процессы multiprocessing (процессы инференса) наследуют sys.argv и окружение родителя
+    if multiprocessing.parent_process() is not None:
+        return False
+    if os.environ.get('DETECTION_SERVING') == '1':
+        return True
+    if os.path.basename(sys.argv[0]) != 'manage.py' or 'runserver' not in sys.argv:
+        return False
+    # Процесс-наблюдатель автоперезагрузки runserver запросы не обслуживает
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
 
 
 class DetectionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'detection'
+
+    def ready(self):
+        if not getattr(settings, 'YOLO_PRELOAD_ON_START', True) or not _is_serving_process():
+            return
+        from . import yolo
+
+        # Загрузка и прогрев идут в фоне, чтобы не задерживать старт сервера;
+        # запросы, пришедшие раньше, дождутся загрузки своей модели в реестре
+        threading.Thread(target=yolo.preload_models, name="yolo-preload", daemon=True).start()
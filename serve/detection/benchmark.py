@@ -0,0 +1,454 @@
+import functools
+import os
+import platform
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import psutil
+import torch
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client
+from django.urls import reverse
+from ultralytics.engine.results import Results
+
+from .models import DetectionHistory, VideoJob
+from . import persistence, storage, yolo
+
+SCENARIOS = ("yolo_image", "yolo_imgsz", "yolo_batch", "yolo_video", "api_image", "api_video", "pool_image", "db_write")
+
+
+class StubModel:
+    """
+    Детерминированная замена модели YOLO для бенчмарков и тестов (без весов и сети).
+    Интерфейс как у ultralytics.YOLO: атрибут names и вызов model(source) -> list[Results].
+    На каждый кадр – boxes_per_frame боксов, положение, класс и уверенность которых
+    определяются содержимым кадра: один и тот же кадр всегда даёт один и тот же результат.
+    Стоимость прохода: уменьшение кадра до imgsz (как letterbox в ultralytics),
+    пауза batch_ms + frame_ms на кадр (время самой сети) и cpu_ms на кадр вычислений на Python,
+    которые держат GIL и занимают ядро (их параллелит только пул процессов).
+    Аргументы вызова как у ultralytics: imgsz (время на кадр растёт пропорционально площади входа
+    относительно imgsz заглушки), conf, classes и max_det отбрасывают боксы.
+    """
+
+    def __init__(self, names=None, boxes_per_frame=5, batch_ms=5.0, frame_ms=2.0, imgsz=640, cpu_ms=0.0):
+        if names is None:
+            from .render import coco_names
+            names = coco_names()
+        self.names = dict(names)
+        self.boxes_per_frame = boxes_per_frame
+        self.batch_ms = batch_ms
+        self.frame_ms = frame_ms
+        self.imgsz = imgsz
+        self.cpu_ms = cpu_ms
+
+    def __call__(self, source, imgsz=None, conf=0.0, classes=None, max_det=None, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        frames = [cv2.imread(frame) if isinstance(frame, str) else frame for frame in frames]
+        imgsz = imgsz or self.imgsz
+        results = [self._detect(frame, imgsz, conf, classes, max_det) for frame in frames]
+        area = (imgsz / self.imgsz) ** 2
+        time.sleep((self.batch_ms + self.frame_ms * area * len(frames)) / 1000)
+        if self.cpu_ms:
+            deadline = time.thread_time() + self.cpu_ms * area * len(frames) / 1000
+            while time.thread_time() < deadline:
+                pass
+        return results
+
+    def _detect(self, frame, imgsz, conf=0.0, classes=None, max_det=None):
+        height, width = frame.shape[:2]
+        scale = imgsz / max(height, width)
+        cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_LINEAR)
+
+        signature = cv2.resize(frame, (16, 16), interpolation=cv2.INTER_AREA)
+        rng = np.random.default_rng(zlib.crc32(signature.tobytes()))
+        count = self.boxes_per_frame
+        xy = rng.uniform(0, 1, (count, 2)) * [width * 0.9, height * 0.9]
+        wh = rng.uniform(0.02, 0.1, (count, 2)) * [width, height]
+        data = np.concatenate([
+            xy, np.minimum(xy + wh, [width, height]),
+            rng.uniform(0.25, 0.95, (count, 1)),
+            rng.integers(0, len(self.names), (count, 1)),
+        ], axis=1)
+        data = data[data[:, 4] > conf]
+        if classes is not None:
+            data = data[np.isin(data[:, 5], classes)]
+        if max_det is not None and len(data) > max_det:
+            data = data[np.argsort(-data[:, 4], kind="stable")[:max_det]]
+        return Results(frame, path="", names=self.names, boxes=torch.tensor(data, dtype=torch.float32))
+
+
+def stub_loader(name, threads=None, **kwargs):
+    """
+    Загрузчик заглушки для пула процессов инференса (YOLO_WORKER_POOL_LOADER, WorkerPool(loader=...)).
+    """
+    return StubModel(**kwargs)
+
+
+def synthetic_frame(width, height, seed=0):
+    """
+    Кадр BGR: градиентный фон, шум и несколько цветных прямоугольников.
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(40, 200, width, dtype=np.float32)[None, :, None]
+    frame = np.broadcast_to(gradient, (height, width, 3)).astype(np.uint8)
+    frame = cv2.add(frame, rng.integers(0, 20, (height, width, 3), dtype=np.uint8))
+    for _ in range(8):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(max(2, min(width, height) // 20), max(3, min(width, height) // 4)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(frame, (x, y), (x + size, y + size), color, -1)
+    return frame
+
+
+def synthetic_image(width, height, seed=0, quality=90):
+    """
+    JPEG-байты синтетического изображения width x height.
+    """
+    ok, encoded = cv2.imencode(".jpg", synthetic_frame(width, height, seed), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Не удалось закодировать изображение.")
+    return encoded.tobytes()
+
+
+def synthetic_video(path, width, height, frames, fps=25, seed=0):
+    """
+    Записывает MP4 из frames кадров: фон со сдвигом и движущиеся прямоугольники. Возвращает path.
+    """
+    background = synthetic_frame(width, height, seed)
+    rng = np.random.default_rng(seed)
+    objects = rng.uniform(0, 1, (6, 4)) * [width, height, 8, 6] - [0, 0, 4, 3]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    try:
+        for idx in range(frames):
+            frame = np.roll(background, idx * 2, axis=1)
+            size = max(4, min(width, height) // 8)
+            for obj_idx, (x, y, vx, vy) in enumerate(objects):
+                x, y = int((x + vx * idx) % width), int((y + vy * idx) % height)
+                cv2.rectangle(frame, (x, y), (x + size, y + size), (0, 80 * (obj_idx % 3), 255), -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def latency_summary(latencies_ms):
+    """
+    p50/p95/p99, среднее, минимум и максимум задержек в мс.
+    """
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    if not len(values):
+        return {}
+    return {
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "mean": round(float(values.mean()), 2),
+        "min": round(float(values.min()), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+
+class PeakRSS:
+    """
+    Прирост RSS процесса за время блока with (опрос psutil каждые interval секунд в отдельном потоке).
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.process = psutil.Process()
+        self._stop = threading.Event()
+        self.baseline = 0
+        self.peak = 0
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self):
+        self.baseline = self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, name="bench-memory", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+    @property
+    def growth_mb(self):
+        return round((self.peak - self.baseline) / 2 ** 20, 1)
+
+
+def measure(call, runs, concurrency=1, warmup=1, items_per_call=1):
+    """
+    Вызывает call(i) для i = 0..runs-1 (в concurrency потоков) после warmup прогревочных вызовов
+    (i = runs, runs + 1, ...). call возвращает словарь длительностей стадий в мс (или None).
+    Возвращает:
+      - latency_ms: p50/p95/p99, среднее, минимум и максимум;
+      - throughput_per_s: элементов (items_per_call на вызов) в секунду;
+      - stages_ms: среднее по вызовам для каждой стадии;
+      - peak_rss_mb: прирост RSS за замер;
+      - peak_traced_mb: пик выделений Python/NumPy за один вызов – отдельным вызовом
+        под tracemalloc, чтобы его накладные расходы не попали в задержки.
+    """
+    for i in range(warmup):
+        call(runs + i)
+    latencies = []
+    stages = {}
+    lock = threading.Lock()
+
+    def timed(i):
+        started = time.perf_counter()
+        stage_times = call(i) or {}
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            for name, value in stage_times.items():
+                stages.setdefault(name, []).append(value)
+
+    with PeakRSS() as rss:
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(timed, range(runs)))
+        else:
+            for i in range(runs):
+                timed(i)
+        wall = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        call(runs + warmup)
+        peak_traced = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "runs": runs,
+        "concurrency": concurrency,
+        "latency_ms": latency_summary(latencies),
+        "throughput_per_s": round(runs * items_per_call / wall, 2) if wall else 0.0,
+        "stages_ms": {name: round(float(np.mean(values)), 2) for name, values in stages.items()},
+        "peak_rss_mb": rss.growth_mb,
+        "peak_traced_mb": round(peak_traced / 2 ** 20, 1),
+    }
+
+
+def _pipeline_stages_ms(stage_timings):
+    return {f"{name}_busy": round(stat["busy_s"] * 1000, 2) for name, stat in stage_timings.items()}
+
+
+def bench_yolo_image(width, height, runs, concurrency=1, model_name=None):
+    """
+    decode_image + process_image_yolo10m (через планировщик, если он включён).
+    """
+    images = _images(width, height, runs)
+
+    def call(i):
+        data = images[i % len(images)]
+        started = time.perf_counter()
+        frame = storage.decode_image(data)
+        decode_ms = (time.perf_counter() - started) * 1000
+        stats = {}
+        started = time.perf_counter()
+        yolo.process_image_yolo10m(frame, f"bench_{i}.jpg", stats=stats, model_name=model_name)
+        return {"decode": decode_ms, "queue_wait": stats.get("queue_wait_ms") or 0.0,
+                "process": (time.perf_counter() - started) * 1000}
+    return measure(call, runs, concurrency)
+
+
+def bench_yolo_imgsz(width, height, runs, imgsz, model_name=None):
+    """
+    process_image_yolo10m с заданным размером входа модели (число или "auto"): задержка прохода
+    при разном imgsz на изображении одного размера. Запускать без планировщика, чтобы в задержку
+    не попало ожидание батча.
+    """
+    images = _images(width, height, runs)
+
+    def call(i):
+        frame = storage.decode_image(images[i % len(images)])
+        yolo.process_image_yolo10m(frame, f"bench_{i}.jpg", model_name=model_name, annotate=False,
+                                   inference={"imgsz": imgsz})
+    return measure(call, runs)
+
+
+def bench_yolo_batch(width, height, runs, batch_size=8, model_name=None):
+    """
+    process_images_yolo10m на пачке из batch_size кадров; throughput – изображений в секунду.
+    """
+    frames = [storage.decode_image(synthetic_image(width, height, seed=i)) for i in range(batch_size)]
+
+    def call(i):
+        items = [(frame, f"bench_{i}_{n}.jpg") for n, frame in enumerate(frames)]
+        yolo.process_images_yolo10m(items, max_batch_size=batch_size, model_name=model_name)
+    return measure(call, runs, items_per_call=batch_size)
+
+
+def bench_yolo_video(path, runs, frames, model_name=None):
+    """
+    process_video_yolo10m по готовому файлу; стадии конвейера – суммарное время работы (busy).
+    """
+    def call(i):
+        stats = {}
+        yolo.process_video_yolo10m(path, f"bench_{i}.mp4", stats=stats, model_name=model_name)
+        return _pipeline_stages_ms(stats["stages"])
+    return measure(call, runs, items_per_call=frames)
+
+
+def bench_api_image(width, height, runs, concurrency=1, model_name=None):
+    """
+    POST /api/process-image/ с загрузкой файла (multipart), как у клиента API.
+    """
+    url = reverse('process_image')
+    images = _images(width, height, runs)
+
+    def call(i):
+        client = Client()
+        upload = SimpleUploadedFile(f"bench_{i}.jpg", images[i % len(images)], content_type="image/jpeg")
+        fields = {"image": upload, **({"model": model_name} if model_name else {})}
+        response = client.post(url, fields)
+        if response.status_code != 200:
+            raise RuntimeError(f"Ответ {response.status_code}: {response.content[:200]!r}")
+        return {"queue_wait": response.json().get("queue_wait_ms") or 0.0}
+    return measure(call, runs, concurrency)
+
+
+def bench_api_video(video_url, runs, frames, model_name=None, timeout=600):
+    """
+    POST /api/process-video/ со ссылкой на видео и ожидание завершения фоновой задачи;
+    задержка – от постановки в очередь до статуса done.
+    """
+    url = reverse('process_video')
+
+    def call(i):
+        payload = {"video_url": video_url, **({"model": model_name} if model_name else {})}
+        response = Client().post(url, payload, content_type="application/json")
+        if response.status_code != 202:
+            raise RuntimeError(f"Ответ {response.status_code}: {response.content[:200]!r}")
+        job_id = response.json()["job_id"]
+        deadline = time.monotonic() + timeout
+        while True:
+            job = VideoJob.objects.get(pk=job_id)
+            if job.status == VideoJob.STATUS_DONE:
+                return _pipeline_stages_ms(job.stage_timings)
+            if job.status == VideoJob.STATUS_FAILED:
+                raise RuntimeError(f"Задача {job_id} завершилась с ошибкой: {job.error}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Задача {job_id} не завершилась за {timeout} c")
+            time.sleep(0.02)
+    return measure(call, runs, items_per_call=frames)
+
+
+def bench_worker_pool(pool, width, height, runs):
+    """
+    pool.predict по одному кадру из pool.size потоков: пропускная способность пула процессов инференса.
+    """
+    frames = [storage.decode_image(data) for data in _images(width, height, runs)]
+
+    def call(i):
+        pool.predict([frames[i % len(frames)]])
+    return measure(call, runs, concurrency=pool.size)
+
+
+def bench_db_write(runs, concurrency=1, detections=5):
+    """
+    persistence.save_history одной записи с detections детекциями – запись в БД на пути запроса
+    /api/process-image/ (групповая или прямая – по HISTORY_WRITE_GROUP_COMMIT).
+    """
+    details = [{"class": "person", "confidence": 0.9, "bbox": [10.0 * n, 20.0, 10.0 * n + 50, 120.0]}
+               for n in range(detections)]
+
+    def call(i):
+        record = DetectionHistory(
+            image_name=f"bench_{i}.jpg", shape="640x480", classes_from_img="person", source_type="file",
+            path=f"output_img/bench_{i}.jpg", input_path=f"input_img/bench_{i}.jpg", content_hash=f"bench_{i}",
+        )
+        persistence.save_history([(record, details)])
+    return measure(call, runs, concurrency)
+
+
+def _images(width, height, runs, warmup=1):
+    """
+    Разные изображения на каждый вызов measure (кэш результатов по содержимому не срабатывает),
+    сгенерированные заранее, чтобы генерация не попала в замер.
+    """
+    return [synthetic_image(width, height, seed=seed) for seed in range(runs + warmup + 1)]
+
+
+class MediaServer:
+    """
+    Локальный HTTP-сервер, раздающий файлы из directory (ссылки для image_url / video_url).
+    """
+
+    def __init__(self, directory):
+        handler = functools.partial(_QuietHandler, directory=directory)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="bench-media", daemon=True)
+
+    def url(self, name):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def environment():
+    """
+    Сведения об окружении для отчёта: сравнивать имеет смысл прогоны на одинаковом железе.
+    """
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "scheduler_enabled": getattr(settings, 'YOLO_SCHEDULER_ENABLED', True),
+        "backend": getattr(settings, 'YOLO_BACKEND', "torch"),
+    }
+
+
+def scenario_key(entry):
+    """
+    Ключ сценария для сравнения прогонов: имя и параметры.
+    """
+    return f"{entry['scenario']}[{entry['params']}]"
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Сравнивает два отчёта по одинаковым сценариям. Возвращает список строк о регрессиях:
+    p50/p95 выросли или throughput упал больше чем на threshold (доля).
+    """
+    previous = {scenario_key(entry): entry for entry in baseline.get("results", [])}
+    regressions = []
+    for entry in current.get("results", []):
+        old = previous.get(scenario_key(entry))
+        if old is None:
+            continue
+        for metric in ("p50", "p95"):
+            before, after = old["latency_ms"].get(metric), entry["latency_ms"].get(metric)
+            if before and after and after > before * (1 + threshold):
+                regressions.append(f"{scenario_key(entry)}: {metric} {before} -> {after} мс")
+        before, after = old.get("throughput_per_s"), entry.get("throughput_per_s")
+        if before and after is not None and after < before * (1 - threshold):
+            regressions.append(f"{scenario_key(entry)}: throughput {before} -> {after} /с")
+    return regressions
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import DetectionHistory
+
+
+def cache_key(content_digest, model_name, params=None):
+    """
+    Ключ кэша результатов: хэш содержимого входного файла + имя модели + параметры инференса.
+    """
+    payload = json.dumps(
+        {"content": content_digest, "model": model_name, "params": params or {}},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Кэш результатов детекции по ключу cache_key().
+    Первый уровень – LRU в памяти процесса, ограниченный по суммарному размеру записей
+    (max_bytes, 0 – отключён); второй – индексированная колонка DetectionHistory.content_hash.
+    Считает попадания и промахи.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Возвращает сохранённую запись (словарь) или None.
+        """
+        with self._lock:
+            item = self._entries.get(key)
+        if item is not None:
+            entry = item[0]
+            # Файлы записи могли перекодировать или удалить (manage.py compact_media) –
+            # тогда запись перечитывается из БД
+            if os.path.exists(os.path.join(settings.MEDIA_ROOT, entry["path"] or entry["input_path"])):
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                return entry
+            with self._lock:
+                if self._entries.get(key) is item:
+                    del self._entries[key]
+                    self._bytes -= item[1]
+
+        record = (DetectionHistory.objects
+                  .filter(content_hash=key)
+                  .order_by('-id')
+                  .first())
+        # Без аннотированного файла (annotate=false) изображение отрисовывается по исходному
+        if record is None or not os.path.exists(os.path.join(settings.MEDIA_ROOT, record.path or record.input_path)):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        entry = entry_from_record(record)
+        with self._lock:
+            self.db_hits += 1
+        self.put(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        if not self.max_bytes:
+            return
+        size = len(json.dumps(entry, ensure_ascii=False))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (entry, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            total = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_ratio": round(hits / total, 4) if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def entry_from_record(record):
+    """
+    Запись кэша по строке DetectionHistory.
+    """
+    return {
+        "record_id": record.id,
+        "image_name": record.image_name,
+        "shape": record.shape,
+        "path": record.path,
+        "input_path": record.input_path,
+        "detected_classes": [c for c in record.classes_from_img.split(", ") if c],
+        "detected_details": record.get_detailed_results(),
+    }
+
+
+result_cache = ResultCache(max_bytes=getattr(settings, 'RESULT_CACHE_MAX_BYTES', 0))
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+# Сколько детекций копится в мелких массивах кадров, прежде чем склеиться в один блок
+_CONSOLIDATE_ROWS = 4096
+
+
+class FrameDetections:
+    """
+    Детекции одного кадра в виде массивов:
+    class_id (N,) int16, confidence (N,) float32, xyxy (N, 4) float32,
+    track_id (N,) int32 (-1 – без трека), interpolated (N,) bool.
+    """
+
+    def __init__(self, class_id, confidence, xyxy, track_id=None, interpolated=None):
+        self.class_id = np.asarray(class_id, dtype=np.int16).reshape(-1)
+        self.confidence = np.asarray(confidence, dtype=np.float32).reshape(-1)
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        count = len(self.class_id)
+        self.track_id = (np.full(count, -1, dtype=np.int32) if track_id is None
+                         else np.asarray(track_id, dtype=np.int32).reshape(-1))
+        self.interpolated = (np.zeros(count, dtype=bool) if interpolated is None
+                             else np.broadcast_to(np.asarray(interpolated, dtype=bool), (count,)).copy())
+
+    def __len__(self):
+        return len(self.class_id)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0), np.zeros(0), np.zeros((0, 4)))
+
+    @classmethod
+    def from_result(cls, result):
+        """
+        Массивы из результата YOLO: по одному переносу cls/conf/xyxy с устройства на кадр,
+        без преобразования каждого бокса в объекты Python.
+        """
+        if result is None or result.boxes is None or not len(result.boxes):
+            return cls.empty()
+        boxes = result.boxes
+        return cls(boxes.cls.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.xyxy.cpu().numpy())
+
+    @classmethod
+    def from_details(cls, details, class_ids, interpolated=False):
+        """
+        Массивы из словарей детекций (class, confidence, bbox[, track_id]); class_ids – {имя: id}.
+        """
+        return cls(
+            [class_ids.get(detail["class"], -1) for detail in details],
+            [detail.get("confidence") or 0.0 for detail in details],
+            [detail["bbox"] for detail in details],
+            [detail.get("track_id", -1) for detail in details],
+            interpolated,
+        )
+
+    def scaled(self, scale_x, scale_y):
+        """
+        Копия с боксами, умноженными на scale_x по горизонтали и scale_y по вертикали
+        (перевод из координат уменьшенного кадра в исходные).
+        """
+        factors = np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        return FrameDetections(self.class_id, self.confidence, self.xyxy * factors, self.track_id, self.interpolated)
+
+    def class_names(self, names):
+        return [names[class_id] for class_id in self.class_id.tolist()]
+
+    def to_details(self, names, frame=None):
+        """
+        Словари в формате detailed_results; бокс за боксом, поэтому только по запросу.
+        """
+        details = []
+        rows = zip(self.class_names(names), self.confidence.tolist(), self.xyxy.tolist(),
+                   self.track_id.tolist(), self.interpolated.tolist())
+        for class_name, confidence, bbox, track_id, interpolated in rows:
+            detail = {"class": class_name, "confidence": confidence, "bbox": bbox}
+            if frame is not None:
+                detail = {"frame": frame, **detail}
+            if track_id >= 0:
+                detail["track_id"] = track_id
+                detail["interpolated"] = interpolated
+            details.append(detail)
+        return details
+
+
+class DetectionColumns:
+    """
+    Детекции видео в колоночном виде: массивы frame, class_id, confidence, xyxy, track_id,
+    interpolated одинаковой длины плюс словарь имён классов.
+    31 байт на детекцию вместо словаря с вложенным списком (~450 байт);
+    кадры добавляются по одному (append), хранятся и читаются файлом .npz (save/load).
+    """
+
+    FIELDS = ("frame", "class_id", "confidence", "xyxy", "track_id", "interpolated")
+
+    def __init__(self, names):
+        self.names = {int(class_id): name for class_id, name in dict(names).items()}
+        self._blocks = {field: [] for field in self.FIELDS}
+        self._pending = []
+        self._pending_rows = 0
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, frame_idx, detections):
+        if not len(detections):
+            return
+        with self._lock:
+            self._pending.append((frame_idx, detections))
+            self._pending_rows += len(detections)
+            self.count += len(detections)
+            if self._pending_rows >= _CONSOLIDATE_ROWS:
+                self._consolidate()
+
+    def _consolidate(self):
+        if not self._pending:
+            return
+        frames = [np.full(len(d), frame_idx, dtype=np.int32) for frame_idx, d in self._pending]
+        self._blocks["frame"].append(np.concatenate(frames))
+        for field in self.FIELDS[1:]:
+            self._blocks[field].append(np.concatenate([getattr(d, field) for _, d in self._pending]))
+        self._pending = []
+        self._pending_rows = 0
+
+    def arrays(self):
+        """
+        Словарь {поле: массив} по всем добавленным кадрам.
+        """
+        with self._lock:
+            self._consolidate()
+            if len(self._blocks["frame"]) > 1:
+                self._blocks = {field: [np.concatenate(blocks)] for field, blocks in self._blocks.items()}
+            empty = FrameDetections.empty()
+            return {
+                field: (blocks[0] if blocks
+                        else np.zeros(0, dtype=np.int32) if field == "frame"
+                        else getattr(empty, field))
+                for field, blocks in self._blocks.items()
+            }
+
+    def classes(self):
+        """
+        Список уникальных имён обнаруженных классов.
+        """
+        return [self.names[class_id] for class_id in np.unique(self.arrays()["class_id"]).tolist()]
+
+    def to_details(self, from_frame=None, to_frame=None):
+        """
+        Детекции в формате detailed_results (с номером кадра), по желанию – только
+        кадров from_frame <= frame < to_frame. Словари создаются только здесь.
+        """
+        columns = self.arrays()
+        mask = np.ones(len(columns["frame"]), dtype=bool)
+        if from_frame is not None:
+            mask &= columns["frame"] >= from_frame
+        if to_frame is not None:
+            mask &= columns["frame"] < to_frame
+        details = []
+        frames = columns["frame"][mask]
+        selected = FrameDetections(*(columns[field][mask] for field in self.FIELDS[1:]))
+        for frame, detail in zip(frames.tolist(), selected.to_details(self.names)):
+            details.append({"frame": frame, **detail})
+        return details
+
+    def save(self, path):
+        """
+        Атомарно сохраняет колонки в path (.npz со сжатием).
+        """
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, names=np.array(json.dumps(self.names)), **self.arrays())
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            columns = cls(json.loads(str(data["names"])))
+            frames = data["frame"]
+            if len(frames):
+                columns._blocks = {field: [data[field]] for field in cls.FIELDS}
+                columns.count = len(frames)
+        return columns
+
+
+def columns_path(video_path):
+    """
+    Путь к файлу детекций .npz рядом с видео (то же имя, другое расширение).
+    """
+    return os.path.splitext(video_path)[0] + ".npz"
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import shutil
+import threading
+
+import cv2
+import numpy as np
+import torch
+from django.conf import settings
+from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+from ultralytics.engine.results import Results
+from ultralytics.utils import ops
+
+try:
+    from ultralytics.utils.nms import non_max_suppression
+except ImportError:  # ultralytics < 8.3.100
+    from ultralytics.utils.ops import non_max_suppression
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+_export_lock = threading.Lock()
+
+
+def inference_threads():
+    """
+    Число потоков инференса: YOLO_INFERENCE_THREADS или все доступные ядра.
+    """
+    threads = getattr(settings, 'YOLO_INFERENCE_THREADS', 0)
+    return threads if threads > 0 else (os.cpu_count() or 1)
+
+
+def export_artifact(name, backend, imgsz=None):
+    """
+    Экспортирует веса name в формат backend (один раз) и возвращает путь к артефакту
+    в YOLO_EXPORT_DIR. Рядом сохраняется <артефакт>.json с именами классов.
+    """
+    imgsz = imgsz or getattr(settings, 'YOLO_EXPORT_IMGSZ', 640)
+    export_dir = getattr(settings, 'YOLO_EXPORT_DIR', os.path.join(settings.BASE_DIR, 'model_cache'))
+    os.makedirs(export_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if backend == "onnx":
+        target = os.path.join(export_dir, f"{stem}_{imgsz}.onnx")
+    else:
+        target = os.path.join(export_dir, f"{stem}_{imgsz}_openvino")
+
+    with _export_lock:
+        if os.path.exists(target) and os.path.exists(target + ".json"):
+            return target
+
+        logger.info("Экспорт %s в %s (imgsz=%s)", name, backend, imgsz)
+        source = YOLO(name)
+        # dynamic=True: переменный размер батча и входа, нужен для батчевого инференса
+        exported = source.export(format=backend, dynamic=True, imgsz=imgsz)
+        tmp_target = f"{target}.tmp{os.getpid()}"
+        shutil.move(str(exported), tmp_target)
+        os.replace(tmp_target, target)
+        with open(target + ".json", "w", encoding="utf-8") as f:
+            json.dump({"source": name, "imgsz": imgsz, "names": source.names}, f, ensure_ascii=False)
+    return target
+
+
+class ExportedModel:
+    """
+    Модель, экспортированная в ONNX или OpenVINO, с интерфейсом вызова как у ultralytics.YOLO:
+    model(source) возвращает список ultralytics Results, поэтому остальной код
+    (извлечение детекций, plot()) не зависит от движка.
+    Поддерживаются source: путь, кадр BGR (numpy) или список кадров.
+    """
+
+    def __init__(self, artifact, backend, threads=None):
+        with open(artifact + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.artifact = artifact
+        self.backend = backend
+        self.names = {int(k): v for k, v in meta["names"].items()}
+        self.imgsz = meta["imgsz"]
+        self.stride = 32
+        self.threads = threads or inference_threads()
+        # Для совместимости с кодом, который ищет torch-модель (оценка размера весов)
+        self.model = None
+        if backend == "onnx":
+            self._load_onnx()
+        else:
+            self._load_openvino()
+
+    def _load_onnx(self):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = onnxruntime.InferenceSession(self.artifact, options, providers=["CPUExecutionProvider"])
+        input_name = session.get_inputs()[0].name
+        self._run = lambda batch: session.run(None, {input_name: batch})[0]
+
+    def _load_openvino(self):
+        import openvino as ov
+
+        core = ov.Core()
+        xml = next(f for f in os.listdir(self.artifact) if f.endswith(".xml"))
+        compiled = core.compile_model(
+            os.path.join(self.artifact, xml), "CPU",
+            {"INFERENCE_NUM_THREADS": self.threads, "PERFORMANCE_HINT": "LATENCY"},
+        )
+        self._run = lambda batch: compiled(batch)[0]
+
+    def __call__(self, source, conf=0.25, iou=0.7, classes=None, max_det=300, imgsz=None, verbose=False, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        frames = [cv2.imread(f) if isinstance(f, str) else f for f in frames]
+        # Модель экспортирована с dynamic=True: размер входа можно менять от вызова к вызову
+        imgsz = imgsz or self.imgsz
+        # Как в ultralytics: минимальные поля (auto) только если все кадры одного размера
+        same_shapes = len({f.shape for f in frames}) == 1
+        letterbox = LetterBox((imgsz, imgsz), auto=same_shapes, stride=self.stride)
+        batch = np.stack([letterbox(image=f) for f in frames])
+        batch = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+        preds = torch.from_numpy(np.asarray(self._run(batch)))
+        if preds.shape[-1] == 6:
+            # Модели end-to-end (YOLOv10): уже (batch, max_det, 6) без NMS
+            detections = []
+            for pred in preds:
+                pred = pred[pred[:, 4] > conf]
+                if classes is not None:
+                    pred = pred[torch.isin(pred[:, 5], torch.tensor(classes, dtype=pred.dtype))]
+                detections.append(pred[:max_det])
+        else:
+            detections = non_max_suppression(preds, conf, iou, classes=classes, max_det=max_det)
+
+        results = []
+        for frame, det in zip(frames, detections):
+            det = det.clone()
+            det[:, :4] = ops.scale_boxes(batch.shape[2:], det[:, :4], frame.shape)
+            results.append(Results(frame, path="", names=self.names, boxes=det))
+        return results
+
+
+def load_model(name, backend=None, threads=None):
+    """
+    Загружает модель name через выбранный движок (YOLO_BACKEND по умолчанию):
+      - torch: ultralytics.YOLO как есть (число потоков – torch.set_num_threads);
+      - onnx: ONNX Runtime на CPU;
+      - openvino: OpenVINO Runtime на CPU.
+    Для onnx/openvino веса экспортируются один раз и кэшируются в YOLO_EXPORT_DIR.
+    threads – число потоков инференса (по умолчанию inference_threads()).
+    """
+    backend = backend or getattr(settings, 'YOLO_BACKEND', "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный движок инференса {backend}. Доступные: {', '.join(BACKENDS)}.")
+    threads = threads or inference_threads()
+    if backend == "torch":
+        torch.set_num_threads(threads)
+        return YOLO(name)
+    return ExportedModel(export_artifact(name, backend), backend, threads=threads)
@@ -0,0 +1,239 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class FetchError(ValueError):
+    """
+    Ошибка загрузки по ссылке; текст предназначен для клиента API.
+    """
+
+
+class FetchResult:
+    """
+    Результат загрузки: содержимое и валидаторы кэширования.
+    revalidated=True – сервер ответил 304 и содержимое взято из кэша.
+    """
+
+    def __init__(self, url, data, etag="", last_modified="", revalidated=False):
+        self.url = url
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.revalidated = revalidated
+
+
+class Fetcher:
+    """
+    Загрузчик входных файлов по ссылкам:
+      - отдельная requests.Session с пулом соединений на каждый хост (не больше max_hosts сессий);
+      - таймауты на соединение и чтение, повтор при сбое соединения и ответах 502/503/504;
+      - потоковое чтение кусками с ограничением max_bytes (и по Content-Length, и по факту);
+      - условные запросы: для ранее загруженных ссылок с ETag/Last-Modified отправляются
+        If-None-Match/If-Modified-Since, и при ответе 304 содержимое берётся из кэша в памяти
+        (LRU, не больше cache_bytes).
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, connect_timeout=5.0, read_timeout=30.0, max_bytes=0, pool_size=10,
+                 max_hosts=64, retries=2, cache_bytes=0, prefetch_workers=4):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+        self.pool_size = pool_size
+        self.max_hosts = max_hosts
+        self.retries = retries
+        self.cache_bytes = cache_bytes
+        self.prefetch_workers = prefetch_workers
+        self._sessions = OrderedDict()
+        self._cache = OrderedDict()
+        self._cache_size = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self.requests = 0
+        self.not_modified = 0
+
+    def session(self, url):
+        """
+        Сессия для хоста url; соединения с хостом переиспользуются между запросами.
+        """
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is not None:
+                self._sessions.move_to_end(host)
+                return session
+            session = requests.Session()
+            retry = Retry(
+                total=self.retries, connect=self.retries, read=0, backoff_factor=0.2,
+                status_forcelist=(502, 503, 504), allowed_methods=("GET", "HEAD"),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sessions[host] = session
+            while len(self._sessions) > self.max_hosts:
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.close()
+            return session
+
+    def _open(self, url, revalidate):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise FetchError("Поддерживаются только ссылки http(s).")
+        headers = {}
+        cached = None
+        if revalidate:
+            with self._lock:
+                cached = self._cache.get(url)
+            if cached is not None:
+                if cached.etag:
+                    headers["If-None-Match"] = cached.etag
+                if cached.last_modified:
+                    headers["If-Modified-Since"] = cached.last_modified
+        try:
+            response = self.session(url).get(url, headers=headers, stream=True, timeout=self.timeout)
+        except requests.Timeout:
+            raise FetchError("Превышено время ожидания ответа при скачивании.")
+        except requests.RequestException as e:
+            raise FetchError(f"Ошибка при скачивании: {str(e)}")
+        with self._lock:
+            self.requests += 1
+        return response, cached
+
+    def _check_length(self, response, max_bytes):
+        length = response.headers.get("Content-Length")
+        if max_bytes and length and length.isdigit() and int(length) > max_bytes:
+            response.close()
+            raise FetchError(f"Файл по ссылке больше допустимого размера ({max_bytes} байт).")
+
+    def _iter_body(self, response, max_bytes):
+        received = 0
+        try:
+            for chunk in response.iter_content(self.CHUNK_SIZE):
+                received += len(chunk)
+                if max_bytes and received > max_bytes:
+                    raise FetchError(f"Файл по ссылке больше допустимого размера ({max_bytes} байт).")
+                yield chunk
+        except requests.RequestException as e:
+            raise FetchError(f"Ошибка при скачивании: {str(e)}")
+        finally:
+            response.close()
+
+    def fetch(self, url, max_bytes=None, revalidate=True):
+        """
+        Загружает url в память и возвращает FetchResult.
+        Бросает FetchError при ошибке сети, таймауте, статусе, отличном от 200, и превышении max_bytes.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        response, cached = self._open(url, revalidate)
+        if response.status_code == 304 and cached is not None:
+            response.close()
+            with self._lock:
+                self.not_modified += 1
+                if url in self._cache:
+                    self._cache.move_to_end(url)
+            return FetchResult(url, cached.data, cached.etag, cached.last_modified, revalidated=True)
+        if response.status_code != 200:
+            response.close()
+            raise FetchError("Не удалось скачать файл по ссылке.")
+        self._check_length(response, max_bytes)
+        data = b"".join(self._iter_body(response, max_bytes))
+        result = FetchResult(
+            url, data,
+            etag=response.headers.get("ETag", ""),
+            last_modified=response.headers.get("Last-Modified", ""),
+        )
+        if "no-store" not in response.headers.get("Cache-Control", ""):
+            self._remember(result)
+        return result
+
+    def download(self, url, path, max_bytes=None):
+        """
+        Потоково записывает url в файл path (через временный файл), не держа содержимое в памяти.
+        Возвращает число записанных байт.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        response, _ = self._open(url, revalidate=False)
+        if response.status_code != 200:
+            response.close()
+            raise FetchError("Не удалось скачать файл по ссылке.")
+        self._check_length(response, max_bytes)
+        tmp = f"{path}.{threading.get_ident()}.part"
+        written = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in self._iter_body(response, max_bytes):
+                    f.write(chunk)
+                    written += len(chunk)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return written
+
+    def fetch_many(self, urls, max_bytes=None):
+        """
+        Загружает ссылки параллельно (prefetch_workers потоков).
+        Возвращает список FetchResult или FetchError в порядке urls.
+        """
+        if not urls:
+            return []
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix="fetch")
+        futures = [self._executor.submit(self.fetch, url, max_bytes) for url in urls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except FetchError as e:
+                results.append(e)
+        return results
+
+    def _remember(self, result):
+        if not self.cache_bytes or not (result.etag or result.last_modified):
+            return
+        size = len(result.data)
+        if size > self.cache_bytes:
+            return
+        with self._lock:
+            old = self._cache.pop(result.url, None)
+            if old is not None:
+                self._cache_size -= len(old.data)
+            self._cache[result.url] = result
+            self._cache_size += size
+            while self._cache_size > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_size -= len(evicted.data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "not_modified": self.not_modified,
+                "hosts": len(self._sessions),
+                "cached_urls": len(self._cache),
+                "cached_bytes": self._cache_size,
+            }
+
+
+fetcher = Fetcher(
+    connect_timeout=getattr(settings, 'FETCH_CONNECT_TIMEOUT', 5.0),
+    read_timeout=getattr(settings, 'FETCH_READ_TIMEOUT', 30.0),
+    max_bytes=getattr(settings, 'FETCH_MAX_BYTES', 0),
+    pool_size=getattr(settings, 'FETCH_POOL_SIZE', 10),
+    max_hosts=getattr(settings, 'FETCH_MAX_HOSTS', 64),
+    retries=getattr(settings, 'FETCH_RETRIES', 2),
+    cache_bytes=getattr(settings, 'FETCH_CACHE_BYTES', 0),
+    prefetch_workers=getattr(settings, 'FETCH_PREFETCH_WORKERS', 4),
+)
@@ -0,0 +1,401 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .columnar import columns_path
+from .fetcher import FetchError, fetcher
+from .models import Detection, DetectionHistory, VideoJob
+from . import metrics, segments, storage, yolo
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Возвращает общий пул потоков для фоновых задач по видео.
+    Размер пула задаётся VIDEO_JOB_WORKERS.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'VIDEO_JOB_WORKERS', 2),
+                thread_name_prefix="video-job",
+            )
+    return _executor
+
+
+def submit_video_job(job_id):
+    """
+    Ставит задачу с указанным id на выполнение в пул.
+    """
+    get_executor().submit(run_video_job, job_id)
+
+
+def worker_id():
+    """
+    Идентификатор текущего процесса – владельца задач (VideoJob.owner).
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class _Heartbeat:
+    """
+    Продлевает аренду задач, выполняемых в этом процессе: раз в VIDEO_JOB_HEARTBEAT_INTERVAL секунд
+    обновляет VideoJob.heartbeat_at. Отдельный поток продлевает аренду и пока видео скачивается
+    или загружается модель, когда прогресс не сохраняется.
+    """
+
+    def __init__(self):
+        self._jobs = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, job_id):
+        with self._lock:
+            self._jobs.add(job_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="video-job-heartbeat", daemon=True)
+                self._thread.start()
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.discard(job_id)
+
+    def _run(self):
+        interval = getattr(settings, 'VIDEO_JOB_HEARTBEAT_INTERVAL', 10.0)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                jobs = list(self._jobs)
+            if not jobs:
+                continue
+            close_old_connections()
+            try:
+                VideoJob.objects.filter(pk__in=jobs, owner=worker_id()).update(heartbeat_at=timezone.now())
+            except DatabaseError:
+                logger.warning("Не удалось продлить аренду задач по видео", exc_info=True)
+
+
+heartbeat = _Heartbeat()
+
+
+def resume_pending_jobs():
+    """
+    Ставит в пул этого процесса задачи из очереди и забирает задачи, брошенные другими процессами:
+    running-задачи, аренду которых не продлевали дольше VIDEO_JOB_LEASE_SECONDS, возвращаются
+    в очередь. Задачи живых процессов (несколько воркеров сервера, перезапуск одного из них)
+    не трогаются. Задачу выполняет тот процесс, который первым переведёт её в running,
+    поэтому одну и ту же задачу можно ставить в пул нескольких процессов.
+    Частичные результаты брошенной задачи убирает её новый владелец (run_video_job).
+    """
+    lease = getattr(settings, 'VIDEO_JOB_LEASE_SECONDS', 60.0)
+    expired = (Q(heartbeat_at__lt=timezone.now() - datetime.timedelta(seconds=lease))
+               | Q(heartbeat_at__isnull=True))
+    try:
+        taken_over = VideoJob.objects.filter(expired, status=VideoJob.STATUS_RUNNING).update(
+            status=VideoJob.STATUS_QUEUED, owner="", heartbeat_at=None, frames_done=0, fps=0.0, started_at=None
+        )
+        pending = list(VideoJob.objects.filter(status=VideoJob.STATUS_QUEUED).values_list('id', flat=True))
+    except DatabaseError:
+        # Миграции ещё не применены
+        logger.warning("Не удалось прочитать очередь задач по видео", exc_info=True)
+        return 0
+    for job_id in pending:
+        submit_video_job(job_id)
+    if pending:
+        logger.info("Возобновлено фоновых задач по видео: %s (из них брошенных другими процессами: %s)",
+                    len(pending), taken_over)
+    return len(pending)
+
+
+def _remove_output(record):
+    """
+    Удаляет выходное видео записи и .npz с его детекциями, оставшиеся от прерванной попытки.
+    """
+    if record.path:
+        storage.remove_media(record.path)
+        storage.remove_media(columns_path(record.path))
+
+
+def _discard_history(record):
+    """
+    Удаляет запись истории незавершённой задачи вместе с частичными детекциями и её файлами.
+    """
+    _remove_output(record)
+    if record.input_path:
+        storage.remove_media(record.input_path)
+    segments.discard(record.image_name)
+    record.delete()
+
+
+def _reset_history(record):
+    """
+    Готовит запись истории задачи, взятой заново: у сегментной обработки с сохранённым манифестом
+    запись, загруженное видео и готовые сегменты остаются (их детекции заново запишутся из файлов
+    при склейке), иначе запись удаляется вместе с частичными детекциями и файлами.
+    Выходное видео и .npz прежней попытки удаляются в обоих случаях. Возвращает запись или None.
+    """
+    if record is None:
+        return None
+    if (segments.segment_parallel_enabled() and segments.has_manifest(record.image_name)
+            and os.path.exists(os.path.join(settings.MEDIA_ROOT, record.input_path))):
+        Detection.objects.filter(history=record).delete()
+        _remove_output(record)
+        return record
+    _discard_history(record)
+    return None
+
+
+# Прямые ссылки на видеофайлы скачиваются без yt-dlp
+DIRECT_VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi')
+
+
+def ytdlp_format(target_height=0, audio=False):
+    """
+    Селектор формата yt-dlp: самый маленький поток высотой не ниже target_height, а если такого нет –
+    лучший из имеющихся (0 – всегда лучший). Без audio берутся потоки только с видео:
+    выходной ролик пишется без звука, а склейка видео и звука требует ffmpeg.
+    Если у площадки нет отдельных потоков, берётся общий файл по тем же правилам.
+    """
+    video, combined = "bv", "b"
+    if target_height:
+        video = f"wv[height>={int(target_height)}]/bv"
+        combined = f"w[height>={int(target_height)}]/b"
+    if audio:
+        video = "/".join(f"{selector}+ba" for selector in video.split("/"))
+    return f"{video}/{combined}"
+
+
+def download_video(video_url, unique_name, target_height=0):
+    """
+    Скачивает видео в MEDIA/input_video и возвращает путь к файлу.
+    Прямая ссылка на файл скачивается потоково через fetcher, страница видеохостинга – через yt-dlp
+    (поток выбирается по target_height, см. ytdlp_format; звук – только при VIDEO_DOWNLOAD_AUDIO).
+    Размер ограничен FETCH_MAX_VIDEO_BYTES.
+    """
+    input_video_path = os.path.join(settings.MEDIA_ROOT, 'input_video', unique_name)
+    max_bytes = getattr(settings, 'FETCH_MAX_VIDEO_BYTES', 0)
+    if urlparse(video_url).path.lower().endswith(DIRECT_VIDEO_EXTENSIONS):
+        try:
+            fetcher.download(video_url, input_video_path, max_bytes=max_bytes)
+        except FetchError as e:
+            raise Exception(f"Ошибка при загрузке видео: {str(e)}")
+        return input_video_path
+
+    try:
+        import yt_dlp
+    except ImportError:
+        raise Exception("Библиотека yt-dlp не установлена. Установите её: pip install yt-dlp.")
+
+    ydl_opts = {
+        'outtmpl': input_video_path,
+        'format': ytdlp_format(target_height, getattr(settings, 'VIDEO_DOWNLOAD_AUDIO', False)),
+        'quiet': True,
+        'socket_timeout': getattr(settings, 'FETCH_READ_TIMEOUT', 30.0),
+    }
+    if max_bytes:
+        ydl_opts['max_filesize'] = max_bytes
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([video_url])
+    except Exception as e:
+        raise Exception(f"Ошибка при загрузке видео через yt-dlp: {str(e)}")
+
+    if not os.path.exists(input_video_path):
+        raise Exception("Видео не было успешно загружено.")
+    return input_video_path
+
+
+def video_unique_name(video_url):
+    """
+    Уникальное имя файла для видео по ссылке.
+    """
+    from .views import generate_unique_filename
+
+    original_name = os.path.basename(urlparse(video_url).path)
+    if not original_name:
+        original_name = "video.mp4"
+    return generate_unique_filename(original_name)
+
+
+class _DetectionWriter:
+    """
+    Записывает детекции видео в таблицу Detection по мере обработки кадров
+    (для потоковой выдачи и фильтров истории; полный набор детекций – в .npz рядом с видео).
+    В памяти держится не больше DETECTION_BULK_CHUNK_SIZE ещё не записанных детекций,
+    поэтому расход памяти не зависит от длины видео.
+    """
+
+    def __init__(self, history_id, names):
+        self.history_id = history_id
+        self.names = names
+        self.chunk_size = getattr(settings, 'DETECTION_BULK_CHUNK_SIZE', 1000)
+        self.pending = []
+
+    def __call__(self, frame_idx, detections):
+        if not len(detections):
+            return
+        self.pending.extend(Detection.from_frame_detections(self.history_id, frame_idx, detections, self.names))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            Detection.objects.bulk_create(self.pending, batch_size=self.chunk_size)
+            self.pending = []
+
+
+class _ProgressReporter:
+    """
+    Сохраняет прогресс задачи в БД не чаще, чем раз в VIDEO_JOB_PROGRESS_INTERVAL секунд.
+    Если передан writer, его детекции записываются до обновления frames_done:
+    детекции всех кадров с номером меньше frames_done уже лежат в БД (на это опирается стриминг).
+    Вместе с прогрессом продлевается аренда задачи (heartbeat_at).
+    """
+
+    def __init__(self, job_id, writer=None):
+        self.job_id = job_id
+        self.writer = writer
+        self.interval = getattr(settings, 'VIDEO_JOB_PROGRESS_INTERVAL', 1.0)
+        self.started = time.monotonic()
+        self.last_saved = 0.0
+        self.frames_done = 0
+        self.frames_total = 0
+
+    def fps(self):
+        elapsed = time.monotonic() - self.started
+        return round(self.frames_done / elapsed, 2) if elapsed > 0 else 0.0
+
+    def __call__(self, frames_done, frames_total):
+        self.frames_done = frames_done
+        self.frames_total = frames_total
+        now = time.monotonic()
+        if now - self.last_saved < self.interval:
+            return
+        self.last_saved = now
+        if self.writer is not None:
+            self.writer.flush()
+        VideoJob.objects.filter(pk=self.job_id, owner=worker_id()).update(
+            frames_done=frames_done,
+            frames_total=frames_total,
+            fps=self.fps(),
+            heartbeat_at=timezone.now(),
+        )
+
+
+def run_video_job(job_id):
+    """
+    Выполняет задачу: загрузка видео, покадровая обработка YOLO, запись в DetectionHistory.
+    Исключения не пробрасываются, а сохраняются в VideoJob.error.
+    Задача выполняется, только если её удалось перевести из queued в running (она становится
+    арендой этого процесса, см. _Heartbeat); все дальнейшие записи в VideoJob идут с условием
+    на владельца, так что процесс, у которого задачу забрали, её состояние уже не меняет.
+    """
+    close_old_connections()
+    owner = worker_id()
+    owned = VideoJob.objects.filter(pk=job_id, owner=owner)
+    try:
+        now = timezone.now()
+        updated = VideoJob.objects.filter(pk=job_id, status=VideoJob.STATUS_QUEUED).update(
+            status=VideoJob.STATUS_RUNNING, started_at=now, owner=owner, heartbeat_at=now
+        )
+        if not updated:
+            # Задачу уже забрал другой поток или процесс, или она завершена
+            return
+        heartbeat.add(job_id)
+        job = VideoJob.objects.get(pk=job_id)
+
+        record = _reset_history(job.history)
+        unique_name = None
+        segmented = segments.segment_parallel_enabled()
+        try:
+            if record is not None:
+                # Продолжение прерванной сегментной обработки: видео уже загружено
+                unique_name = record.image_name
+                input_video_path = os.path.join(settings.MEDIA_ROOT, record.input_path)
+            else:
+                unique_name = video_unique_name(job.video_url)
+                with metrics.stage("video_download"):
+                    input_video_path = download_video(job.video_url, unique_name, job.target_height)
+
+            try:
+                yolo.download_model_if_not_exist(job.model_name or None)
+            except Exception as e:
+                raise Exception(f"Ошибка загрузки модели: {str(e)}")
+
+            if record is None:
+                # Запись истории создаётся до обработки: детекции пишутся в неё по ходу,
+                # и их можно читать потоком (/api/video-jobs/<job_id>/events/)
+                record = DetectionHistory.objects.create(
+                    image_name=unique_name,
+                    shape="video",
+                    classes_from_img="",
+                    path=os.path.join('output_video', unique_name),
+                    input_path=os.path.join('input_video', unique_name),
+                    source_type="video"
+                )
+                owned.update(history=record)
+
+            writer = _DetectionWriter(record.id, yolo.class_names(job.model_name or None))
+            progress = _ProgressReporter(job_id, writer)
+            video_stats = {}
+            process_video = segments.process_video_segmented if segmented else yolo.process_video_yolo10m
+            try:
+                output_filename, detected_classes, _ = process_video(
+                    input_video_path, unique_name, progress_callback=progress, stats=video_stats,
+                    frame_stride=job.frame_stride, adaptive_stride=job.adaptive_stride,
+                    model_name=job.model_name or None, on_frame=writer, decode_max_size=job.decode_max_size,
+                    inference=job.inference or None)
+            except Exception as e:
+                raise Exception(f"Ошибка обработки видео: {str(e)}")
+            writer.flush()
+        except Exception as e:
+            if not owned.exists():
+                # Задачу забрал другой процесс: запись истории и сегменты теперь его
+                return
+            if record is not None:
+                # Частичные детекции и файлы незавершённой обработки не сохраняются
+                _discard_history(record)
+            elif unique_name is not None:
+                segments.discard(unique_name)
+            owned.update(status=VideoJob.STATUS_FAILED, error=str(e), finished_at=timezone.now())
+            return
+
+        if not owned.exists():
+            logger.warning("Задачу по видео %s забрал другой процесс, результат не сохраняется", job_id)
+            return
+        DetectionHistory.objects.filter(pk=record.id).update(
+            classes_from_img=", ".join(detected_classes),
+            path=os.path.join('output_video', output_filename),
+        )
+
+        metrics.observe_video(video_stats, progress.fps())
+        owned.update(
+            status=VideoJob.STATUS_DONE,
+            frames_done=progress.frames_done,
+            # Число кадров из заголовка контейнера бывает неточным
+            frames_total=progress.frames_done,
+            fps=progress.fps(),
+            stage_timings=video_stats.get("stages", {}),
+            finished_at=timezone.now(),
+        )
+    except Exception:
+        logger.exception("Сбой фоновой задачи по видео %s", job_id)
+        owned.update(status=VideoJob.STATUS_FAILED, error="Внутренняя ошибка", finished_at=timezone.now())
+    finally:
+        heartbeat.discard(job_id)
+        connection.close()
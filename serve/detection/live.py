@@ -0,0 +1,458 @@
+import collections
+import logging
+import os
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics, yolo
+from .columnar import FrameDetections
+
+logger = logging.getLogger(__name__)
+
+# Окно для оценки скорости и задержки живого потока, кадров
+_WINDOW = 100
+
+
+class FrameGrabber:
+    """
+    Читает кадры источника в своём потоке и хранит только последний: если потребитель не успевает,
+    непрочитанный кадр заменяется новым и считается отброшенным. Так задержка не копится в очереди.
+    У каждого кадра – номер в источнике и момент появления (glass, time.monotonic()):
+      - realtime=True – воспроизведение файла с его собственной скоростью (как камера): кадр N
+        появляется в started + N / fps, это и есть момент glass;
+      - иначе – момент, когда кадр прочитан из источника (для RTSP/HTTP – приход кадра).
+    follow=True – файл, который ещё пишется: в конце файла чтение ждёт новых кадров
+    (переоткрывая файл с текущей позиции) до idle_timeout секунд без новых кадров.
+    Оборвавшийся сетевой поток переоткрывается через reconnect_delay секунд, пока не пройдёт idle_timeout.
+    """
+
+    def __init__(self, source, realtime=False, follow=False, reconnect_delay=1.0, idle_timeout=10.0):
+        self.source = source
+        self.realtime = realtime
+        self.follow = follow
+        self.reconnect_delay = reconnect_delay
+        self.idle_timeout = idle_timeout
+        self.fps = 0.0
+        self.captured = 0
+        self.dropped = 0
+        self.ended = False
+        self.error = ""
+        self._latest = None
+        self._taken = True
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="live-grabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def wait_frame(self, timeout=None):
+        """
+        Самый свежий ещё не взятый кадр (index, frame, glass) или None, если его нет за timeout
+        или источник закончился.
+        """
+        with self._cond:
+            if self._taken and not self.ended:
+                self._cond.wait(timeout)
+            if self._taken:
+                return None
+            self._taken = True
+            return self._latest
+
+    def _publish(self, index, frame, glass):
+        with self._cond:
+            if not self._taken:
+                self.dropped += 1
+            self._latest = (index, frame, glass)
+            self._taken = False
+            self.captured += 1
+            self._cond.notify_all()
+
+    def _open(self, position=0):
+        cap = cv2.VideoCapture(self.source)
+        if cap.isOpened() and position:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+        return cap
+
+    def _run(self):
+        index = 0
+        cap = None
+        started = None
+        last_frame = time.monotonic()
+        try:
+            cap = self._open()
+            if not cap.isOpened():
+                raise ValueError("Не удалось открыть источник.")
+            self.fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    if not (self.follow or self._is_stream()) or time.monotonic() - last_frame > self.idle_timeout:
+                        break
+                    # Конец растущего файла или обрыв потока: ждём и открываем заново с того же кадра
+                    cap.release()
+                    self._stop.wait(self.reconnect_delay)
+                    cap = self._open(index if self.follow else 0)
+                    continue
+                last_frame = time.monotonic()
+                if self.realtime:
+                    if started is None:
+                        started = last_frame
+                    glass = started + index / self.fps
+                    delay = glass - time.monotonic()
+                    if delay > 0 and self._stop.wait(delay):
+                        break
+                else:
+                    glass = last_frame
+                self._publish(index, frame, glass)
+                index += 1
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if cap is not None:
+                cap.release()
+            with self._cond:
+                self.ended = True
+                self._cond.notify_all()
+
+    def _is_stream(self):
+        return "://" in str(self.source)
+
+
+class _Subscription:
+    """
+    Очередь событий одного слушателя: хранит не больше maxlen последних событий,
+    медленный слушатель теряет старые, а не задерживает остальных.
+    """
+
+    def __init__(self, maxlen):
+        self.events = collections.deque(maxlen=maxlen)
+        self.cond = threading.Condition()
+
+    def put(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.events:
+                self.cond.wait(timeout)
+            return self.events.popleft() if self.events else None
+
+
+class _RollingWriter:
+    """
+    Пишет аннотированные кадры в отрезки MEDIA/live/<id>/segment_NNNNN.mp4 по segment_seconds секунд
+    источника и хранит только keep последних. Кадр повторяется, пока не придёт следующий
+    обработанный (по номерам кадров источника), поэтому отрезок идёт с реальной скоростью
+    даже при отброшенных кадрах.
+    """
+
+    def __init__(self, directory, fps, segment_seconds, keep):
+        self.directory = directory
+        self.fps = fps
+        self.segment_frames = max(1, round(fps * segment_seconds))
+        self.keep = max(1, keep)
+        self.writer = None
+        self.path = None
+        self.written = 0
+        self.number = 0
+        self.last_index = None
+        self.finished = collections.deque()
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, index, frame):
+        """
+        Возвращает путь завершённого отрезка, если он закрылся на этом кадре.
+        """
+        repeats = 1 if self.last_index is None else max(1, min(index - self.last_index, self.segment_frames))
+        self.last_index = index
+        closed = None
+        for _ in range(repeats):
+            if self.writer is None:
+                height, width = frame.shape[:2]
+                self.path = os.path.join(self.directory, f"segment_{self.number:05d}.mp4")
+                self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*"mp4v"), self.fps, (width, height))
+                self.number += 1
+            self.writer.write(frame)
+            self.written += 1
+            if self.written >= self.segment_frames:
+                closed = self._close()
+        return closed
+
+    def _close(self):
+        self.writer.release()
+        self.writer = None
+        self.written = 0
+        self.finished.append(self.path)
+        while len(self.finished) > self.keep:
+            try:
+                os.remove(self.finished.popleft())
+            except FileNotFoundError:
+                pass
+        return self.path
+
+    def close(self):
+        if self.writer is not None:
+            return self._close()
+        return None
+
+
+class LiveSession:
+    """
+    Детекция на непрерывном источнике (RTSP/HTTP-поток, растущий или воспроизводимый файл)
+    с ограниченной задержкой: FrameGrabber держит только последний кадр, поток инференса
+    всегда берёт самый свежий, устаревшие отбрасываются. Детекции каждого обработанного кадра
+    сразу публикуются слушателям (subscribe) и в on_result(event); при segment_seconds > 0
+    аннотированные кадры пишутся в скользящие отрезки (MEDIA/live/<id>/, хранятся keep_segments последних).
+    inference – параметры инференса запроса (imgsz, conf, iou, classes, max_det, см. yolo.resolve_inference);
+    аргументы модели вычисляются один раз на размер кадра.
+    stats(): скорость обработки, доля отброшенных кадров, задержка glass-to-result
+    (от появления кадра в источнике до публикации его детекций).
+    """
+
+    def __init__(self, source, model_name=None, realtime=False, follow=False, segment_seconds=0.0,
+                 keep_segments=None, max_size=None, on_result=None, idle_timeout=None, inference=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.model_name = model_name
+        self.inference = inference
+        self._options = {}
+        self.segment_seconds = segment_seconds
+        self.keep_segments = keep_segments or getattr(settings, 'LIVE_KEEP_SEGMENTS', 6)
+        self.max_size = getattr(settings, 'LIVE_DECODE_MAX_SIZE', 1280) if max_size is None else max_size
+        self.on_result = on_result
+        self.grabber = FrameGrabber(
+            source, realtime=realtime, follow=follow,
+            reconnect_delay=getattr(settings, 'LIVE_RECONNECT_DELAY', 1.0),
+            idle_timeout=getattr(settings, 'LIVE_IDLE_TIMEOUT', 10.0) if idle_timeout is None else idle_timeout,
+        )
+        self.status = "starting"
+        self.error = ""
+        self.started_at = timezone.now()
+        self.processed = 0
+        self.segments = []
+        self._done_times = collections.deque(maxlen=_WINDOW)
+        self._latencies = collections.deque(maxlen=_WINDOW)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.grabber.start()
+        self._thread = threading.Thread(target=self._run, name=f"live-{self.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self.grabber.stop()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wait(self, timeout=None):
+        """
+        Ждёт окончания источника (или остановки); True, если сессия завершилась.
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def subscribe(self):
+        subscription = _Subscription(getattr(settings, 'LIVE_SUBSCRIBER_BUFFER', 32))
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def finished(self):
+        return self.status in ("ended", "stopped", "failed")
+
+    def stats(self):
+        latencies = np.array(self._latencies, dtype=np.float64) * 1000
+        done_times = list(self._done_times)
+        fps = (len(done_times) - 1) / (done_times[-1] - done_times[0]) if len(done_times) > 1 and done_times[-1] > done_times[0] else 0.0
+        captured, dropped = self.grabber.captured, self.grabber.dropped
+        return {
+            "stream_id": self.id,
+            "source": self.source,
+            "status": self.status,
+            "error": self.error,
+            "started_at": self.started_at.isoformat(),
+            "source_fps": round(self.grabber.fps, 2),
+            "fps": round(fps, 2),
+            "frames_captured": captured,
+            "frames_processed": self.processed,
+            "frames_dropped": dropped,
+            "drop_rate": round(dropped / captured, 4) if captured else 0.0,
+            "latency_ms": {
+                "p50": round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+                "p95": round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None,
+                "max": round(float(latencies.max()), 2) if len(latencies) else None,
+            },
+            "segments": list(self.segments),
+        }
+
+    def _publish(self, event):
+        if self.on_result is not None:
+            self.on_result(event)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def _run(self):
+        writer = None
+        self.status = "running"
+        try:
+            names = yolo.class_names(self.model_name)
+            while not self._stop.is_set():
+                item = self.grabber.wait_frame(timeout=0.5)
+                if item is None:
+                    if self.grabber.ended:
+                        break
+                    continue
+                index, frame, glass = item
+                source_size = frame.shape[1::-1]
+                if self.max_size and max(source_size) > self.max_size:
+                    scale = self.max_size / max(source_size)
+                    frame = cv2.resize(frame, (max(1, round(source_size[0] * scale)), max(1, round(source_size[1] * scale))),
+                                       interpolation=cv2.INTER_AREA)
+                with metrics.stage("infer"):
+                    result = yolo._predict([frame], self.model_name, self._frame_options(frame))[0]
+                detections = FrameDetections.from_result(result)
+                if frame.shape[1::-1] != source_size:
+                    detections = detections.scaled(source_size[0] / frame.shape[1], source_size[1] / frame.shape[0])
+
+                now = time.monotonic()
+                latency = now - glass
+                self.processed += 1
+                self._done_times.append(now)
+                self._latencies.append(latency)
+                metrics.LIVE_LATENCY_SECONDS.observe(latency)
+                self._publish({
+                    "event": "frame",
+                    "frame": index,
+                    "latency_ms": round(latency * 1000, 2),
+                    "detections": detections.to_details(names),
+                })
+
+                if self.segment_seconds:
+                    if writer is None:
+                        writer = _RollingWriter(os.path.join(settings.MEDIA_ROOT, 'live', self.id),
+                                                self.grabber.fps, self.segment_seconds, self.keep_segments)
+                    with metrics.stage("annotate"):
+                        annotated = result.plot()
+                    with metrics.stage("encode"):
+                        closed = writer.write(index, annotated)
+                    if closed:
+                        self._segment_closed(closed, writer)
+            if writer is not None:
+                closed = writer.close()
+                if closed:
+                    self._segment_closed(closed, writer)
+            if self.grabber.error:
+                raise ValueError(self.grabber.error)
+            self.status = "stopped" if self._stop.is_set() else "ended"
+        except Exception as e:
+            logger.exception("Сбой живого потока %s", self.id)
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.grabber.stop()
+            self._publish({"event": self.status, **({"error": self.error} if self.error else {})})
+
+    def _frame_options(self, frame):
+        """
+        Аргументы вызова модели для кадра: imgsz="auto" зависит от размера кадра,
+        который у потока почти не меняется, поэтому они запоминаются по размеру.
+        """
+        height, width = frame.shape[:2]
+        options = self._options.get((width, height))
+        if options is None:
+            options = self._options[(width, height)] = yolo.resolve_inference(
+                self.inference, width, height, self.model_name)
+        return options
+
+    def _segment_closed(self, path, writer):
+        relative = os.path.relpath(path, settings.MEDIA_ROOT)
+        self.segments = [os.path.relpath(p, settings.MEDIA_ROOT) for p in writer.finished]
+        self._publish({"event": "segment", "path": relative})
+
+
+sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def start_session(source, **kwargs):
+    """
+    Запускает живой поток и регистрирует его в процессе (не больше LIVE_MAX_STREAMS одновременно).
+    Сессии живут в памяти процесса, который их запустил. Режимы realtime и follow (воспроизводимый
+    или растущий локальный файл) доступны только из кода: API принимает лишь сетевые адреса
+    (LIVE_ALLOWED_SCHEMES), чтобы клиент не мог читать файлы сервера.
+    """
+    with _sessions_lock:
+        for session_id, session in list(sessions.items()):
+            if session.finished():
+                del sessions[session_id]
+        if len(sessions) >= getattr(settings, 'LIVE_MAX_STREAMS', 4):
+            raise ValueError("Достигнуто максимальное число живых потоков.")
+        session = LiveSession(source, **kwargs)
+        sessions[session.id] = session
+    return session.start()
+
+
+def stop_session(session_id):
+    session = sessions.get(session_id)
+    if session is not None:
+        session.stop()
+    return session
+
+
+def iter_events(session, keepalive=None, max_seconds=None):
+    """
+    События живого потока для слушателя: frame, segment и последним – ended / stopped / failed;
+    None – keep-alive, если событий нет keepalive секунд. Слушатель подключён не дольше
+    max_seconds (VIDEO_STREAM_MAX_SECONDS, 0 – без ограничения): затем последним приходит
+    {"event": "timeout"}, и клиент переподключается (сессия при этом продолжает работать).
+    """
+    keepalive = keepalive or getattr(settings, 'VIDEO_STREAM_KEEPALIVE', 15.0)
+    if max_seconds is None:
+        max_seconds = getattr(settings, 'VIDEO_STREAM_MAX_SECONDS', 600)
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    subscription = session.subscribe()
+    try:
+        while True:
+            timeout = keepalive if deadline is None else max(0.0, min(keepalive, deadline - time.monotonic()))
+            event = subscription.get(timeout=timeout)
+            if deadline is not None and time.monotonic() >= deadline and (event is None or event["event"] == "frame"):
+                yield {"event": "timeout"}
+                return
+            if event is None:
+                if session.finished():
+                    return
+                yield None
+                continue
+            yield event
+            if event["event"] in ("ended", "stopped", "failed"):
+                return
+    finally:
+        session.unsubscribe(subscription)
@@ -0,0 +1,59 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from detection import engines
+
+
+class Command(BaseCommand):
+    help = "Сравнивает задержку и пропускную способность движков инференса (torch/onnx/openvino) на CPU"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default='yolov10m.pt', help="Веса модели")
+        parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'], choices=engines.BACKENDS)
+        parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4])
+        parser.add_argument('--runs', type=int, default=20, help="Число замеров на конфигурацию")
+        parser.add_argument('--size', default='640x480', help="Размер синтетического кадра WxH")
+        parser.add_argument('--output', help="Сохранить результаты в JSON")
+
+    def handle(self, *args, **options):
+        try:
+            width, height = (int(v) for v in options['size'].lower().split('x'))
+        except ValueError:
+            raise CommandError("--size должен быть в формате WxH")
+        rng = np.random.default_rng(0)
+        frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+
+        report = []
+        for backend in options['backends']:
+            started = time.perf_counter()
+            model = engines.load_model(options['model'], backend)
+            load_s = time.perf_counter() - started
+            for batch_size in options['batch_sizes']:
+                batch = [frame] * batch_size
+                model(batch, verbose=False)  # прогрев
+                latencies = []
+                for _ in range(options['runs']):
+                    t0 = time.perf_counter()
+                    model(batch, verbose=False)
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                latencies = np.array(latencies)
+                row = {
+                    "backend": backend,
+                    "batch_size": batch_size,
+                    "load_s": round(load_s, 3),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                    "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+                    "images_per_s": round(batch_size * 1000 / float(latencies.mean()), 2),
+                }
+                report.append(row)
+                self.stdout.write(
+                    f"{backend:9} batch={batch_size:<3} p50={row['p50_ms']:8.2f} ms  "
+                    f"p95={row['p95_ms']:8.2f} ms  {row['images_per_s']:7.2f} img/s"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
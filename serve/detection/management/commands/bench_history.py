@@ -0,0 +1,139 @@
+import base64
+import datetime
+import json
+import random
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from detection.models import Detection, DetectionHistory
+
+CLASSES = ["person", "car", "dog", "cat", "bicycle", "bus", "truck", "bird"]
+
+
+def cursor_at(moment):
+    """
+    Курсор DRF CursorPagination, указывающий на позицию moment (как в ссылке next).
+    """
+    querystring = urlencode({"p": str(moment)})
+    return base64.b64encode(querystring.encode("ascii")).decode("ascii")
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет временную тестовую БД записями истории и замеряет время страницы /api/history/ "
+        "на разной глубине: курсорная пагинация против OFFSET"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help="Число записей DetectionHistory")
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--runs', type=int, default=20, help="Число замеров на точку")
+        parser.add_argument('--output', help="Сохранить результаты в JSON")
+
+    def handle(self, *args, **options):
+        # Основная БД не трогается: все данные пишутся во временную тестовую БД
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = self._run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    def _run(self, options):
+        rows = options['rows']
+        started = time.perf_counter()
+        newest = self._seed(rows)
+        self.stdout.write(f"Создано {rows} записей за {time.perf_counter() - started:.1f} c")
+
+        client = Client()
+        url = reverse('history')
+        page_size = options['page_size']
+        queryset = DetectionHistory.objects.defer('detailed_results').order_by('-datetime_input', '-id')
+        report = []
+        for depth in sorted({0, rows // 100, rows // 10, rows // 2, rows - page_size}):
+            if depth < 0:
+                continue
+            # Позиция курсора на глубине depth: записи идут с шагом в 1 секунду
+            position = newest - datetime.timedelta(seconds=depth)
+            cursor = {} if depth == 0 else {"cursor": cursor_at(position)}
+            row = {"depth": depth}
+            for name, params in (
+                ("cursor", {"page_size": page_size, **cursor}),
+                ("cursor_class", {"page_size": page_size, "class": "dog", **cursor}),
+            ):
+                row[f"{name}_p50_ms"], row[f"{name}_p95_ms"] = self._measure(
+                    lambda: client.get(url, params), options['runs'])
+            # Те же страницы одним SQL-запросом: условие по индексу против OFFSET
+            row["keyset_sql_p50_ms"], row["keyset_sql_p95_ms"] = self._measure(
+                lambda: list(queryset.filter(datetime_input__lt=position)[:page_size]), options['runs'])
+            row["offset_sql_p50_ms"], row["offset_sql_p95_ms"] = self._measure(
+                lambda: list(queryset[depth:depth + page_size]), options['runs'])
+            report.append(row)
+            self.stdout.write(
+                f"глубина={depth:<9} cursor p50={row['cursor_p50_ms']:7.2f} мс  "
+                f"cursor+class p50={row['cursor_class_p50_ms']:7.2f} мс  "
+                f"SQL keyset p50={row['keyset_sql_p50_ms']:6.2f} мс  OFFSET p50={row['offset_sql_p50_ms']:8.2f} мс"
+            )
+        return report
+
+    def _measure(self, call, runs):
+        call()
+        latencies = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            response = call()
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if getattr(response, 'status_code', 200) != 200:
+                raise RuntimeError(f"Ответ {response.status_code}: {response.content[:200]!r}")
+        latencies = np.array(latencies)
+        return round(float(np.percentile(latencies, 50)), 2), round(float(np.percentile(latencies, 95)), 2)
+
+    def _seed(self, rows, chunk_size=20_000):
+        """
+        Быстрое заполнение через executemany: по записи в секунду в прошлое от текущего момента,
+        у каждой записи 1-3 детекции. Возвращает время самой новой записи.
+        """
+        rng = random.Random(0)
+        newest = timezone.now()
+        history_table = DetectionHistory._meta.db_table
+        detection_table = Detection._meta.db_table
+        with connection.cursor() as cursor:
+            for start in range(0, rows, chunk_size):
+                ids = range(start + 1, min(start + chunk_size, rows) + 1)
+                history = []
+                detections = []
+                for pk in ids:
+                    moment = newest - datetime.timedelta(seconds=pk - 1)
+                    found = rng.sample(CLASSES, rng.randint(1, 3))
+                    history.append((
+                        pk, f"{pk:08x}_file.jpg", connection.ops.adapt_datetimefield_value(moment), "640x480", ", ".join(found),
+                        f"output_img/{pk:08x}_file.jpg", f"input_img/{pk:08x}_file.jpg",
+                        rng.choice(("url", "file")), "", "",
+                    ))
+                    detections.extend(
+                        (pk, name, round(rng.random(), 3), 10.0, 10.0, 100.0, 100.0, False) for name in found
+                    )
+                cursor.executemany(
+                    f"INSERT INTO {history_table} (id, image_name, datetime_input, shape, classes_from_img, path, "
+                    f"input_path, source_type, detailed_results, content_hash) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    history,
+                )
+                cursor.executemany(
+                    f"INSERT INTO {detection_table} (history_id, class_name, confidence, x1, y1, x2, y2, interpolated) "
+                    f"VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                    detections,
+                )
+            cursor.execute("ANALYZE")
+        return newest
@@ -0,0 +1,206 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from detection import benchmark, storage, yolo
+from detection.registry import registry
+from detection.workers import WorkerPool
+
+
+def parse_sizes(value):
+    """
+    "640x480,1920x1080" -> [(640, 480), (1920, 1080)].
+    """
+    sizes = []
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        try:
+            width, height = (int(v) for v in item.lower().split('x'))
+        except ValueError:
+            raise CommandError(f"Неверный размер {item!r}, ожидается WxH.")
+        sizes.append((width, height))
+    return sizes
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарк обработки: yolo.py напрямую и эндпоинты process-image / process-video "
+        "на синтетических изображениях и видео разных размеров (в том числе при разном размере входа модели), пул процессов инференса на 1..N процессах, "
+        "запись истории в БД (групповая и прямая) при разном числе параллельных запросов. "
+        "Модель – детерминированная заглушка (по умолчанию) или настоящие веса. "
+        "Отчёт: p50/p95/p99, throughput, пиковая память, "
+        "время стадий; --output сохраняет JSON, --compare сравнивает с прошлым прогоном"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default='stub',
+                            help="stub – детерминированная заглушка, иначе имя весов из YOLO_MODELS")
+        parser.add_argument('--scenarios', default=','.join(benchmark.SCENARIOS),
+                            help=f"Через запятую: {', '.join(benchmark.SCENARIOS)}")
+        parser.add_argument('--image-sizes', default='640x480,1920x1080,4000x3000')
+        parser.add_argument('--video-sizes', default='640x360,1280x720')
+        parser.add_argument('--video-frames', type=int, default=60)
+        parser.add_argument('--runs', type=int, default=30, help="Замеров на сценарий с изображениями")
+        parser.add_argument('--video-runs', type=int, default=3, help="Замеров на сценарий с видео")
+        parser.add_argument('--concurrency', default='1,4', help="Число параллельных запросов (через запятую)")
+        parser.add_argument('--batch-size', type=int, default=8, help="Размер пачки для yolo_batch")
+        parser.add_argument('--imgsz', default='320,480,640,auto',
+                            help="Размеры входа модели для yolo_imgsz (через запятую; auto – автоматический выбор)")
+        parser.add_argument('--workers', default='1,2,4', help="Размеры пула процессов для pool_image (через запятую)")
+        parser.add_argument('--write-runs', type=int, default=500, help="Записей истории на сценарий db_write")
+        parser.add_argument('--stub-boxes', type=int, default=5, help="Боксов на кадр у заглушки")
+        parser.add_argument('--stub-batch-ms', type=float, default=5.0, help="Пауза заглушки на проход модели, мс")
+        parser.add_argument('--stub-frame-ms', type=float, default=2.0, help="Пауза заглушки на кадр, мс")
+        parser.add_argument('--stub-cpu-ms', type=float, default=0.0,
+                            help="Вычисления заглушки на кадр с захватом GIL, мс")
+        parser.add_argument('--output', help="Сохранить отчёт в JSON")
+        parser.add_argument('--compare', help="JSON прошлого прогона: сообщить о регрессиях и завершиться с ошибкой")
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help="Допустимое ухудшение p50/p95/throughput при --compare (доля)")
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+        model_name = None
+        if options['model'] == 'stub':
+            # Заглушка подменяет модель по умолчанию: запросы без поля model попадают в неё
+            registry.register(yolo.MODEL_NAME, benchmark.StubModel(**self._stub_options(options)))
+        else:
+            model_name = options['model']
+            registry.get(model_name)
+
+        # Основная БД и MEDIA не трогаются: временная тестовая БД и временный каталог
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as media_root:
+            if connection.vendor == 'sqlite':
+                # Тестовая БД SQLite по умолчанию в памяти с общим кэшем: параллельные запросы
+                # получают "database table is locked" вместо ожидания, поэтому – файл
+                connection.settings_dict['TEST']['NAME'] = os.path.join(media_root, 'bench.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                for subdir in ('input_img', 'output_img', 'input_video', 'output_video'):
+                    os.makedirs(os.path.join(media_root, subdir))
+                with override_settings(MEDIA_ROOT=media_root, RESULT_CACHE_ENABLED=False):
+                    results = self._run(scenarios, model_name, media_root, options)
+                    storage.wait_pending()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "model": options['model'],
+            "environment": benchmark.environment(),
+            "options": {key: options[key] for key in (
+                'scenarios', 'image_sizes', 'video_sizes', 'video_frames', 'runs', 'video_runs',
+                'concurrency', 'batch_size', 'imgsz', 'workers', 'write_runs', 'stub_boxes', 'stub_batch_ms', 'stub_frame_ms', 'stub_cpu_ms',
+            )},
+            "results": results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Отчёт сохранён в {options['output']}")
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = benchmark.compare(report, baseline, options['threshold'])
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(f"Регрессия: {line}"))
+            if regressions:
+                raise CommandError(f"Найдено регрессий: {len(regressions)}")
+            self.stdout.write(self.style.SUCCESS("Регрессий нет"))
+
+    @staticmethod
+    def _stub_options(options):
+        return {
+            "boxes_per_frame": options['stub_boxes'],
+            "batch_ms": options['stub_batch_ms'],
+            "frame_ms": options['stub_frame_ms'],
+            "cpu_ms": options['stub_cpu_ms'],
+        }
+
+    def _run(self, scenarios, model_name, media_root, options):
+        image_sizes = parse_sizes(options['image_sizes'])
+        video_sizes = parse_sizes(options['video_sizes'])
+        concurrency = [int(v) for v in options['concurrency'].split(',') if v.strip()]
+        runs, video_runs, frames = options['runs'], options['video_runs'], options['video_frames']
+        results = []
+
+        def record(scenario, params, measured):
+            entry = {"scenario": scenario, "params": params, **measured}
+            results.append(entry)
+            latency = measured["latency_ms"]
+            self.stdout.write(
+                f"{benchmark.scenario_key(entry):<45} p50={latency['p50']:9.2f}  p95={latency['p95']:9.2f}  "
+                f"p99={latency['p99']:9.2f} мс  {measured['throughput_per_s']:8.2f}/с  "
+                f"RSS +{measured['peak_rss_mb']} МБ  alloc {measured['peak_traced_mb']} МБ"
+            )
+
+        for width, height in image_sizes:
+            size = f"{width}x{height}"
+            for workers in concurrency:
+                if "yolo_image" in scenarios:
+                    record("yolo_image", f"{size} c={workers}",
+                           benchmark.bench_yolo_image(width, height, runs, workers, model_name))
+                if "api_image" in scenarios:
+                    record("api_image", f"{size} c={workers}",
+                           benchmark.bench_api_image(width, height, runs, workers, model_name))
+            if "yolo_imgsz" in scenarios:
+                with override_settings(YOLO_SCHEDULER_ENABLED=False):
+                    for imgsz in [v.strip() for v in options['imgsz'].split(',') if v.strip()]:
+                        record("yolo_imgsz", f"{size} imgsz={imgsz}", benchmark.bench_yolo_imgsz(
+                            width, height, runs, imgsz if imgsz == "auto" else int(imgsz), model_name))
+            if "yolo_batch" in scenarios:
+                batch_size = options['batch_size']
+                record("yolo_batch", f"{size} b={batch_size}",
+                       benchmark.bench_yolo_batch(width, height, max(1, runs // batch_size), batch_size, model_name))
+
+        if "pool_image" in scenarios:
+            if model_name is None:
+                pool_options = {"loader": "detection.benchmark.stub_loader", "loader_kwargs": self._stub_options(options)}
+            else:
+                pool_options = {}
+            for workers in [int(v) for v in options['workers'].split(',') if v.strip()]:
+                # Процесс на ядро с одним потоком: масштабирование по процессам, а не по потокам
+                pool = WorkerPool(model_name or yolo.MODEL_NAME, workers=workers, threads=1, **pool_options).start()
+                try:
+                    for width, height in image_sizes:
+                        record("pool_image", f"{width}x{height} w={workers}",
+                               benchmark.bench_worker_pool(pool, width, height, runs))
+                finally:
+                    pool.stop()
+
+        if "db_write" in scenarios:
+            for workers in concurrency:
+                for group_commit in (True, False):
+                    with override_settings(HISTORY_WRITE_GROUP_COMMIT=group_commit):
+                        record("db_write", f"c={workers} {'group' if group_commit else 'direct'}",
+                               benchmark.bench_db_write(options['write_runs'], workers))
+
+        if not {"yolo_video", "api_video"} & set(scenarios):
+            return results
+        sources = os.path.join(media_root, 'bench_sources')
+        os.makedirs(sources)
+        with benchmark.MediaServer(sources) as server:
+            for width, height in video_sizes:
+                size = f"{width}x{height}"
+                name = f"bench_{size}.mp4"
+                path = benchmark.synthetic_video(os.path.join(sources, name), width, height, frames)
+                if "yolo_video" in scenarios:
+                    record("yolo_video", f"{size} n={frames}",
+                           benchmark.bench_yolo_video(path, video_runs, frames, model_name))
+                if "api_video" in scenarios:
+                    record("api_video", f"{size} n={frames}",
+                           benchmark.bench_api_video(server.url(name), video_runs, frames, model_name))
+        return results
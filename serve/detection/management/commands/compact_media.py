@@ -0,0 +1,145 @@
+import datetime
+import os
+
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from detection import storage
+from detection.models import DetectionHistory
+
+ACTIONS = ("reencode", "delete", "keep")
+VIDEO_DIRS = ("input_video", "output_video")
+
+
+def format_bytes(value):
+    return f"{value / 2 ** 20:.1f} МБ"
+
+
+class Command(BaseCommand):
+    help = (
+        "Сжимает MEDIA: файлы записей истории старше срока хранения перекодируются (или удаляются), "
+        "пути в DetectionHistory.path / input_path обновляются. Можно запускать на работающем сервере: "
+        "новые файлы пишутся атомарно, путь меняется условным UPDATE, старый файл удаляется после него "
+        "и только если на него не ссылаются другие записи"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=getattr(settings, 'MEDIA_RETENTION_DAYS', 30),
+                            help="Обрабатывать записи старше стольких дней")
+        parser.add_argument('--outputs', choices=ACTIONS, default="reencode",
+                            help="Аннотированные изображения (path); удалённые отрисовываются по запросу из исходных")
+        parser.add_argument('--inputs', choices=ACTIONS, default="reencode",
+                            help="Исходные изображения (input_path); перекодируются без уменьшения, "
+                                 "чтобы боксы совпадали при отрисовке")
+        parser.add_argument('--videos', choices=("delete", "keep"), default="keep",
+                            help="Входные и выходные видео (детекции .npz не удаляются)")
+        parser.add_argument('--format', choices=list(storage.IMAGE_FORMATS),
+                            default=getattr(settings, 'MEDIA_COMPACT_FORMAT', "webp"))
+        parser.add_argument('--quality', type=int, default=getattr(settings, 'MEDIA_COMPACT_QUALITY', 75))
+        parser.add_argument('--max-size', type=int, default=getattr(settings, 'MEDIA_COMPACT_MAX_SIZE', 1280),
+                            help="Длинная сторона аннотированных изображений, px (0 – без изменения)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Записей, читаемых из БД за раз")
+        parser.add_argument('--dry-run', action='store_true', help="Только подсчитать, ничего не меняя")
+
+    def handle(self, *args, **options):
+        if not 1 <= options['quality'] <= 100:
+            raise CommandError("--quality должен быть от 1 до 100.")
+        self.options = options
+        self.counts = {}
+        self.reclaimed = {}
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        queryset = (DetectionHistory.objects
+                    .filter(datetime_input__lt=cutoff)
+                    .exclude(path="", input_path="")
+                    .only('id', 'path', 'input_path')
+                    .order_by('id'))
+
+        for record in queryset.iterator(chunk_size=options['batch_size']):
+            for field, action in (("path", options['outputs']), ("input_path", options['inputs'])):
+                relative = getattr(record, field)
+                if not relative:
+                    continue
+                if relative.split(os.sep)[0] in VIDEO_DIRS:
+                    action = options['videos']
+                if action == "keep":
+                    continue
+                try:
+                    if action == "delete":
+                        self._delete(record, field, relative)
+                    else:
+                        self._reencode(record, field, relative)
+                except Exception as e:
+                    self._count("errors")
+                    self.stderr.write(f"Запись {record.id}, {relative}: {e}")
+
+        prefix = "[dry-run] " if options['dry_run'] else ""
+        for name, title in (("reencoded", "Перекодировано"), ("deleted", "Удалено")):
+            self.stdout.write(f"{prefix}{title}: {self.counts.get(name, 0)} файлов, "
+                              f"освобождено {format_bytes(self.reclaimed.get(name, 0))}")
+        self.stdout.write(
+            f"{prefix}Пропущено: уже компактнее {self.counts.get('kept', 0)}, нет файла {self.counts.get('missing', 0)}, "
+            f"изменены параллельно {self.counts.get('changed', 0)}, ошибок {self.counts.get('errors', 0)}"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Всего освобождено {format_bytes(sum(self.reclaimed.values()))} "
+            f"({sum(self.reclaimed.values())} байт)"
+        ))
+
+    def _count(self, name, reclaimed=0):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if reclaimed:
+            self.reclaimed[name] = self.reclaimed.get(name, 0) + reclaimed
+
+    def _reencode(self, record, field, relative):
+        absolute = os.path.join(settings.MEDIA_ROOT, relative)
+        try:
+            old_size = os.path.getsize(absolute)
+        except OSError:
+            self._count("missing")
+            return
+        frame = cv2.imread(absolute, cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("не удалось прочитать изображение")
+        data, extension = storage.encode_image(
+            frame, self.options['format'], self.options['quality'],
+            self.options['max_size'] if field == "path" else 0,
+        )
+        if len(data) >= old_size:
+            self._count("kept")
+            return
+
+        new_relative = os.path.splitext(relative)[0] + extension
+        if not self.options['dry_run']:
+            # Новый файл появляется атомарно; при том же имени – подменяет старый (os.replace)
+            storage.write_file(os.path.join(settings.MEDIA_ROOT, new_relative), data)
+            if new_relative != relative and not self._replace_path(record, field, relative, new_relative):
+                os.remove(os.path.join(settings.MEDIA_ROOT, new_relative))
+                self._count("changed")
+                return
+        self._count("reencoded", old_size - len(data))
+
+    def _delete(self, record, field, relative):
+        absolute = os.path.join(settings.MEDIA_ROOT, relative)
+        size = os.path.getsize(absolute) if os.path.exists(absolute) else 0
+        if not self.options['dry_run'] and not self._replace_path(record, field, relative, ""):
+            self._count("changed")
+            return
+        self._count("deleted", size)
+
+    def _replace_path(self, record, field, old, new):
+        """
+        Меняет путь в записи, только если он не изменился с момента чтения, и удаляет старый файл,
+        если на него больше никто не ссылается. Возвращает False, если запись изменилась.
+        """
+        updated = DetectionHistory.objects.filter(pk=record.pk, **{field: old}).update(**{field: new})
+        if not updated:
+            return False
+        if not DetectionHistory.objects.filter(Q(path=old) | Q(input_path=old)).exists():
+            try:
+                os.remove(os.path.join(settings.MEDIA_ROOT, old))
+            except FileNotFoundError:
+                pass
+        return True
@@ -0,0 +1,301 @@
+import bisect
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительностей, сек
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+FPS_BUCKETS = (1, 2, 5, 10, 15, 20, 25, 30, 45, 60, 90, 120, 240)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Стадии текущего запроса {имя: (сумма секунд, число вызовов)} для заголовка Server-Timing
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Гистограмма в формате Prometheus: счётчики по корзинам buckets, сумма и число наблюдений
+    для каждого набора значений меток labelnames.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        # Наблюдение попадает в первую корзину с границей le >= value (последняя – +Inf)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(key, dict(s, buckets=list(s["buckets"]))) for key, s in sorted(self._series.items())]
+        for key, data in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data["buckets"]):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(float(bound)))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(data['sum'])}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {data['count']}"
+
+
+class Gauge:
+    """
+    Мгновенное значение. Значения вычисляются при каждом запросе /metrics функцией
+    callback() -> [(словарь меток, значение), ...]: так показатели вроде глубины очереди
+    не нужно обновлять в коде, который их меняет.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        try:
+            samples = list(self.callback())
+        except Exception:
+            logger.warning("Не удалось вычислить метрику %s", self.name, exc_info=True)
+            return
+        for labels, value in samples:
+            key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+STAGE_SECONDS = Histogram(
+    "detection_stage_seconds",
+    "Длительность стадии обработки (download, decode, infer, annotate, encode, db_insert, db_flush, ...), сек",
+    labelnames=("stage",),
+)
+REQUEST_SECONDS = Histogram(
+    "detection_request_seconds",
+    "Длительность HTTP-запроса по эндпоинту и коду ответа, сек",
+    labelnames=("view", "status"),
+)
+VIDEO_STAGE_SECONDS = Histogram(
+    "detection_video_stage_seconds",
+    "Время работы стадии конвейера видео за задачу (decode, infer, annotate, encode), сек",
+    labelnames=("stage",),
+)
+LIVE_LATENCY_SECONDS = Histogram(
+    "detection_live_latency_seconds",
+    "Задержка живого потока от появления кадра в источнике до публикации его детекций, сек",
+)
+VIDEO_FPS = Histogram(
+    "detection_video_fps",
+    "Скорость обработки завершённых задач по видео, кадров в секунду",
+    buckets=FPS_BUCKETS,
+)
+
+
+def _inference_queue_depth():
+    from . import yolo
+    return [({"model": name}, scheduler.qsize()) for name, scheduler in list(yolo.schedulers.items())]
+
+
+def _video_jobs():
+    from .models import VideoJob
+    try:
+        return [
+            ({"status": status}, VideoJob.objects.filter(status=status).count())
+            for status in (VideoJob.STATUS_QUEUED, VideoJob.STATUS_RUNNING)
+        ]
+    except DatabaseError:
+        return []
+
+
+def _worker_pools():
+    from . import workers
+    samples = []
+    for name, pool in list(workers.pools.items()):
+        for worker in pool.stats()["workers"]:
+            samples.append(({"model": name, "worker": worker["index"], "state": worker["state"]}, 1))
+    return samples
+
+
+def _worker_restarts():
+    from . import workers
+    return [({"model": name}, pool.stats()["restarts"]) for name, pool in list(workers.pools.items())]
+
+
+def _history_write_queue():
+    from . import persistence
+    return [({}, persistence.pending_writes())]
+
+
+def _live_streams(field):
+    def callback():
+        from . import live
+        samples = []
+        for session in list(live.sessions.values()):
+            stats = session.stats()
+            if stats["status"] == "running":
+                samples.append(({"stream": stats["stream_id"]}, stats[field]))
+        return samples
+    return callback
+
+
+def _model_stat(field):
+    def callback():
+        from .registry import registry
+        return [({"model": model["name"]}, model[field]) for model in registry.stats()["models"]]
+    return callback
+
+
+METRICS = [
+    STAGE_SECONDS,
+    REQUEST_SECONDS,
+    VIDEO_STAGE_SECONDS,
+    VIDEO_FPS,
+    LIVE_LATENCY_SECONDS,
+    Gauge("detection_inference_queue_depth", "Кадров в очереди планировщика инференса",
+          labelnames=("model",), callback=_inference_queue_depth),
+    Gauge("detection_video_jobs", "Задачи по видео в очереди и в работе", labelnames=("status",), callback=_video_jobs),
+    Gauge("detection_worker_pool_workers", "Процессы пула инференса и их состояние (idle, busy, starting, broken)",
+          labelnames=("model", "worker", "state"), callback=_worker_pools),
+    Gauge("detection_worker_pool_restarts", "Перезапусков процессов пула инференса", labelnames=("model",),
+          callback=_worker_restarts),
+    Gauge("detection_history_write_queue_depth", "Записей истории, ожидающих групповой записи в БД",
+          callback=_history_write_queue),
+    Gauge("detection_live_fps", "Скорость обработки живого потока, кадров в секунду", labelnames=("stream",),
+          callback=_live_streams("fps")),
+    Gauge("detection_live_drop_rate", "Доля отброшенных кадров живого потока", labelnames=("stream",),
+          callback=_live_streams("drop_rate")),
+    Gauge("detection_model_load_seconds", "Время загрузки модели, сек", labelnames=("model",),
+          callback=_model_stat("load_time_s")),
+    Gauge("detection_model_warmup_seconds", "Время прогрева модели, сек", labelnames=("model",),
+          callback=_model_stat("warmup_time_s")),
+    Gauge("detection_model_memory_bytes", "Прирост RSS при загрузке модели, байт", labelnames=("model",),
+          callback=_model_stat("rss_bytes")),
+]
+
+
+def observe_stage(name, seconds):
+    """
+    Учитывает длительность стадии в гистограмме и, если идёт запрос, – в его Server-Timing.
+    """
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_timings.get()
+    if timings is not None:
+        total, count = timings.get(name, (0.0, 0))
+        timings[name] = (total + seconds, count + 1)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Замер стадии: with metrics.stage("decode"): ...
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def observe_video(stats, fps):
+    """
+    Время стадий конвейера и скорость завершённой задачи по видео (stats из process_video_yolo10m).
+    """
+    for name, stat in stats.get("stages", {}).items():
+        VIDEO_STAGE_SECONDS.observe(stat["busy_s"], stage=name)
+    if fps:
+        VIDEO_FPS.observe(fps)
+
+
+def render():
+    """
+    Все метрики в текстовом формате Prometheus.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    GET /metrics – метрики процесса для Prometheus.
+    Метрики хранятся в памяти процесса: при нескольких воркерах каждый отдаёт свои.
+    """
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
+def server_timing(timings, total):
+    """
+    Значение заголовка Server-Timing: стадии в порядке первого вызова (повторные суммируются) и total, мс.
+    """
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, (seconds, _) in timings.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    """
+    Собирает стадии запроса (metrics.stage) в контекстной переменной, учитывает длительность
+    запроса в detection_request_seconds и при SERVER_TIMING_ENABLED добавляет заголовок Server-Timing.
+    Стадии, выполняемые в других потоках (фоновая запись файла, планировщик инференса),
+    попадают только в гистограммы.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        total = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match is not None and match.url_name else "unmatched"
+        REQUEST_SECONDS.observe(total, view=view, status=response.status_code)
+        if getattr(settings, 'SERVER_TIMING_ENABLED', True):
+            response["Server-Timing"] = server_timing(timings, total)
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0002_detectionhistory_detailed_results_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('video_url', models.CharField(help_text='Ссылка на видео', max_length=2000)),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], db_index=True, default='queued', help_text='Состояние задачи', max_length=10)),
+                ('frames_done', models.IntegerField(default=0, help_text='Обработано кадров')),
+                ('frames_total', models.IntegerField(default=0, help_text='Всего кадров (0, если неизвестно)')),
+                ('fps', models.FloatField(default=0.0, help_text='Скорость обработки, кадров в секунду')),
+                ('error', models.TextField(blank=True, default='', help_text='Текст ошибки, если задача завершилась неудачно')),
+                ('created_at', models.DateTimeField(auto_now_add=True, help_text='Дата и время постановки в очередь')),
+                ('started_at', models.DateTimeField(blank=True, help_text='Дата и время начала обработки', null=True)),
+                ('finished_at', models.DateTimeField(blank=True, help_text='Дата и время завершения', null=True)),
+                ('history', models.ForeignKey(blank=True, help_text='Запись истории, созданная по завершении задачи', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='video_jobs', to='detection.detectionhistory')),
+            ],
+        ),
+    ]
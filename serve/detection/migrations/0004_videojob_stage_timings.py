@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0003_videojob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videojob',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict, help_text='Время работы стадий конвейера decode/infer/annotate/encode (сек)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0004_videojob_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videojob',
+            name='adaptive_stride',
+            field=models.BooleanField(default=False, help_text='Назначать ключевой кадр раньше при смене сцены'),
+        ),
+        migrations.AddField(
+            model_name='videojob',
+            name='frame_stride',
+            field=models.PositiveIntegerField(default=1, help_text='Полная детекция на каждом N-м кадре, между ними боксы переносит трекер'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0005_videojob_frame_stride'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectionhistory',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Ключ кэша: sha256 от хэша входного файла, имени модели и параметров инференса', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0006_detectionhistory_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videojob',
+            name='model_name',
+            field=models.CharField(blank=True, default='', help_text='Имя модели YOLO', max_length=100),
+        ),
+    ]
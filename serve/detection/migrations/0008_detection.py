@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0007_videojob_model_name'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='detectionhistory',
+            name='detailed_results',
+            field=models.TextField(blank=True, default='', help_text='Детальная информация о классификации (JSON). Устарело: детекции хранятся в Detection'),
+        ),
+        migrations.CreateModel(
+            name='Detection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frame', models.IntegerField(blank=True, help_text='Номер кадра (для видео)', null=True)),
+                ('class_name', models.CharField(help_text='Обнаруженный класс', max_length=100)),
+                ('confidence', models.FloatField(blank=True, help_text='Уверенность модели', null=True)),
+                ('x1', models.FloatField(help_text='Bounding box: левый край')),
+                ('y1', models.FloatField(help_text='Bounding box: верхний край')),
+                ('x2', models.FloatField(help_text='Bounding box: правый край')),
+                ('y2', models.FloatField(help_text='Bounding box: нижний край')),
+                ('track_id', models.IntegerField(blank=True, help_text='Id трека (видео с frame_stride > 1)', null=True)),
+                ('interpolated', models.BooleanField(default=False, help_text='Бокс перенесён трекером, а не найден моделью')),
+                ('history', models.ForeignKey(help_text='Запись истории, к которой относится детекция', on_delete=django.db.models.deletion.CASCADE, related_name='detections', to='detection.detectionhistory')),
+            ],
+            options={
+                'ordering': ('id',),
+                'indexes': [models.Index(fields=['class_name', 'confidence'], name='detection_class_conf_idx'), models.Index(fields=['confidence'], name='detection_conf_idx'), models.Index(fields=['history', 'frame'], name='detection_history_frame_idx')],
+            },
+        ),
+    ]
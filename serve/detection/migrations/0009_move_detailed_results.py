@@ -0,0 +1,106 @@
+import json
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+
+def parse_details(text):
+    """
+    Разбирает JSON detailed_results в список полей Detection и число пропущенных детекций без bbox
+    (координаты им не придумываются). Возвращает None, если JSON повреждён или не в ожидаемом формате:
+    такая запись остаётся как есть (поле не очищается), чтобы данные не потерялись.
+    """
+    try:
+        details = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(details, list):
+        return None
+    rows = []
+    skipped = 0
+    for detail in details:
+        if not isinstance(detail, dict):
+            return None
+        bbox = detail.get("bbox")
+        if not bbox:
+            skipped += 1
+            continue
+        if not isinstance(bbox, list) or len(bbox) != 4:
+            return None
+        rows.append({
+            "frame": detail.get("frame"),
+            "class_name": detail.get("class", ""),
+            "confidence": detail.get("confidence"),
+            "x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3],
+            "track_id": detail.get("track_id"),
+            "interpolated": detail.get("interpolated", False),
+        })
+    return rows, skipped
+
+
+def move_detailed_results(apps, schema_editor):
+    """
+    Переносит детекции из JSON-поля detailed_results в таблицу Detection и очищает поле.
+    """
+    DetectionHistory = apps.get_model('detection', 'DetectionHistory')
+    Detection = apps.get_model('detection', 'Detection')
+
+    records = (DetectionHistory.objects
+               .exclude(detailed_results="")
+               .only('id', 'detailed_results')
+               .iterator(chunk_size=100))
+    for record in records:
+        parsed = parse_details(record.detailed_results)
+        if parsed is None:
+            continue
+        rows, skipped = parsed
+        if skipped:
+            logger.warning("Запись истории %s: пропущено детекций без bbox: %s", record.id, skipped)
+        for start in range(0, len(rows), CHUNK_SIZE):
+            Detection.objects.bulk_create(
+                Detection(history_id=record.id, **row) for row in rows[start:start + CHUNK_SIZE]
+            )
+        DetectionHistory.objects.filter(pk=record.id).update(detailed_results="")
+
+
+def restore_detailed_results(apps, schema_editor):
+    """
+    Обратная операция: собирает JSON detailed_results из таблицы Detection.
+    """
+    DetectionHistory = apps.get_model('detection', 'DetectionHistory')
+    Detection = apps.get_model('detection', 'Detection')
+
+    history_ids = Detection.objects.values_list('history_id', flat=True).distinct()
+    for history_id in history_ids.iterator():
+        details = []
+        for detection in Detection.objects.filter(history_id=history_id).order_by('id').iterator():
+            detail = {
+                "class": detection.class_name,
+                "confidence": detection.confidence,
+                "bbox": [detection.x1, detection.y1, detection.x2, detection.y2],
+            }
+            if detection.frame is not None:
+                detail = {"frame": detection.frame, **detail}
+            if detection.track_id is not None:
+                detail["track_id"] = detection.track_id
+                detail["interpolated"] = detection.interpolated
+            details.append(detail)
+        DetectionHistory.objects.filter(pk=history_id).update(
+            detailed_results=json.dumps(details, ensure_ascii=False)
+        )
+    Detection.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0008_detection'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_detailed_results, restore_detailed_results),
+    ]
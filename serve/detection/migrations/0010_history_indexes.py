@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0009_move_detailed_results'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='detection',
+            index=models.Index(fields=['history', 'class_name', 'confidence'], name='detection_history_class_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detectionhistory',
+            index=models.Index(fields=['datetime_input', 'id'], name='history_datetime_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detectionhistory',
+            index=models.Index(fields=['source_type', 'datetime_input', 'id'], name='history_source_datetime_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0010_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videojob',
+            name='history',
+            field=models.ForeignKey(blank=True, help_text='Запись истории; создаётся в начале обработки, детекции добавляются по ходу', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='video_jobs', to='detection.detectionhistory'),
+        ),
+    ]
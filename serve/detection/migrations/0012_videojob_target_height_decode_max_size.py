@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0011_videojob_history_help_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videojob',
+            name='decode_max_size',
+            field=models.PositiveIntegerField(default=0, help_text='Уменьшать кадры после декодирования до этого размера по длинной стороне, px (0 – без изменения)'),
+        ),
+        migrations.AddField(
+            model_name='videojob',
+            name='target_height',
+            field=models.PositiveIntegerField(default=0, help_text='Загружать самый маленький поток не ниже этой высоты, px (0 – лучшее качество)'),
+        ),
+    ]
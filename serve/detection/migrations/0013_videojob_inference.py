@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0012_videojob_target_height_decode_max_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videojob',
+            name='inference',
+            field=models.JSONField(blank=True, default=dict, help_text='Параметры инференса: imgsz, conf, iou, classes, max_det, latency_budget_ms (пусто – по умолчанию)'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detection', '0013_videojob_inference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videojob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, help_text='Последнее продление аренды задачи её процессом', null=True),
+        ),
+        migrations.AddField(
+            model_name='videojob',
+            name='owner',
+            field=models.CharField(blank=True, default='', help_text='Процесс, выполняющий задачу (хост:pid)', max_length=255),
+        ),
+    ]
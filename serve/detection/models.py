@@ -1,5 +1,12 @@
+import json
+import logging
+
+from django.conf import settings
 from django.db import models
 
+logger = logging.getLogger(__name__)
+
+
 class DetectionHistory(models.Model):
     image_name = models.CharField(max_length=255, help_text="Имя изображения (одинаковое для input и output)")
     datetime_input = models.DateTimeField(auto_now_add=True, help_text="Дата и время обработки")
@@ -15,8 +22,215 @@ class DetectionHistory(models.Model):
     detailed_results = models.TextField(
         blank=True,
         default="",
-        help_text="Детальная информация о классификации (JSON)"
+        help_text="Детальная информация о классификации (JSON). Устарело: детекции хранятся в Detection"
+    )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        db_index=True,
+        help_text="Ключ кэша: sha256 от хэша входного файла, имени модели и параметров инференса"
     )
 
+    class Meta:
+        indexes = [
+            # Курсорная пагинация истории: ORDER BY datetime_input DESC, id DESC
+            models.Index(fields=["datetime_input", "id"], name="history_datetime_id_idx"),
+            models.Index(fields=["source_type", "datetime_input", "id"], name="history_source_datetime_idx"),
+        ]
+
     def __str__(self):
         return f"{self.image_name} - {self.datetime_input}"
+
+    def get_detailed_results(self):
+        """
+        Список детекций в прежнем формате detailed_results (class, confidence, bbox[, frame, ...]).
+        Берётся из таблицы Detection, а для записей, не перенесённых в неё, – из JSON.
+        """
+        detections = list(self.detections.all())
+        if detections:
+            return [detection.as_dict() for detection in detections]
+        return json.loads(self.detailed_results) if self.detailed_results else []
+
+
+class Detection(models.Model):
+    history = models.ForeignKey(
+        DetectionHistory,
+        on_delete=models.CASCADE,
+        related_name="detections",
+        help_text="Запись истории, к которой относится детекция"
+    )
+    frame = models.IntegerField(null=True, blank=True, help_text="Номер кадра (для видео)")
+    class_name = models.CharField(max_length=100, help_text="Обнаруженный класс")
+    confidence = models.FloatField(null=True, blank=True, help_text="Уверенность модели")
+    x1 = models.FloatField(help_text="Bounding box: левый край")
+    y1 = models.FloatField(help_text="Bounding box: верхний край")
+    x2 = models.FloatField(help_text="Bounding box: правый край")
+    y2 = models.FloatField(help_text="Bounding box: нижний край")
+    track_id = models.IntegerField(null=True, blank=True, help_text="Id трека (видео с frame_stride > 1)")
+    interpolated = models.BooleanField(default=False, help_text="Бокс перенесён трекером, а не найден моделью")
+
+    class Meta:
+        ordering = ("id",)
+        indexes = [
+            models.Index(fields=["class_name", "confidence"], name="detection_class_conf_idx"),
+            models.Index(fields=["confidence"], name="detection_conf_idx"),
+            models.Index(fields=["history", "frame"], name="detection_history_frame_idx"),
+            # Фильтр истории по классу: EXISTS (... WHERE history_id = ? AND class_name = ?)
+            models.Index(fields=["history", "class_name", "confidence"], name="detection_history_class_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.class_name} ({self.confidence}) - {self.history_id}"
+
+    @classmethod
+    def from_dict(cls, history_id, detail):
+        """
+        Объект Detection из словаря detailed_results; bbox обязателен (ValueError, если его нет).
+        """
+        bbox = detail.get("bbox")
+        if not bbox or len(bbox) != 4:
+            raise ValueError(f"Детекция {detail.get('class')!r} без bbox")
+        return cls(
+            history_id=history_id,
+            frame=detail.get("frame"),
+            class_name=detail["class"],
+            confidence=detail.get("confidence"),
+            x1=bbox[0], y1=bbox[1], x2=bbox[2], y2=bbox[3],
+            track_id=detail.get("track_id"),
+            interpolated=detail.get("interpolated", False),
+        )
+
+    def as_dict(self):
+        detail = {
+            "class": self.class_name,
+            "confidence": self.confidence,
+            "bbox": [self.x1, self.y1, self.x2, self.y2],
+        }
+        if self.frame is not None:
+            detail = {"frame": self.frame, **detail}
+        if self.track_id is not None:
+            detail["track_id"] = self.track_id
+            detail["interpolated"] = self.interpolated
+        return detail
+
+    @classmethod
+    def from_frame_detections(cls, history_id, frame, detections, names):
+        """
+        Объекты Detection из массивов одного кадра (columnar.FrameDetections) без промежуточных словарей.
+        """
+        rows = zip(detections.class_names(names), detections.confidence.tolist(), detections.xyxy.tolist(),
+                   detections.track_id.tolist(), detections.interpolated.tolist())
+        return [
+            cls(history_id=history_id, frame=frame, class_name=class_name, confidence=confidence,
+                x1=bbox[0], y1=bbox[1], x2=bbox[2], y2=bbox[3],
+                track_id=track_id if track_id >= 0 else None, interpolated=interpolated)
+            for class_name, confidence, bbox, track_id, interpolated in rows
+        ]
+
+    @classmethod
+    def bulk_create_from_details(cls, history_id, details, chunk_size=None):
+        """
+        Сохраняет детекции одной записи истории (итерируемое словарей detailed_results).
+        """
+        return cls.bulk_create_rows(((history_id, detail) for detail in details), chunk_size)
+
+    @classmethod
+    def bulk_create_rows(cls, rows, chunk_size=None):
+        """
+        Сохраняет пары (history_id, словарь детекции) пачками по chunk_size
+        (DETECTION_BULK_CHUNK_SIZE), не собирая все объекты в памяти. Возвращает число строк.
+        Детекции без bbox не сохраняются (координаты не придумываются) и попадают в лог.
+        """
+        chunk_size = chunk_size or getattr(settings, 'DETECTION_BULK_CHUNK_SIZE', 1000)
+        chunk = []
+        total = 0
+        for history_id, detail in rows:
+            try:
+                chunk.append(cls.from_dict(history_id, detail))
+            except ValueError as e:
+                logger.warning("Запись истории %s: %s не сохранена", history_id, e)
+                continue
+            if len(chunk) >= chunk_size:
+                cls.objects.bulk_create(chunk)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            cls.objects.bulk_create(chunk)
+            total += len(chunk)
+        return total
+
+
+class VideoJob(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "В очереди"),
+        (STATUS_RUNNING, "Выполняется"),
+        (STATUS_DONE, "Готово"),
+        (STATUS_FAILED, "Ошибка"),
+    ]
+
+    video_url = models.CharField(max_length=2000, help_text="Ссылка на видео")
+    frame_stride = models.PositiveIntegerField(
+        default=1,
+        help_text="Полная детекция на каждом N-м кадре, между ними боксы переносит трекер"
+    )
+    adaptive_stride = models.BooleanField(
+        default=False,
+        help_text="Назначать ключевой кадр раньше при смене сцены"
+    )
+    model_name = models.CharField(max_length=100, blank=True, default="", help_text="Имя модели YOLO")
+    target_height = models.PositiveIntegerField(
+        default=0,
+        help_text="Загружать самый маленький поток не ниже этой высоты, px (0 – лучшее качество)"
+    )
+    decode_max_size = models.PositiveIntegerField(
+        default=0,
+        help_text="Уменьшать кадры после декодирования до этого размера по длинной стороне, px (0 – без изменения)"
+    )
+    inference = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Параметры инференса: imgsz, conf, iou, classes, max_det, latency_budget_ms (пусто – по умолчанию)"
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_QUEUED,
+        db_index=True,
+        help_text="Состояние задачи"
+    )
+    frames_done = models.IntegerField(default=0, help_text="Обработано кадров")
+    frames_total = models.IntegerField(default=0, help_text="Всего кадров (0, если неизвестно)")
+    fps = models.FloatField(default=0.0, help_text="Скорость обработки, кадров в секунду")
+    error = models.TextField(blank=True, default="", help_text="Текст ошибки, если задача завершилась неудачно")
+    stage_timings = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Время работы стадий конвейера decode/infer/annotate/encode (сек)"
+    )
+    history = models.ForeignKey(
+        DetectionHistory,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="video_jobs",
+        help_text="Запись истории; создаётся в начале обработки, детекции добавляются по ходу"
+    )
+    owner = models.CharField(
+        max_length=255, blank=True, default="",
+        help_text="Процесс, выполняющий задачу (хост:pid)"
+    )
+    heartbeat_at = models.DateTimeField(
+        null=True, blank=True,
+        help_text="Последнее продление аренды задачи её процессом"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, help_text="Дата и время постановки в очередь")
+    started_at = models.DateTimeField(null=True, blank=True, help_text="Дата и время начала обработки")
+    finished_at = models.DateTimeField(null=True, blank=True, help_text="Дата и время завершения")
+
+    def __str__(self):
+        return f"VideoJob {self.pk} ({self.status})"
@@ -0,0 +1,191 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from . import metrics
+from .models import Detection, DetectionHistory
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def _write(items):
+    """
+    Сохраняет пары (запись истории без id, детекции в формате detailed_results) одной транзакцией.
+    Записям проставляются id.
+    """
+    with transaction.atomic():
+        # На SQLite >= 3.35 bulk_create проставляет id созданным объектам
+        records = DetectionHistory.objects.bulk_create([record for record, _ in items])
+        Detection.bulk_create_rows(
+            (record.id, detail)
+            for record, (_, details) in zip(records, items)
+            for detail in details
+        )
+    return records
+
+
+class HistoryWriter:
+    """
+    Групповая запись истории: запросы кладут записи в очередь, фоновый поток забирает
+    всё накопившееся (не больше max_rows записей; первая ждёт не дольше max_delay секунд)
+    и сохраняет одной транзакцией. На SQLite пишет всегда один поток одного процесса:
+    запросы не дерутся за блокировку базы, а fsync выполняется раз на пачку, а не на запись.
+    Очередь ограничена max_rows: если поток записи не успевает, submit ждёт места
+    (не дольше timeout), так что несохранённых записей не бывает больше max_rows.
+    Вызывающий получает Future с сохранённой записью (с id): ответ уходит только после фиксации
+    транзакции, поэтому сохранность записи не хуже, чем при прямом create.
+    """
+
+    def __init__(self, max_rows=200, max_delay=0.002, timeout=30.0):
+        self.max_rows = max(1, int(max_rows))
+        self.max_delay = max(0.0, float(max_delay))
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=self.max_rows)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, record, details=()):
+        """
+        Ставит запись DetectionHistory (ещё не сохранённую) и её детекции в очередь.
+        Возвращает Future с записью после фиксации.
+        """
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put((record, list(details), future), timeout=self.timeout)
+        except queue.Full:
+            raise Exception("Очередь записи истории переполнена, повторите запрос позже.")
+        return future
+
+    def save(self, items):
+        """
+        Сохраняет пары (запись, детекции) и ждёт фиксации; возвращает записи с id в том же порядке.
+        """
+        futures = [self.submit(record, details) for record, details in items]
+        return [future.result(timeout=self.timeout) for future in futures]
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=None):
+        """
+        Дописывает очередь и останавливает поток записи.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_rows and batch[-1] is not _STOP:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._collect_batch()
+                stop = batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                if batch:
+                    self._flush(batch)
+                if stop:
+                    break
+        finally:
+            connection.close()
+
+    def _flush(self, batch):
+        # Соединение потока постоянное (CONN_MAX_AGE): разорванное или просроченное закрывается здесь
+        close_old_connections()
+        try:
+            with metrics.stage("db_flush"):
+                records = _write([(record, details) for record, details, _ in batch])
+        except Exception:
+            if len(batch) == 1:
+                logger.exception("Не удалось сохранить запись истории")
+                batch[0][2].set_exception(Exception("Не удалось сохранить запись истории."))
+                return
+            # Одна ошибочная запись не должна ронять остальные запросы пачки; id, проставленные
+            # до отката транзакции, недействительны
+            for item in batch:
+                item[0].pk = None
+                self._flush([item])
+            return
+        self.batches += 1
+        self.rows += len(records)
+        for (_, _, future), record in zip(batch, records):
+            future.set_result(record)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer():
+    """
+    Общий для процесса поток записи истории (HISTORY_WRITE_MAX_ROWS, HISTORY_WRITE_MAX_DELAY).
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter(
+                max_rows=getattr(settings, 'HISTORY_WRITE_MAX_ROWS', 200),
+                max_delay=getattr(settings, 'HISTORY_WRITE_MAX_DELAY', 0.002),
+                timeout=getattr(settings, 'HISTORY_WRITE_TIMEOUT', 30.0),
+            )
+    return _writer
+
+
+def pending_writes():
+    """
+    Записей истории в очереди групповой записи.
+    """
+    return _writer.qsize() if _writer is not None else 0
+
+
+def save_history(items):
+    """
+    Сохраняет пары (запись DetectionHistory без id, детекции в формате detailed_results)
+    и возвращает записи с id. При HISTORY_WRITE_GROUP_COMMIT – через общий поток записи
+    (одна транзакция на все записи, пришедшие за время предыдущей), иначе – транзакцией
+    в текущем потоке.
+    """
+    items = list(items)
+    if not items:
+        return []
+    if getattr(settings, 'HISTORY_WRITE_GROUP_COMMIT', True):
+        return get_history_writer().save(items)
+    return _write(items)
+
+
+@atexit.register
+def shutdown_writer():
+    if _writer is not None:
+        _writer.stop(timeout=10)
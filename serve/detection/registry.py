@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import psutil
+from django.conf import settings
+
+from .engines import load_model
+
+logger = logging.getLogger(__name__)
+
+
+class LoadedModel:
+    """
+    Загруженная модель и сведения о ней.
+    Вызовы model должны выполняться под lock: предиктор ultralytics не потокобезопасен.
+    """
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.lock = threading.Lock()
+        self.load_time_s = 0.0
+        self.warmup_time_s = 0.0
+        self.rss_bytes = 0
+        self.param_bytes = 0
+        self.loaded_at = time.time()
+        self.last_used = time.time()
+        self.uses = 0
+
+    @property
+    def memory_bytes(self):
+        """
+        Оценка занимаемой памяти: прирост RSS при загрузке, но не меньше размера весов.
+        """
+        return max(self.rss_bytes, self.param_bytes)
+
+    def info(self):
+        return {
+            "name": self.name,
+            "load_time_s": round(self.load_time_s, 3),
+            "warmup_time_s": round(self.warmup_time_s, 3),
+            "rss_bytes": self.rss_bytes,
+            "param_bytes": self.param_bytes,
+            "uses": self.uses,
+            "last_used": self.last_used,
+        }
+
+
+def _param_bytes(model):
+    torch_model = getattr(model, "model", None)
+    if torch_model is None or not hasattr(torch_model, "parameters"):
+        return 0
+    try:
+        return int(sum(p.numel() * p.element_size() for p in torch_model.parameters()))
+    except Exception:
+        return 0
+
+
+class ModelRegistry:
+    """
+    Реестр загруженных моделей YOLO.
+    Модели загружаются по имени при первом обращении (или заранее через preload),
+    прогреваются пустым кадром и хранятся в порядке последнего использования.
+    Когда суммарная оценка памяти превышает memory_budget_bytes, выгружаются
+    давно не использовавшиеся модели (кроме только что запрошенной).
+    """
+
+    def __init__(self, loader, memory_budget_bytes=0, warmup_size=640):
+        self.loader = loader
+        self.memory_budget_bytes = memory_budget_bytes
+        self.warmup_size = warmup_size
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.evictions = 0
+
+    def get(self, name):
+        """
+        Возвращает LoadedModel, загружая модель при необходимости.
+        """
+        with self._lock:
+            loaded = self._models.get(name)
+            if loaded is not None:
+                self._models.move_to_end(name)
+                loaded.last_used = time.time()
+                loaded.uses += 1
+                return loaded
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # Параллельные запросы одной и той же модели ждут одну загрузку
+        with load_lock:
+            with self._lock:
+                loaded = self._models.get(name)
+            if loaded is None:
+                loaded = self._load(name)
+                self.register(name, loaded)
+        loaded.uses += 1
+        return loaded
+
+    def register(self, name, model):
+        """
+        Добавляет в реестр уже загруженную модель (объект YOLO или LoadedModel).
+        """
+        loaded = model if isinstance(model, LoadedModel) else LoadedModel(name, model)
+        with self._lock:
+            self._models[name] = loaded
+            self._models.move_to_end(name)
+            self._evict(keep=name)
+        return loaded
+
+    def unload(self, name):
+        with self._lock:
+            return self._models.pop(name, None) is not None
+
+    def preload(self, names):
+        """
+        Загружает (и прогревает) перечисленные модели; ошибки логируются и не прерывают остальные.
+        """
+        for name in names:
+            try:
+                self.get(name)
+            except Exception:
+                logger.exception("Не удалось загрузить модель %s", name)
+
+    def loaded_names(self):
+        with self._lock:
+            return list(self._models)
+
+    def stats(self):
+        with self._lock:
+            models = [loaded.info() for loaded in self._models.values()]
+            used = sum(loaded.memory_bytes for loaded in self._models.values())
+        return {
+            "models": models,
+            "memory_bytes": used,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "evictions": self.evictions,
+        }
+
+    def _load(self, name):
+        process = psutil.Process()
+        rss_before = process.memory_info().rss
+        started = time.perf_counter()
+        loaded = LoadedModel(name, self.loader(name))
+        loaded.load_time_s = time.perf_counter() - started
+
+        if self.warmup_size:
+            started = time.perf_counter()
+            dummy = np.zeros((self.warmup_size, self.warmup_size, 3), dtype=np.uint8)
+            with loaded.lock:
+                loaded.model(dummy, verbose=False)
+            loaded.warmup_time_s = time.perf_counter() - started
+
+        loaded.rss_bytes = max(0, process.memory_info().rss - rss_before)
+        loaded.param_bytes = _param_bytes(loaded.model)
+        logger.info("Модель %s загружена за %.2f c (прогрев %.2f c), RSS +%d МБ",
+                    name, loaded.load_time_s, loaded.warmup_time_s, loaded.rss_bytes // (1024 * 1024))
+        return loaded
+
+    def _evict(self, keep):
+        if not self.memory_budget_bytes:
+            return
+        used = sum(loaded.memory_bytes for loaded in self._models.values())
+        for name in list(self._models):
+            if used <= self.memory_budget_bytes:
+                break
+            if name == keep:
+                continue
+            used -= self._models.pop(name).memory_bytes
+            self.evictions += 1
+            logger.info("Модель %s выгружена из памяти (LRU)", name)
+
+
+registry = ModelRegistry(
+    loader=load_model,
+    memory_budget_bytes=getattr(settings, 'YOLO_MODEL_MEMORY_BUDGET_MB', 0) * 1024 * 1024,
+    warmup_size=getattr(settings, 'YOLO_WARMUP_IMAGE_SIZE', 640),
+)
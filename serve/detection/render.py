@@ -0,0 +1,203 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+from django.conf import settings
+from ultralytics.utils.checks import check_yaml
+from ultralytics.utils.plotting import Annotator, colors
+
+try:
+    from ultralytics.utils import YAML
+    _yaml_load = YAML.load
+except ImportError:  # ultralytics < 8.3.150
+    from ultralytics.utils import yaml_load as _yaml_load
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=1)
+def coco_names():
+    """
+    Имена классов COCO ({id: name}) – по ним выбирается цвет бокса, как в results[0].plot().
+    """
+    return _yaml_load(check_yaml("coco.yaml"))["names"]
+
+
+def draw_detections(frame, detected_details, names):
+    """
+    Рисует боксы из detected_details на копии кадра в том же стиле, что и results[0].plot().
+    К подписи добавляется id трека, если он есть.
+    """
+    annotator = Annotator(frame.copy())
+    class_ids = {name: idx for idx, name in names.items()}
+    for detail in detected_details:
+        label = f"{detail['class']} {detail['confidence']:.2f}"
+        if detail.get("track_id") is not None:
+            label = f"#{detail['track_id']} {label}"
+        annotator.box_label(detail["bbox"], label, color=colors(class_ids.get(detail["class"], 0), True))
+    return annotator.result()
+
+
+def render_params(max_size=None, classes=None, conf=None):
+    """
+    Нормализованные параметры отрисовки (часть ключа кэша).
+    """
+    return {
+        "max_size": int(max_size) if max_size else 0,
+        "classes": sorted(set(classes)) if classes else [],
+        "conf": float(conf) if conf else 0.0,
+    }
+
+
+def render_detections(input_path, detected_details, max_size=0, classes=(), conf=0.0):
+    """
+    Рисует детекции на исходном изображении и возвращает кадр BGR.
+    Изображение сначала уменьшается до max_size по длинной стороне (0 – без изменения),
+    боксы масштабируются вместе с ним; детекции отбираются по classes и conf.
+    """
+    frame = cv2.imread(input_path)
+    if frame is None:
+        raise ValueError("Не удалось прочитать исходное изображение.")
+
+    details = [
+        detail for detail in detected_details
+        if (not classes or detail["class"] in classes) and (detail.get("confidence") or 0.0) >= conf
+    ]
+    height, width = frame.shape[:2]
+    scale = min(1.0, max_size / max(height, width)) if max_size else 1.0
+    if scale < 1.0:
+        frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        details = [{**detail, "bbox": [v * scale for v in detail["bbox"]]} for detail in details]
+    return draw_detections(frame, details, coco_names())
+
+
+class RenderCache:
+    """
+    Дисковый кэш отрисованных изображений в directory, ограниченный по суммарному размеру
+    файлов (max_bytes, 0 – без ограничения). При переполнении удаляются файлы,
+    к которым дольше всего не обращались. Индекс строится по содержимому каталога
+    при первом обращении, поэтому переживает перезапуск процесса.
+    """
+
+    def __init__(self, directory, max_bytes=0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load_index(self):
+        if self._entries is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        self._entries = OrderedDict((name, size) for _, name, size in sorted(files))
+        self._bytes = sum(self._entries.values())
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.jpg")
+
+    def get(self, key):
+        """
+        Путь к закэшированному файлу или None.
+        """
+        with self._lock:
+            self._load_index()
+            name = f"{key}.jpg"
+            if name in self._entries and os.path.exists(self.path(key)):
+                self._entries.move_to_end(name)
+                self.hits += 1
+                # mtime – порядок вытеснения после перезапуска
+                os.utime(self.path(key))
+                return self.path(key)
+            self._entries.pop(name, None)
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        """
+        Сохраняет байты изображения и возвращает путь к файлу.
+        """
+        target = self.path(key)
+        with self._lock:
+            self._load_index()
+            tmp = f"{target}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, target)
+            name = os.path.basename(target)
+            self._bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict(keep=name)
+        return target
+
+    def _evict(self, keep):
+        if not self.max_bytes:
+            return
+        for name in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            self._bytes -= self._entries.pop(name)
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                logger.warning("Не удалось удалить %s из кэша отрисовки", name)
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def render_record(record, max_size=None, classes=None, conf=None):
+    """
+    Возвращает путь к JPEG с детекциями записи истории, отрисовывая его при первом обращении.
+    Бросает ValueError, если исходное изображение недоступно.
+    """
+    params = render_params(max_size, classes, conf)
+    key = hashlib.sha256(json.dumps(
+        {"record": record.id, "input": record.input_path, **params}, sort_keys=True
+    ).encode("utf-8")).hexdigest()
+    cached = render_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with metrics.stage("render"):
+        frame = render_detections(
+            os.path.join(settings.MEDIA_ROOT, record.input_path), record.get_detailed_results(),
+            params["max_size"], params["classes"], params["conf"],
+        )
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, getattr(settings, 'RENDER_JPEG_QUALITY', 90)])
+    if not ok:
+        raise ValueError("Не удалось закодировать изображение.")
+    return render_cache.put(key, encoded.tobytes())
+
+
+render_cache = RenderCache(
+    directory=getattr(settings, 'RENDER_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'render_cache')),
+    max_bytes=getattr(settings, 'RENDER_CACHE_MAX_BYTES', 0),
+)
@@ -0,0 +1,94 @@
+import threading
+
+from django.conf import settings
+
+# Вход модели кратен шагу сетки YOLO
+IMGSZ_STEP = 32
+# Вход ultralytics по умолчанию: с ним получены результаты запросов без imgsz
+DEFAULT_IMGSZ = 640
+# Размер входа, для которого задаётся YOLO_LATENCY_PRIOR_MS
+PRIOR_IMGSZ = DEFAULT_IMGSZ
+
+
+def imgsz_choices():
+    """
+    Размеры входа модели, из которых выбирает автоматическая политика (YOLO_IMGSZ_CHOICES), по возрастанию.
+    """
+    return sorted({int(size) for size in getattr(settings, 'YOLO_IMGSZ_CHOICES', [320, 416, 512, 640, 800, 960, 1280])})
+
+
+class LatencyEstimator:
+    """
+    Оценка времени прохода модели на кадр, мс, для каждой пары (модель, imgsz):
+    экспоненциальное скользящее среднее наблюдаемых проходов (observe).
+    Для ещё не встречавшегося размера оценка пересчитывается с ближайшего измеренного
+    пропорционально площади входа (свёрточная сеть считает пропорционально числу пикселей),
+    а без измерений – с prior_ms для PRIOR_IMGSZ (0 – оценки нет).
+    """
+
+    def __init__(self, alpha=0.2, prior_ms=0.0):
+        self.alpha = alpha
+        self.prior_ms = prior_ms
+        self._observed = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model_name, imgsz, ms_per_frame):
+        key = (model_name, int(imgsz))
+        with self._lock:
+            previous = self._observed.get(key)
+            self._observed[key] = (ms_per_frame if previous is None
+                                   else previous + self.alpha * (ms_per_frame - previous))
+
+    def estimate(self, model_name, imgsz):
+        """
+        Оценка времени на кадр, мс, или None, если оценить не по чему.
+        """
+        with self._lock:
+            measured = {size: ms for (name, size), ms in self._observed.items() if name == model_name}
+        if imgsz in measured:
+            return measured[imgsz]
+        if measured:
+            nearest = min(measured, key=lambda size: abs(size - imgsz))
+            return measured[nearest] * (imgsz / nearest) ** 2
+        if self.prior_ms:
+            return self.prior_ms * (imgsz / PRIOR_IMGSZ) ** 2
+        return None
+
+    def stats(self):
+        with self._lock:
+            observed = dict(self._observed)
+        result = {}
+        for (name, size), ms in sorted(observed.items()):
+            result.setdefault(name, {})[size] = round(ms, 2)
+        return result
+
+
+def auto_imgsz(width, height, model_name, budget_ms=0, estimator=None, choices=None, max_imgsz=None):
+    """
+    Размер входа модели для изображения width x height:
+      - наименьший из choices, не меньший длинной стороны (мелкое изображение не растягивается
+        до большого входа: лишние пиксели не добавляют деталей, а время растёт как квадрат размера);
+      - не больше max_imgsz (YOLO_IMGSZ_AUTO_MAX): крупные изображения уменьшаются, как и раньше;
+      - при budget_ms > 0 – уменьшается, пока оценка времени прохода на кадр превышает бюджет
+        (но не меньше наименьшего из choices).
+    """
+    choices = choices or imgsz_choices()
+    if max_imgsz is None:
+        max_imgsz = getattr(settings, 'YOLO_IMGSZ_AUTO_MAX', 640)
+    allowed = [size for size in choices if size <= max_imgsz] or choices[:1]
+    long_side = max(width, height)
+    index = next((i for i, size in enumerate(allowed) if size >= long_side), len(allowed) - 1)
+    if budget_ms:
+        estimator = estimator or latency_estimator
+        while index > 0:
+            estimate = estimator.estimate(model_name, allowed[index])
+            if estimate is None or estimate <= budget_ms:
+                break
+            index -= 1
+    return allowed[index]
+
+
+latency_estimator = LatencyEstimator(
+    alpha=getattr(settings, 'YOLO_LATENCY_EMA_ALPHA', 0.2),
+    prior_ms=getattr(settings, 'YOLO_LATENCY_PRIOR_MS', 0.0),
+)
@@ -0,0 +1,505 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from . import storage, workers, yolo
+from .columnar import DetectionColumns, FrameDetections, columns_path
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+# Настройки, которые процессы сегментов получают от родителя: в том числе подменённые
+# в тестах и бенчмарке (override_settings), иначе дочерний процесс видел бы значения из settings.py
+FORWARDED_SETTINGS = (
+    "MEDIA_ROOT",
+    "VIDEO_INFERENCE_BATCH_SIZE",
+    "VIDEO_PIPELINE_QUEUE_SIZE",
+    "VIDEO_ADAPTIVE_STRIDE_THRESHOLD",
+)
+
+
+class SegmentError(Exception):
+    """
+    Сегмент видео не удалось обработать за отведённое число попыток.
+    """
+
+
+def segment_parallel_enabled():
+    return getattr(settings, 'VIDEO_SEGMENT_PARALLEL_ENABLED', False)
+
+
+def keyframe_indices(path):
+    """
+    Номера ключевых кадров и число кадров видео. Пакеты читаются без декодирования
+    (CAP_PROP_FORMAT = -1), поэтому проход по файлу почти бесплатный.
+    Если бэкенд так не умеет, возвращает (None, 0).
+    """
+    cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if not cap.isOpened():
+        return None, 0
+    keyframes = []
+    count = 0
+    try:
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(count)
+            count += 1
+    finally:
+        cap.release()
+    return (keyframes or None), count
+
+
+def plan_segments(frames_total, segment_frames, keyframes=None):
+    """
+    Делит кадры [0, frames_total) на отрезки [start, end) не короче segment_frames кадров,
+    начинающиеся с ключевых кадров (keyframes=None – с любого кадра). Хвост короче половины
+    segment_frames присоединяется к предыдущему отрезку.
+    """
+    segment_frames = max(1, int(segment_frames))
+    if keyframes is None:
+        keyframes = range(0, frames_total, segment_frames)
+    starts = [0]
+    for keyframe in keyframes:
+        if keyframe - starts[-1] >= segment_frames and keyframe < frames_total:
+            starts.append(keyframe)
+    if len(starts) > 1 and frames_total - starts[-1] < segment_frames / 2:
+        starts.pop()
+    return list(zip(starts, starts[1:] + [frames_total]))
+
+
+def segments_dir(unique_name):
+    """
+    Каталог частичных результатов видео: MEDIA/output_video/<имя без расширения>.segments.
+    """
+    return os.path.join(settings.MEDIA_ROOT, 'output_video', os.path.splitext(unique_name)[0] + ".segments")
+
+
+def has_manifest(unique_name):
+    return os.path.exists(os.path.join(segments_dir(unique_name), "manifest.json"))
+
+
+def discard(unique_name):
+    """
+    Удаляет частичные результаты видео (после склейки или при окончательной ошибке задачи).
+    """
+    shutil.rmtree(segments_dir(unique_name), ignore_errors=True)
+
+
+class SegmentManifest:
+    """
+    Состояние сегментной обработки видео в MEDIA/output_video/<имя>.segments/manifest.json:
+    параметры обработки и список сегментов {index, start, end, status, attempts, error, frames, stats}.
+    Пишется атомарно после каждого изменения, поэтому после падения процесса видно,
+    какие сегменты уже готовы (их частичные видео и .npz лежат рядом).
+    """
+
+    def __init__(self, unique_name, data):
+        self.unique_name = unique_name
+        self.data = data
+
+    @property
+    def path(self):
+        return os.path.join(segments_dir(self.unique_name), "manifest.json")
+
+    @property
+    def segments(self):
+        return self.data["segments"]
+
+    def part_name(self, segment):
+        """
+        Имя частичного видео относительно MEDIA/output_video (как unique_name у process_video_yolo10m).
+        """
+        return os.path.join(os.path.basename(segments_dir(self.unique_name)), f"{segment['index']:04d}.mp4")
+
+    def part_path(self, segment):
+        return os.path.join(settings.MEDIA_ROOT, 'output_video', self.part_name(segment))
+
+    def is_done(self, segment):
+        """
+        Сегмент готов, если он отмечен в манифесте и его файлы на месте.
+        """
+        part_path = self.part_path(segment)
+        return (segment["status"] == "done"
+                and os.path.exists(part_path) and os.path.exists(columns_path(part_path)))
+
+    def save(self):
+        storage.write_file(self.path, json.dumps(self.data, ensure_ascii=False).encode())
+
+    @classmethod
+    def create(cls, unique_name, input_video_path, options, spans, fps):
+        os.makedirs(segments_dir(unique_name), exist_ok=True)
+        manifest = cls(unique_name, {
+            "version": MANIFEST_VERSION,
+            "input": os.path.basename(input_video_path),
+            "options": options,
+            "fps": fps,
+            "frames_total": spans[-1][1],
+            "segments": [
+                {"index": index, "start": start, "end": end, "status": "pending",
+                 "attempts": 0, "error": "", "frames": 0, "stats": {}}
+                for index, (start, end) in enumerate(spans)
+            ],
+        })
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, unique_name, input_video_path, options):
+        """
+        Манифест прерванной обработки того же видео с теми же параметрами или None.
+        """
+        manifest = cls(unique_name, None)
+        try:
+            with open(manifest.path, encoding='utf-8') as f:
+                manifest.data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (manifest.data.get("version") != MANIFEST_VERSION
+                or manifest.data.get("input") != os.path.basename(input_video_path)
+                or manifest.data.get("options") != options):
+            return None
+        return manifest
+
+
+# Маркер сегмента, который сейчас обрабатывает этот процесс сегментов (см. running_marker)
+_current_marker = None
+
+
+def running_marker(part_path):
+    """
+    Маркер «сегмент в работе»: процесс сегментов создаёт его перед обработкой и удаляет после неё,
+    а также когда родитель останавливает процесс (SIGTERM). Остаётся только у сегмента, процесс
+    которого погиб сам, – по нему родитель находит виновника BrokenProcessPool.
+    """
+    return part_path + ".running"
+
+
+def _on_terminate(signum, frame):
+    if _current_marker:
+        try:
+            os.remove(_current_marker)
+        except OSError:
+            pass
+    os._exit(128 + signum)
+
+
+def _init_segment_worker(threads, forwarded, model_name, loader, loader_kwargs):
+    """
+    Инициализация процесса сегментов: потоки, настройки родителя и, если задан loader, модель.
+    """
+    # Останавливает процессы родитель; Ctrl+C в терминале не должен ронять их раньше
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _on_terminate)
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+
+    import django
+    import torch
+    from django.utils.module_loading import import_string
+
+    django.setup()
+    for name, value in forwarded.items():
+        setattr(settings, name, value)
+    # Процесс сам держит копию модели: пул инференса внутри него не нужен
+    settings.YOLO_WORKER_POOL_ENABLED = False
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    if loader:
+        from .registry import registry
+        registry.register(model_name or yolo.MODEL_NAME, import_string(loader)(model_name, threads=threads, **loader_kwargs))
+
+
+def _run_segment(input_video_path, part_name, start, end, options):
+    """
+    Обрабатывает кадры [start, end) в процессе сегментов: частичное видео и .npz с глобальными
+    номерами кадров пишутся в каталог сегментов. Возвращает число кадров и статистику.
+    """
+    global _current_marker
+    stats = {}
+    marker = running_marker(os.path.join(settings.MEDIA_ROOT, 'output_video', part_name))
+    open(marker, "w").close()
+    _current_marker = marker
+    try:
+        yolo.process_video_yolo10m(
+            input_video_path, part_name, stats=stats,
+            frame_stride=options["frame_stride"], adaptive_stride=options["adaptive_stride"],
+            model_name=options["model_name"] or None, decode_max_size=options["decode_max_size"],
+            start_frame=start, end_frame=end, inference=options["inference"] or None,
+        )
+    finally:
+        _current_marker = None
+        os.remove(marker)
+    return {"frames": stats["frames"], "stats": stats}
+
+
+class _Stitcher:
+    """
+    Склеивает готовые сегменты строго по порядку: кадры частичных видео дописываются в выходное видео,
+    детекции – в общие колонки (с глобальными номерами кадров) и в on_frame; прогресс – после сегмента.
+    Номера треков сдвигаются, чтобы треки разных сегментов не совпадали.
+    """
+
+    def __init__(self, manifest, output_path, on_frame, progress_callback):
+        self.manifest = manifest
+        self.output_path = output_path
+        # Имена классов берутся из .npz первого сегмента: родителю не нужно загружать модель
+        self.columns = None
+        self.on_frame = on_frame
+        self.progress_callback = progress_callback
+        self.next_index = 0
+        self.frames_done = 0
+        self.track_offset = 0
+        self.writer = None
+        self.busy_s = 0.0
+
+    def advance(self):
+        segments = self.manifest.segments
+        while self.next_index < len(segments) and segments[self.next_index]["status"] == "done":
+            started = time.perf_counter()
+            self._append(segments[self.next_index])
+            self.busy_s += time.perf_counter() - started
+            self.next_index += 1
+
+    def _append(self, segment):
+        part_path = self.manifest.part_path(segment)
+        cap = cv2.VideoCapture(part_path)
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if self.writer is None:
+                    height, width = frame.shape[:2]
+                    self.writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*"mp4v"),
+                                                  self.manifest.data["fps"], (width, height))
+                self.writer.write(frame)
+        finally:
+            cap.release()
+
+        part = DetectionColumns.load(columns_path(part_path))
+        if self.columns is None:
+            self.columns = DetectionColumns(part.names)
+        arrays = part.arrays()
+        track_id = arrays["track_id"]
+        if len(track_id) and track_id.max() >= 0:
+            arrays["track_id"] = np.where(track_id >= 0, track_id + self.track_offset, -1).astype(np.int32)
+            self.track_offset = int(arrays["track_id"].max()) + 1
+        # Кадры в .npz сегмента идут по возрастанию: границы кадров – бинарным поиском
+        frame_idxs = range(segment["start"], segment["start"] + segment["frames"])
+        bounds = np.searchsorted(arrays["frame"], np.arange(frame_idxs.start, frame_idxs.stop + 1))
+        for position, frame_idx in enumerate(frame_idxs):
+            rows = slice(bounds[position], bounds[position + 1])
+            detections = FrameDetections(*(arrays[field][rows] for field in DetectionColumns.FIELDS[1:]))
+            self.columns.append(frame_idx, detections)
+            if self.on_frame is not None:
+                self.on_frame(frame_idx, detections)
+        self.frames_done += segment["frames"]
+        if self.progress_callback is not None:
+            self.progress_callback(self.frames_done, self.manifest.data["frames_total"])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+def _create_executor(workers_count, threads, model_name, loader, loader_kwargs):
+    forwarded = {name: getattr(settings, name) for name in FORWARDED_SETTINGS if hasattr(settings, name)}
+    return ProcessPoolExecutor(
+        max_workers=workers_count,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_segment_worker,
+        initargs=(threads, forwarded, model_name, loader, loader_kwargs or {}),
+    )
+
+
+def _aggregate_stats(stats, manifest, stitcher, wall_s, workers_count, resumed, retries_done):
+    segments = manifest.segments
+    stages = {}
+    for segment in segments:
+        for name, stat in segment["stats"].get("stages", {}).items():
+            total = stages.setdefault(name, {"busy_s": 0.0, "wait_in_s": 0.0, "wait_out_s": 0.0, "items": 0})
+            for key in total:
+                total[key] += stat.get(key, 0)
+    stages["stitch"] = {"busy_s": stitcher.busy_s, "wait_in_s": 0.0, "wait_out_s": 0.0, "items": stitcher.frames_done}
+    for stat in stages.values():
+        for key in ("busy_s", "wait_in_s", "wait_out_s"):
+            stat[key] = round(stat[key], 4)
+    first = segments[0]["stats"]
+    stats["keyframes"] = sum(segment["stats"].get("keyframes", 0) for segment in segments)
+    stats["source_size"] = first.get("source_size")
+    stats["processed_size"] = first.get("processed_size")
+    stats["stages"] = stages
+    stats["frames"] = stitcher.frames_done
+    stats["detections"] = len(stitcher.columns)
+    stats["segments"] = len(segments)
+    stats["segments_resumed"] = resumed
+    stats["segment_retries"] = retries_done
+    stats["segment_workers"] = workers_count
+    stats["wall_s"] = round(wall_s, 4)
+    stats["fps"] = round(stitcher.frames_done / wall_s, 2) if wall_s else 0.0
+
+
+def process_video_segmented(input_video_path, unique_name, progress_callback=None, stats=None,
+                            frame_stride=1, adaptive_stride=False, model_name=None, on_frame=None,
+                            decode_max_size=0, workers_count=None, threads=None, segment_seconds=None,
+                            retries=None, loader=None, loader_kwargs=None, inference=None):
+    """
+    То же, что process_video_yolo10m, но видео делится по ключевым кадрам на сегменты примерно
+    по segment_seconds секунд, и сегменты обрабатываются параллельно в workers_count процессах
+    (spawn, в каждом своя копия модели). Каждый сегмент пишет частичное видео и .npz с глобальными
+    номерами кадров в MEDIA/output_video/<имя>.segments; готовые сегменты сразу склеиваются по порядку
+    в выходное видео и общие колонки, on_frame и progress_callback вызываются в порядке кадров.
+    Упавший сегмент (исключение или гибель процесса) повторяется отдельно до retries раз, затем
+    обработка прерывается с SegmentError. Манифест и готовые сегменты при ошибке остаются на диске:
+    повторный вызов для того же unique_name с теми же параметрами обрабатывает только недостающие
+    сегменты. После успешной склейки каталог сегментов удаляется.
+    Склейка перекодирует кадры частичных видео (OpenCV не умеет копировать поток без перекодирования).
+    Видео короче двух сегментов обрабатывается process_video_yolo10m в текущем процессе.
+    Значения по умолчанию – VIDEO_SEGMENT_WORKERS, VIDEO_SEGMENT_THREADS, VIDEO_SEGMENT_SECONDS,
+    VIDEO_SEGMENT_RETRIES, VIDEO_SEGMENT_LOADER. В stats дополнительно: segments, segments_resumed,
+    segment_retries, segment_workers; время склейки – стадия stitch.
+    """
+    if workers_count is None:
+        workers_count = getattr(settings, 'VIDEO_SEGMENT_WORKERS', 0)
+    if threads is None:
+        threads = getattr(settings, 'VIDEO_SEGMENT_THREADS', 0)
+    if segment_seconds is None:
+        segment_seconds = getattr(settings, 'VIDEO_SEGMENT_SECONDS', 10.0)
+    if retries is None:
+        retries = getattr(settings, 'VIDEO_SEGMENT_RETRIES', 2)
+    if loader is None:
+        loader = getattr(settings, 'VIDEO_SEGMENT_LOADER', "")
+    options = {
+        "frame_stride": max(1, int(frame_stride)),
+        "adaptive_stride": bool(adaptive_stride),
+        "model_name": model_name or "",
+        "decode_max_size": int(decode_max_size or 0),
+        "inference": dict(inference or {}),
+    }
+    started = time.perf_counter()
+
+    manifest = SegmentManifest.load(unique_name, input_video_path, options)
+    if manifest is None:
+        cap = cv2.VideoCapture(input_video_path)
+        if not cap.isOpened():
+            raise Exception("Не удалось открыть входное видео.")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        header_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        cap.release()
+        keyframes, frames_total = keyframe_indices(input_video_path)
+        spans = plan_segments(frames_total or header_frames, max(1, round(fps * segment_seconds)), keyframes)
+        if len(spans) < 2:
+            discard(unique_name)
+            return yolo.process_video_yolo10m(
+                input_video_path, unique_name, progress_callback=progress_callback, stats=stats,
+                frame_stride=frame_stride, adaptive_stride=adaptive_stride, model_name=model_name,
+                on_frame=on_frame, decode_max_size=decode_max_size, inference=inference)
+        manifest = SegmentManifest.create(unique_name, input_video_path, options, spans, fps)
+
+    pending = [segment for segment in manifest.segments if not manifest.is_done(segment)]
+    resumed = len(manifest.segments) - len(pending)
+    if resumed:
+        logger.info("Видео %s: продолжение обработки, готово сегментов %s из %s",
+                    unique_name, resumed, len(manifest.segments))
+    workers_count, threads, _ = workers.plan_workers(workers_count, threads)
+    workers_count = max(1, min(workers_count, len(pending)))
+
+    output_path = os.path.join(settings.MEDIA_ROOT, 'output_video', unique_name)
+    stitcher = _Stitcher(manifest, output_path, on_frame, progress_callback)
+    executor = None
+    running = {}
+    retries_done = 0
+
+    def submit(segment):
+        segment["status"] = "running"
+        # Маркер от прошлого запуска задачи не должен указать на сегмент, который ещё не начат
+        try:
+            os.remove(running_marker(manifest.part_path(segment)))
+        except FileNotFoundError:
+            pass
+        future = executor.submit(_run_segment, input_video_path, manifest.part_name(segment),
+                                 segment["start"], segment["end"], options)
+        running[future] = segment
+
+    def failed(segment, error):
+        nonlocal retries_done
+        segment["attempts"] += 1
+        segment["error"] = error
+        if segment["attempts"] > retries:
+            segment["status"] = "failed"
+            manifest.save()
+            raise SegmentError(
+                f"Сегмент {segment['index']} (кадры {segment['start']}–{segment['end']}) "
+                f"не обработан за {segment['attempts']} попыток: {error}")
+        logger.warning("Видео %s: сегмент %s упал (%s), повтор", unique_name, segment["index"], error)
+        segment["status"] = "pending"
+        retries_done += 1
+        pending.append(segment)
+
+    try:
+        stitcher.advance()
+        while pending or running:
+            if executor is None:
+                executor = _create_executor(workers_count, threads, model_name, loader, loader_kwargs)
+            while pending:
+                submit(pending.pop(0))
+            manifest.save()
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            interrupted = []
+            for future in done:
+                segment = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    interrupted.append(segment)
+                    continue
+                except Exception as e:
+                    failed(segment, f"{type(e).__name__}: {e}")
+                    continue
+                segment.update(status="done", error="", frames=result["frames"], stats=result["stats"])
+            if interrupted:
+                # Пул с погибшим процессом не принимает задачи. BrokenProcessPool получают все сегменты
+                # в работе, но виноват только тот, чей процесс погиб сам: его маркер остался
+                # (остальные процессы пул останавливает SIGTERM, и они удаляют свои маркеры)
+                interrupted += running.values()
+                running.clear()
+                executor.shutdown(wait=True, cancel_futures=True)
+                executor = None
+                crashed = [segment for segment in interrupted
+                           if os.path.exists(running_marker(manifest.part_path(segment)))]
+                # Процесс погиб вне сегмента (например, при загрузке модели): виновника не найти,
+                # попытка засчитывается всем, иначе повторы не ограничены
+                crashed = crashed or interrupted
+                innocent = sorted((segment for segment in interrupted if segment not in crashed),
+                                  key=lambda segment: segment["index"])
+                for segment in innocent:
+                    segment["status"] = "pending"
+                pending[:0] = innocent
+                for segment in crashed:
+                    failed(segment, "процесс сегментов завершился аварийно")
+            manifest.save()
+            stitcher.advance()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        stitcher.close()
+
+    stitcher.columns.save(columns_path(output_path))
+    discard(unique_name)
+
+    if stats is not None:
+        _aggregate_stats(stats, manifest, stitcher, time.perf_counter() - started,
+                         workers_count, resumed, retries_done)
+    return unique_name, stitcher.columns.classes(), stitcher.columns
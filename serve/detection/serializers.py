@@ -1,10 +1,66 @@
+import os
+
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
-from .models import DetectionHistory
+from .models import DetectionHistory, VideoJob
 
 class DetectionHistorySerializer(serializers.ModelSerializer):
-    # Преобразуем строку JSON в объект
-    detailed_results = serializers.JSONField()
+    # Детекции хранятся в таблице Detection; для совместимости отдаём их
+    # в прежнем формате списка словарей (class, confidence, bbox[, frame])
+    detailed_results = serializers.SerializerMethodField()
 
     class Meta:
         model = DetectionHistory
         fields = '__all__'
+
+    def get_detailed_results(self, obj) -> list:
+        return obj.get_detailed_results()
+
+
+class DetectionHistoryListSerializer(serializers.ModelSerializer):
+    """
+    Запись истории без детекций – для списка (/api/history/).
+    """
+
+    class Meta:
+        model = DetectionHistory
+        exclude = ('detailed_results',)
+
+
+class VideoJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source='id', read_only=True)
+    eta_seconds = serializers.SerializerMethodField(help_text="Оценка оставшегося времени, сек (null, если неизвестно)")
+    db_record_id = serializers.IntegerField(source='history_id', read_only=True, allow_null=True)
+    output_video_url = serializers.SerializerMethodField()
+    detections_url = serializers.SerializerMethodField(help_text="Детекции задачи (JSON; .npz – с output=npz)")
+
+    class Meta:
+        model = VideoJob
+        fields = (
+            'job_id', 'status', 'video_url', 'model_name', 'frame_stride', 'adaptive_stride', 'target_height', 'decode_max_size',
+            'inference', 'frames_done', 'frames_total', 'fps', 'eta_seconds',
+            'stage_timings', 'error', 'db_record_id', 'output_video_url', 'detections_url', 'created_at', 'started_at', 'finished_at',
+        )
+
+    def get_eta_seconds(self, obj) -> float | None:
+        if obj.status == VideoJob.STATUS_DONE:
+            return 0.0
+        if obj.status != VideoJob.STATUS_RUNNING or not obj.fps or not obj.frames_total:
+            return None
+        return round(max(obj.frames_total - obj.frames_done, 0) / obj.fps, 1)
+
+    def get_output_video_url(self, obj) -> str | None:
+        # Запись истории появляется в начале обработки, а видео готово только по её завершении
+        if obj.history_id is None or obj.status != VideoJob.STATUS_DONE:
+            return None
+        url = os.path.join(settings.MEDIA_URL, obj.history.path)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def get_detections_url(self, obj) -> str | None:
+        if obj.history_id is None or obj.status != VideoJob.STATUS_DONE:
+            return None
+        url = reverse('history_detections', args=[obj.history_id])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
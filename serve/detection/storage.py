@@ -0,0 +1,184 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def decode_image(data):
+    """
+    Декодирует байты изображения в кадр BGR (numpy) один раз – без записи на диск.
+    Бросает ValueError, если байты не являются изображением.
+    """
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR) if data else None
+    if frame is None:
+        raise ValueError("Не удалось открыть изображение: неподдерживаемый или повреждённый файл.")
+    return frame
+
+
+# Форматы сохраняемых изображений: расширение и параметр качества OpenCV
+IMAGE_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+    "avif": (".avif", getattr(cv2, "IMWRITE_AVIF_QUALITY", None)),
+}
+
+
+def encode_image(frame, image_format="jpeg", quality=75, max_size=0):
+    """
+    Кодирует кадр BGR в image_format (jpeg, webp, avif) с качеством quality (1-100),
+    предварительно уменьшив его до max_size по длинной стороне (0 – без изменения).
+    Возвращает (байты, расширение). Если OpenCV собран без AVIF, кодирует Pillow.
+    Бросает ValueError для неизвестного или неподдерживаемого формата.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Неизвестный формат изображения {image_format}. Доступные: {', '.join(IMAGE_FORMATS)}.")
+    extension, quality_flag = IMAGE_FORMATS[image_format]
+    height, width = frame.shape[:2]
+    if max_size and max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+    ok, encoded = False, None
+    try:
+        ok, encoded = cv2.imencode(extension, frame, [quality_flag, int(quality)] if quality_flag is not None else [])
+    except cv2.error:
+        ok = False
+    if ok:
+        return encoded.tobytes(), extension
+
+    from PIL import Image, features
+    if image_format != "avif" or not features.check("avif"):
+        raise ValueError(f"Кодирование в {image_format} не поддерживается.")
+    buffer = io.BytesIO()
+    Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).save(buffer, "AVIF", quality=int(quality))
+    return buffer.getvalue(), extension
+
+
+def encode_output(frame):
+    """
+    Аннотированное изображение в формате OUTPUT_IMAGE_FORMAT с качеством OUTPUT_IMAGE_QUALITY,
+    не больше OUTPUT_PREVIEW_MAX_SIZE по длинной стороне. Возвращает (байты, расширение).
+    """
+    return encode_image(
+        frame,
+        getattr(settings, 'OUTPUT_IMAGE_FORMAT', "jpeg"),
+        getattr(settings, 'OUTPUT_IMAGE_QUALITY', 75),
+        getattr(settings, 'OUTPUT_PREVIEW_MAX_SIZE', 0),
+    )
+
+
+def image_shape(frame):
+    """
+    Размер кадра в формате WxH.
+    """
+    height, width = frame.shape[:2]
+    return f"{width}x{height}"
+
+
+def get_executor():
+    """
+    Пул потоков для фоновой записи входных файлов (INPUT_PERSIST_WORKERS).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'INPUT_PERSIST_WORKERS', 2),
+                thread_name_prefix="input-persist",
+            )
+    return _executor
+
+
+def write_file(path, data):
+    """
+    Атомарно записывает байты в path (через временный файл и os.replace).
+    """
+    with metrics.stage("persist"):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+def _forget(future):
+    with _pending_lock:
+        _pending.discard(future)
+    if future.exception() is not None:
+        logger.error("Не удалось сохранить входной файл", exc_info=future.exception())
+
+
+def _write_input(path, relative_path, data):
+    write_file(path, data)
+    return relative_path
+
+
+def persist_input(relative_path, data):
+    """
+    Начинает сохранение исходного файла в MEDIA/relative_path и возвращает Future,
+    результат которого – relative_path ("" если сохранение отключено, INPUT_PERSIST_ENABLED = False).
+    При INPUT_PERSIST_ASYNC запись идёт в фоне параллельно инференсу; перед сохранением записи
+    в историю нужно дождаться future.result() – он бросает OSError, если файл не записан,
+    и запись не должна ссылаться на несуществующий файл.
+    """
+    if not getattr(settings, 'INPUT_PERSIST_ENABLED', True):
+        future = Future()
+        future.set_result("")
+        return future
+    path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    if not getattr(settings, 'INPUT_PERSIST_ASYNC', True):
+        future = Future()
+        try:
+            future.set_result(_write_input(path, relative_path, data))
+        except OSError as e:
+            future.set_exception(e)
+        return future
+    future = get_executor().submit(_write_input, path, relative_path, data)
+    with _pending_lock:
+        _pending.add(future)
+    future.add_done_callback(_forget)
+    return future
+
+
+def remove_media(relative_path):
+    """
+    Удаляет файл MEDIA/relative_path, если он есть (файл без записи в истории).
+    """
+    try:
+        os.remove(os.path.join(settings.MEDIA_ROOT, relative_path))
+    except OSError:
+        pass
+
+
+def discard_input(future):
+    """
+    Удаляет файл, начатый persist_input, когда запись в историю не состоялась (ошибка обработки).
+    """
+    def remove(done):
+        if done.exception() is None and done.result():
+            remove_media(done.result())
+
+    future.add_done_callback(remove)
+
+
+def wait_pending(timeout=None):
+    """
+    Ждёт завершения фоновых записей (для тестов и корректной остановки).
+    """
+    with _pending_lock:
+        pending = list(_pending)
+    wait(pending, timeout=timeout)
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from .models import Detection, VideoJob
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON: одно событие – одна строка.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_ndjson(data)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Server-Sent Events (text/event-stream).
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_sse(data)
+
+
+def format_ndjson(event):
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def format_sse(event):
+    """
+    Событие SSE; у кадров id – номер кадра, чтобы клиент мог продолжить с Last-Event-ID.
+    """
+    lines = []
+    if isinstance(event, dict) and "event" in event:
+        if event["event"] == "frame":
+            lines.append(f"id: {event['frame']}")
+        lines.append(f"event: {event['event']}")
+    lines.append(f"data: {json.dumps(event, ensure_ascii=False)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class StreamSlots:
+    """
+    Счётчик одновременно открытых потоков событий (задач по видео и живых потоков).
+    Поток событий держит поток обработки запроса до своего конца, поэтому на синхронном
+    WSGI-воркере каждый открытый поток занимает его целиком; acquire отказывает сверх limit
+    (VIDEO_STREAM_MAX_CONCURRENT, 0 – без ограничения), чтобы потоки не заняли все воркеры.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, limit):
+        with self._lock:
+            if limit and self.active >= limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+event_stream_slots = StreamSlots()
+
+
+def iter_job_events(job_id, from_frame=0):
+    """
+    Генератор событий задачи по видео, пока она выполняется:
+      - {"event": "frame", "frame": N, "detections": [...]} – по порядку для каждого кадра,
+        в том числе без детекций;
+      - {"event": "progress", "frames_done", "frames_total", "fps"} – при изменении прогресса;
+      - {"event": "done" | "failed", ...} – последнее событие;
+      - {"event": "timeout", "next_frame": N} – последнее событие, если поток открыт дольше
+        VIDEO_STREAM_MAX_SECONDS (0 – без ограничения): клиент переподключается с from_frame=N.
+    Детекции читаются из таблицы Detection окнами по VIDEO_STREAM_WINDOW_FRAMES кадров,
+    поэтому память не зависит от длины видео. Между опросами БД – пауза VIDEO_STREAM_POLL_INTERVAL;
+    если новых событий нет дольше VIDEO_STREAM_KEEPALIVE секунд, выдаётся None (keep-alive).
+    """
+    poll_interval = getattr(settings, 'VIDEO_STREAM_POLL_INTERVAL', 0.5)
+    window = getattr(settings, 'VIDEO_STREAM_WINDOW_FRAMES', 100)
+    keepalive = getattr(settings, 'VIDEO_STREAM_KEEPALIVE', 15.0)
+    max_seconds = getattr(settings, 'VIDEO_STREAM_MAX_SECONDS', 600)
+    next_frame = max(0, int(from_frame))
+    last_progress = None
+    last_event = started = time.monotonic()
+
+    while True:
+        job = (VideoJob.objects
+               .filter(pk=job_id)
+               .values('status', 'frames_done', 'frames_total', 'fps', 'history_id', 'error')
+               .first())
+        if job is None:
+            return
+        finished = job['status'] in (VideoJob.STATUS_DONE, VideoJob.STATUS_FAILED)
+
+        # Детекции кадров с номером меньше frames_done уже записаны (см. jobs._ProgressReporter)
+        if job['history_id'] is not None and job['status'] != VideoJob.STATUS_FAILED:
+            while next_frame < job['frames_done']:
+                upto = min(job['frames_done'], next_frame + window)
+                yield from _frame_events(job['history_id'], next_frame, upto)
+                next_frame = upto
+                last_event = time.monotonic()
+
+        if finished:
+            final = {"event": job['status'], "frames_done": job['frames_done'], "db_record_id": job['history_id']}
+            if job['error']:
+                final["error"] = job['error']
+            yield final
+            return
+
+        if max_seconds and time.monotonic() - started >= max_seconds:
+            yield {"event": "timeout", "next_frame": next_frame}
+            return
+
+        progress = (job['frames_done'], job['frames_total'])
+        if progress != last_progress:
+            last_progress = progress
+            last_event = time.monotonic()
+            yield {"event": "progress", "frames_done": job['frames_done'],
+                   "frames_total": job['frames_total'], "fps": job['fps']}
+        elif time.monotonic() - last_event >= keepalive:
+            last_event = time.monotonic()
+            yield None
+        time.sleep(poll_interval)
+
+
+def _frame_events(history_id, start, stop):
+    detections = (Detection.objects
+                  .filter(history_id=history_id, frame__gte=start, frame__lt=stop)
+                  .order_by('frame', 'id'))
+    by_frame = {}
+    for detection in detections.iterator():
+        detail = detection.as_dict()
+        detail.pop("frame", None)
+        by_frame.setdefault(detection.frame, []).append(detail)
+    for frame in range(start, stop):
+        yield {"event": "frame", "frame": frame, "detections": by_frame.get(frame, [])}
@@ -1,3 +1,1739 @@
-from django.test import TestCase
+import datetime
+import importlib.util
+import io
+import itertools
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+import cv2
+import numpy as np
+import torch
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from ultralytics import YOLO
+
+from . import apps, benchmark, columnar, engines, jobs, live, metrics, render, resolution, segments, storage, tiling, yolo
+from .cache import ResultCache, entry_from_record
+from .fetcher import Fetcher, FetchError, FetchResult, fetcher
+from .models import Detection, DetectionHistory, VideoJob
+from .persistence import HistoryWriter
+from .registry import registry
+from .streaming import event_stream_slots
+from .tracker import IoUTracker, iou_matrix
+from .video_pipeline import StagedPipeline
+from .workers import WorkerError, WorkerPool, plan_workers
+
+
+@unittest.skipUnless(importlib.util.find_spec("onnxruntime"), "onnxruntime не установлен")
+class OnnxBackendParityTests(SimpleTestCase):
+    """
+    Детекции ONNX-движка совпадают с PyTorch-движком на тех же весах.
+    Используется модель со случайными весами из yaml, чтобы тест не зависел от сети.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        torch.manual_seed(0)
+        cls.weights = os.path.join(cls.tmp.name, "parity.pt")
+        YOLO("yolov10n.yaml").save(cls.weights)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def test_detections_match_torch(self):
+        frames = [np.random.default_rng(seed).integers(0, 255, (480, 640, 3), dtype=np.uint8) for seed in (1, 2)]
+        with override_settings(YOLO_EXPORT_DIR=os.path.join(self.tmp.name, "export")):
+            onnx_model = engines.load_model(self.weights, "onnx")
+        torch_model = YOLO(self.weights)
+
+        # Случайные веса дают очень низкую уверенность, поэтому порог почти нулевой
+        expected = torch_model(frames, conf=1e-6, verbose=False)
+        actual = onnx_model(frames, conf=1e-6)
+
+        for exp, act in zip(expected, actual):
+            self.assertEqual(exp.names, act.names)
+            self.assertEqual(len(exp.boxes), len(act.boxes))
+            np.testing.assert_allclose(act.boxes.xyxy.numpy(), exp.boxes.xyxy.numpy(), atol=0.5)
+            np.testing.assert_allclose(act.boxes.conf.numpy(), exp.boxes.conf.numpy(), atol=1e-4)
+            np.testing.assert_array_equal(act.boxes.cls.numpy(), exp.boxes.cls.numpy())
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """
+    Локальный HTTP-сервер для тестов загрузчика.
+    """
+    protocol_version = "HTTP/1.1"
+    body = b"x" * 200_000
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.connections.add(self.client_address)
+        server.requests.append((self.path, dict(self.headers)))
+        if self.path == "/etag":
+            if self.headers.get("If-None-Match") == '"v1"':
+                return self._reply(304, b"", {"ETag": '"v1"'})
+            return self._reply(200, self.body, {"ETag": '"v1"'})
+        if self.path == "/last-modified":
+            stamp = "Wed, 21 Oct 2015 07:28:00 GMT"
+            if self.headers.get("If-Modified-Since") == stamp:
+                return self._reply(304, b"", {"Last-Modified": stamp})
+            return self._reply(200, self.body, {"Last-Modified": stamp})
+        if self.path == "/chunked":
+            # Без Content-Length: размер проверяется по мере чтения
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for _ in range(4):
+                chunk = self.body[:100_000]
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        if self.path == "/slow":
+            time.sleep(1.0)
+            return self._reply(200, b"late")
+        if self.path == "/missing":
+            return self._reply(404, b"no")
+        return self._reply(200, self.body)
+
+    def _reply(self, code, body, headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FetcherTests(SimpleTestCase):
+    """
+    Загрузчик ссылок против локального HTTP-сервера.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+        cls.server.daemon_threads = True
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.connections = set()
+        self.server.requests = []
+        self.fetcher = Fetcher(connect_timeout=1.0, read_timeout=0.3, max_bytes=300_000,
+                               retries=0, cache_bytes=1_000_000)
+
+    def test_reuses_connection_per_host(self):
+        for _ in range(3):
+            self.assertEqual(self.fetcher.fetch(f"{self.base}/plain").data, _StandInHandler.body)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_etag_revalidation(self):
+        first = self.fetcher.fetch(f"{self.base}/etag")
+        second = self.fetcher.fetch(f"{self.base}/etag")
+        self.assertFalse(first.revalidated)
+        self.assertTrue(second.revalidated)
+        self.assertEqual(second.data, _StandInHandler.body)
+        self.assertEqual(self.server.requests[1][1].get("If-None-Match"), '"v1"')
+
+    def test_last_modified_revalidation(self):
+        self.fetcher.fetch(f"{self.base}/last-modified")
+        second = self.fetcher.fetch(f"{self.base}/last-modified")
+        self.assertTrue(second.revalidated)
+        self.assertEqual(self.fetcher.stats()["not_modified"], 1)
+
+    def test_max_bytes(self):
+        with self.assertRaises(FetchError):
+            self.fetcher.fetch(f"{self.base}/plain", max_bytes=1000)
+        # Без Content-Length лимит срабатывает во время чтения
+        with self.assertRaises(FetchError):
+            self.fetcher.fetch(f"{self.base}/chunked", max_bytes=250_000)
+        self.assertEqual(len(self.fetcher.fetch(f"{self.base}/chunked", max_bytes=500_000).data), 400_000)
+
+    def test_read_timeout_and_status(self):
+        with self.assertRaises(FetchError):
+            self.fetcher.fetch(f"{self.base}/slow")
+        with self.assertRaises(FetchError):
+            self.fetcher.fetch(f"{self.base}/missing")
+        with self.assertRaises(FetchError):
+            self.fetcher.fetch("ftp://127.0.0.1/file")
+
+    def test_download_streams_to_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "video.mp4")
+            self.assertEqual(self.fetcher.download(f"{self.base}/chunked", path, max_bytes=500_000), 400_000)
+            self.assertEqual(os.path.getsize(path), 400_000)
+            with self.assertRaises(FetchError):
+                self.fetcher.download(f"{self.base}/chunked", os.path.join(tmp, "big.mp4"), max_bytes=250_000)
+            self.assertEqual(sorted(os.listdir(tmp)), ["video.mp4"])
+
+    def test_fetch_many_keeps_order(self):
+        results = self.fetcher.fetch_many([f"{self.base}/plain", f"{self.base}/missing", f"{self.base}/etag"])
+        self.assertEqual(results[0].data, _StandInHandler.body)
+        self.assertIsInstance(results[1], FetchError)
+        self.assertEqual(results[2].etag, '"v1"')
+
+
+class BenchmarkHarnessTests(SimpleTestCase):
+    """
+    Заглушка модели и сравнение отчётов бенчмарка (manage.py benchmark).
+    """
+
+    def test_stub_model_is_deterministic(self):
+        model = benchmark.StubModel(names={0: "person", 1: "car"}, boxes_per_frame=4, batch_ms=0, frame_ms=0)
+        first, second = (benchmark.synthetic_frame(320, 240, seed) for seed in (1, 2))
+        again = model([first, second])
+        results = model([first, second])
+        self.assertTrue(torch.equal(results[0].boxes.data, again[0].boxes.data))
+        self.assertFalse(torch.equal(results[0].boxes.data, results[1].boxes.data))
+        self.assertEqual(len(results[0].boxes), 4)
+        boxes = results[0].boxes.xyxy.numpy()
+        self.assertTrue((boxes >= 0).all())
+        self.assertTrue((boxes[:, 2] <= 320).all() and (boxes[:, 3] <= 240).all())
+
+    def test_compare_reports_regressions(self):
+        def report(p50, throughput):
+            return {"results": [{"scenario": "yolo_image", "params": "640x480 c=1",
+                                 "latency_ms": {"p50": p50, "p95": p50 * 1.2}, "throughput_per_s": throughput}]}
+
+        self.assertEqual(benchmark.compare(report(10.5, 98), report(10, 100), threshold=0.1), [])
+        regressions = benchmark.compare(report(13, 70), report(10, 100), threshold=0.1)
+        self.assertEqual(len(regressions), 3)
+        self.assertIn("yolo_image[640x480 c=1]: p50 10 -> 13", regressions[0])
+
+
+class MetricsTests(TestCase):
+    """
+    Гистограммы стадий, эндпоинт /metrics и заголовок Server-Timing.
+    """
+
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram("test_seconds", "Тест", labelnames=("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, stage="decode")
+        lines = list(histogram.collect())
+        self.assertIn('test_seconds_bucket{stage="decode",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="decode",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="decode",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{stage="decode"} 3', lines)
+
+    def test_metrics_endpoint_and_server_timing(self):
+        for status in (VideoJob.STATUS_QUEUED, VideoJob.STATUS_QUEUED, VideoJob.STATUS_RUNNING):
+            VideoJob.objects.create(video_url="http://example.com/v.mp4", status=status)
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn("# TYPE detection_stage_seconds histogram", body)
+        # Gauge задач читает VideoJob из БД (в SimpleTestCase запрос запрещён и метрика молча пропадала)
+        self.assertIn("# TYPE detection_video_jobs gauge", body)
+        self.assertIn(f'detection_video_jobs{{status="{VideoJob.STATUS_QUEUED}"}} 2', body)
+        self.assertIn(f'detection_video_jobs{{status="{VideoJob.STATUS_RUNNING}"}} 1', body)
+        self.assertIn("total;dur=", response["Server-Timing"])
+        with override_settings(SERVER_TIMING_ENABLED=False):
+            self.assertFalse(self.client.get("/metrics").has_header("Server-Timing"))
+
+
+class ServingProcessTests(SimpleTestCase):
+    def check(self, argv, environ):
+        with mock.patch.object(apps.sys, "argv", argv), mock.patch.dict(apps.os.environ, environ, clear=True):
+            return apps._is_serving_process()
+
+    def test_preload_only_when_serving(self):
+        self.assertTrue(self.check(["/srv/venv/bin/gunicorn", "image_work.wsgi"], {"DETECTION_SERVING": "1"}))
+        self.assertTrue(self.check(["manage.py", "runserver"], {"RUN_MAIN": "true"}))
+        self.assertTrue(self.check(["manage.py", "runserver", "--noreload"], {}))
+        # Наблюдатель автоперезагрузки, служебные команды и посторонние скрипты модели не грузят
+        self.assertFalse(self.check(["manage.py", "runserver"], {}))
+        self.assertFalse(self.check(["manage.py", "migrate"], {}))
+        self.assertFalse(self.check(["/usr/bin/celery", "worker"], {}))
+        self.assertFalse(self.check(["pytest"], {}))
+
+
+class _GatedStub(benchmark.StubModel):
+    """
+    Заглушка, записывающая вызовы (число кадров, imgsz); первый вызов ждёт gate,
+    пока тест набирает очередь, а при fail бросает исключение.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(boxes_per_frame=2, batch_ms=0, frame_ms=0, **kwargs)
+        self.calls = []
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.fail = False
+
+    def __call__(self, source, **kwargs):
+        self.started.set()
+        self.gate.wait(5)
+        self.calls.append((len(source), kwargs.get("imgsz")))
+        if self.fail:
+            raise RuntimeError("сбой модели")
+        return super().__call__(source, **kwargs)
+
+
+class InferenceSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = _GatedStub()
+        registry.register("test-sched", self.stub)
+        self.addCleanup(registry.unload, "test-sched")
+        self.addCleanup(self.stub.gate.set)
+        self.frames = [benchmark.synthetic_frame(64, 48, seed=seed) for seed in range(8)]
+
+    def scheduler(self, **kwargs):
+        return yolo.InferenceScheduler(model_name="test-sched", **{"max_batch_size": 4, "max_wait_ms": 20, **kwargs})
+
+    def test_queued_frames_are_batched_up_to_max_batch_size(self):
+        scheduler = self.scheduler()
+        first = scheduler.submit(self.frames[0])
+        self.assertTrue(self.stub.started.wait(5))
+        # Пока модель занята, кадры копятся в очереди и уходят пачками не больше max_batch_size
+        futures = [scheduler.submit(frame) for frame in self.frames[1:6]]
+        self.stub.gate.set()
+        self.assertEqual(first.result(5)[1]["batch_size"], 1)
+        infos = [future.result(5)[1] for future in futures]
+        self.assertEqual([info["batch_size"] for info in infos], [4, 4, 4, 4, 1])
+        self.assertEqual(self.stub.calls, [(1, None), (4, None), (1, None)])
+        # Каждый получает результат своего кадра
+        for frame, future in zip(self.frames[1:6], futures):
+            expected = self.stub([frame])[0].boxes.data
+            self.assertTrue(torch.equal(future.result(5)[0].boxes.data, expected))
+
+    def test_batch_is_split_by_inference_options(self):
+        scheduler = self.scheduler(max_batch_size=8)
+        scheduler.submit(self.frames[0])
+        self.assertTrue(self.stub.started.wait(5))
+        options = [{"imgsz": 320}, {"imgsz": 640}, {"imgsz": 320}, {"imgsz": 640}, {"imgsz": 320}]
+        futures = [scheduler.submit(frame, opts) for frame, opts in zip(self.frames[1:], options)]
+        self.stub.gate.set()
+        self.assertEqual([future.result(5)[1]["batch_size"] for future in futures], [3, 2, 3, 2, 3])
+        self.assertEqual(sorted(self.stub.calls[1:]), [(2, 640), (3, 320)])
+
+    def test_first_frame_waits_at_most_max_wait(self):
+        self.stub.gate.set()
+        scheduler = self.scheduler(max_wait_ms=100)
+        started = time.monotonic()
+        result, info = scheduler.submit(self.frames[0]).result(5)
+        elapsed = time.monotonic() - started
+        # Одиночный кадр уходит в модель по истечении max_wait, не дожидаясь полного батча
+        self.assertEqual(info["batch_size"], 1)
+        self.assertGreaterEqual(info["queue_wait_ms"], 90)
+        self.assertLess(elapsed, 1.0)
+
+        # Кадр, пришедший в пределах ожидания первого, попадает в тот же батч
+        first = scheduler.submit(self.frames[1])
+        time.sleep(0.02)
+        second = scheduler.submit(self.frames[2])
+        self.assertEqual([first.result(5)[1]["batch_size"], second.result(5)[1]["batch_size"]], [2, 2])
+
+    def test_error_is_set_on_every_future_of_the_batch(self):
+        scheduler = self.scheduler()
+        first = scheduler.submit(self.frames[0])
+        self.assertTrue(self.stub.started.wait(5))
+        futures = [scheduler.submit(frame) for frame in self.frames[1:4]]
+        self.stub.fail = True
+        self.stub.gate.set()
+        for future in [first, *futures]:
+            with self.assertRaisesMessage(RuntimeError, "сбой модели"):
+                future.result(5)
+        # Поток планировщика после ошибки продолжает работать
+        self.stub.fail = False
+        self.assertEqual(scheduler.submit(self.frames[4]).result(5)[1]["batch_size"], 1)
+
+
+class WorkerPoolTests(SimpleTestCase):
+    """
+    Пул процессов инференса с заглушкой модели: результаты, распределение ядер, перезапуск.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = {"names": {0: "person", 1: "car"}, "boxes_per_frame": 3, "batch_ms": 0, "frame_ms": 0}
+        cls.pool = WorkerPool("stub", workers=1, threads=1, shm_bytes=2 * 1024 * 1024, timeout=10,
+                              health_interval=0.2, loader="detection.benchmark.stub_loader",
+                              loader_kwargs=cls.stub, warmup_size=32).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.stop()
+        super().tearDownClass()
+
+    def test_plan_workers(self):
+        self.assertEqual(plan_workers(0, 0, cpus=range(8)), (8, 1, [[i] for i in range(8)]))
+        self.assertEqual(plan_workers(2, 0, cpus=range(8)), (2, 4, [[0, 1, 2, 3], [4, 5, 6, 7]]))
+        # Ядер на всех не хватает – без привязки
+        self.assertEqual(plan_workers(4, 2, cpus=range(4)), (4, 2, [None] * 4))
+
+    def test_results_match_in_process_model(self):
+        # Третий кадр больше блока разделяемой памяти: уходит отдельным вызовом через канал
+        frames = [benchmark.synthetic_frame(640, 480, seed) for seed in range(2)] + [benchmark.synthetic_frame(1024, 768, 3)]
+        expected = benchmark.StubModel(**self.stub)(frames)
+        results = self.pool.predict(frames)
+        self.assertEqual(len(results), 3)
+        for frame, result, reference in zip(frames, results, expected):
+            self.assertTrue(torch.equal(result.boxes.data, reference.boxes.data))
+            self.assertEqual(result.names, reference.names)
+            self.assertIs(result.orig_img, frame)
+
+    def test_crashed_worker_is_restarted(self):
+        frame = benchmark.synthetic_frame(64, 64)
+        self.pool.predict([frame])
+        pid = self.pool.stats()["workers"][0]["pid"]
+        os.kill(pid, signal.SIGKILL)
+        with self.assertRaises(WorkerError):
+            self.pool.predict([frame])
+        deadline = time.monotonic() + 60
+        while self.pool.stats()["workers"][0]["state"] != "idle" and time.monotonic() < deadline:
+            time.sleep(0.1)
+        stats = self.pool.stats()
+        self.assertGreaterEqual(stats["restarts"], 1)
+        self.assertNotEqual(stats["workers"][0]["pid"], pid)
+        self.assertEqual(len(self.pool.predict([frame])[0].boxes), 3)
+
+
+class CompactMediaTests(TestCase):
+    """
+    manage.py compact_media: перекодирование и удаление файлов старых записей истории.
+    """
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media.name))
+        for subdir in ("input_img", "output_img"):
+            os.makedirs(os.path.join(self.media.name, subdir))
+        self.old = self._record("old.png", days=40)
+        self.recent = self._record("recent.png", days=1)
+
+    def _record(self, name, days):
+        frame = benchmark.synthetic_frame(800, 600, seed=days)
+        for subdir in ("input_img", "output_img"):
+            cv2.imwrite(os.path.join(self.media.name, subdir, name), frame)
+        record = DetectionHistory.objects.create(
+            image_name=name, shape="800x600", classes_from_img="", source_type="file",
+            path=os.path.join("output_img", name), input_path=os.path.join("input_img", name),
+        )
+        DetectionHistory.objects.filter(pk=record.pk).update(
+            datetime_input=timezone.now() - datetime.timedelta(days=days))
+        return record
+
+    def _exists(self, relative):
+        return os.path.exists(os.path.join(self.media.name, relative))
+
+    def test_reencode_updates_paths(self):
+        out = io.StringIO()
+        call_command("compact_media", days=30, format="webp", max_size=400, stdout=out)
+        self.old.refresh_from_db()
+        self.assertEqual(self.old.path, "output_img/old.webp")
+        self.assertEqual(self.old.input_path, "input_img/old.webp")
+        self.assertFalse(self._exists("output_img/old.png"))
+        preview = cv2.imread(os.path.join(self.media.name, self.old.path))
+        self.assertEqual(preview.shape[:2], (300, 400))
+        # Исходное изображение не уменьшается: боксы должны совпадать при отрисовке
+        self.assertEqual(cv2.imread(os.path.join(self.media.name, self.old.input_path)).shape[:2], (600, 800))
+        self.recent.refresh_from_db()
+        self.assertEqual(self.recent.path, "output_img/recent.png")
+        self.assertIn("Перекодировано: 2 файлов", out.getvalue())
+
+    def test_delete_and_dry_run(self):
+        out = io.StringIO()
+        call_command("compact_media", days=30, outputs="delete", inputs="keep", dry_run=True, stdout=out)
+        self.assertIn("[dry-run] Удалено: 1 файлов", out.getvalue())
+        self.assertTrue(self._exists("output_img/old.png"))
+
+        call_command("compact_media", days=30, outputs="delete", inputs="keep", stdout=io.StringIO())
+        self.old.refresh_from_db()
+        self.assertEqual((self.old.path, self.old.input_path), ("", "input_img/old.png"))
+        self.assertFalse(self._exists("output_img/old.png"))
+        self.assertTrue(self._exists("input_img/old.png"))
+
+
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def entry(self, name, record_id=1):
+        with open(os.path.join(self.media, name), "wb") as f:
+            f.write(b"jpeg")
+        return {"record_id": record_id, "image_name": name, "shape": "1x1", "path": name,
+                "input_path": "", "detected_classes": [], "detected_details": []}
+
+    def test_lru_is_bounded_by_bytes(self):
+        entries = {key: self.entry(f"{key}.jpg") for key in "abcd"}
+        size = len(json.dumps(entries["a"], ensure_ascii=False))
+        cache = ResultCache(max_bytes=size * 3)
+        for key in "abc":
+            cache.put(key, entries[key])
+        # Обращение к "a" делает её свежей: при добавлении "d" вытесняется самая старая – "b"
+        self.assertEqual(cache.get("a"), entries["a"])
+        cache.put("d", entries["d"])
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"]), (3, size * 3))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), entries["c"])
+        self.assertEqual(cache.stats()["memory_hits"], 2)
+        # Запись больше всего кэша в память не кладётся
+        cache.put("huge", {**entries["a"], "detected_details": ["x" * size * 3]})
+        self.assertNotIn("huge", cache._entries)
+        self.assertEqual(ResultCache(max_bytes=0).stats()["entries"], 0)
+
+    def test_falls_back_to_db_and_drops_missing_files(self):
+        self.entry("out.jpg")
+        record = DetectionHistory.objects.create(image_name="in.jpg", shape="1x1", classes_from_img="car",
+                                                 path="out.jpg", input_path="", content_hash="k")
+        Detection.objects.create(history=record, class_name="car", confidence=0.8, x1=1, y1=2, x2=3, y2=4)
+        cache = ResultCache(max_bytes=10 ** 6)
+        entry = cache.get("k")
+        self.assertEqual(entry, entry_from_record(record))
+        self.assertEqual(entry["detected_details"][0]["class"], "car")
+        self.assertEqual(cache.get("k"), entry)
+        self.assertEqual(cache.get("missing"), None)
+        self.assertEqual({name: cache.stats()[name] for name in ("db_hits", "memory_hits", "misses")},
+                         {"db_hits": 1, "memory_hits": 1, "misses": 1})
+        # Файл удалён (compact_media): запись вытесняется из памяти, а без файла – промах
+        os.remove(os.path.join(self.media, "out.jpg"))
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class HistoryListTests(TestCase):
+    def setUp(self):
+        self.ids = {}
+        base = timezone.make_aware(datetime.datetime(2024, 5, 10, 12, 0))
+        rows = [
+            # имя, источник, смещение, детекции (класс, уверенность)
+            ("a", "file", datetime.timedelta(days=-2), [("car", 0.9)]),
+            ("b", "url", datetime.timedelta(days=-1), [("person", 0.4), ("car", 0.3)]),
+            ("c", "video", datetime.timedelta(0), [("person", 0.8)]),
+            ("d", "file", datetime.timedelta(0), []),
+            ("e", "url", datetime.timedelta(hours=3), [("dog", 0.6)]),
+        ]
+        for name, source_type, offset, detections in rows:
+            record = DetectionHistory.objects.create(image_name=name, shape="1x1", classes_from_img="",
+                                                     path="", input_path="", source_type=source_type)
+            DetectionHistory.objects.filter(pk=record.pk).update(datetime_input=base + offset)
+            Detection.objects.bulk_create(Detection(history=record, class_name=cls, confidence=conf,
+                                                    x1=0, y1=0, x2=1, y2=1) for cls, conf in detections)
+            self.ids[name] = record.pk
+
+    def names(self, **params):
+        response = self.client.get("/api/history/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row["image_name"] for row in response.json()["results"]]
+
+    def test_filters(self):
+        self.assertEqual(self.names(), ["e", "d", "c", "b", "a"])
+        self.assertEqual(self.names(**{"class": "car"}), ["b", "a"])
+        self.assertEqual(self.names(**{"class": "car", "min_confidence": 0.5}), ["a"])
+        self.assertEqual(self.names(**{"class": "person", "min_confidence": 0.5}), ["c"])
+        self.assertEqual(self.names(source_type="url"), ["e", "b"])
+        # Дата без времени в date_to включается целиком
+        self.assertEqual(self.names(date_from="2024-05-09", date_to="2024-05-10"), ["e", "d", "c", "b"])
+        self.assertEqual(self.names(date_to="2024-05-10T12:00:00+00:00"), ["d", "c", "b", "a"])
+        self.assertEqual(self.names(**{"class": "car", "source_type": "file"}), ["a"])
+        for params in ({"min_confidence": 0.5}, {"class": "car", "min_confidence": "high"}, {"date_from": "вчера"}):
+            response = self.client.get("/api/history/", params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("error", response.json())
+
+    def test_cursor_pages_cover_records_once(self):
+        names, url, pages = [], "/api/history/?page_size=2", 0
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page["results"]), 2)
+            self.assertNotIn("detailed_results", page["results"][0])
+            names += [row["image_name"] for row in page["results"]]
+            url, pages = page["next"], pages + 1
+        # c и d записаны в один момент: порядок между ними задаёт id, страницы их не теряют и не повторяют
+        self.assertEqual(names, ["e", "d", "c", "b", "a"])
+        self.assertEqual(pages, 3)
+
+        first = self.client.get("/api/history/", {"page_size": 2, "include_details": "true"}).json()
+        self.assertEqual(first["results"][0]["detailed_results"][0]["class"], "dog")
+        previous = self.client.get(self.client.get(first["next"]).json()["previous"]).json()
+        self.assertEqual([row["image_name"] for row in previous["results"]], ["e", "d"])
+
+
+class VideoJobLeaseTests(TestCase):
+    """
+    Восстановление задач по видео при старте процесса не трогает задачи живых процессов.
+    """
+
+    def _job(self, status, owner="", heartbeat_age=None):
+        heartbeat_at = timezone.now() - datetime.timedelta(seconds=heartbeat_age) if heartbeat_age is not None else None
+        return VideoJob.objects.create(video_url="http://example.com/v.mp4", status=status,
+                                       owner=owner, heartbeat_at=heartbeat_at)
+
+    @override_settings(VIDEO_JOB_LEASE_SECONDS=60)
+    def test_only_expired_leases_are_taken_over(self):
+        alive = self._job(VideoJob.STATUS_RUNNING, "other:1", heartbeat_age=5)
+        expired = self._job(VideoJob.STATUS_RUNNING, "other:2", heartbeat_age=120)
+        queued = self._job(VideoJob.STATUS_QUEUED)
+        with mock.patch.object(jobs, "submit_video_job") as submit:
+            self.assertEqual(jobs.resume_pending_jobs(), 2)
+        self.assertEqual(sorted(call.args[0] for call in submit.call_args_list), sorted([expired.id, queued.id]))
+        alive.refresh_from_db()
+        self.assertEqual((alive.status, alive.owner), (VideoJob.STATUS_RUNNING, "other:1"))
+        expired.refresh_from_db()
+        self.assertEqual((expired.status, expired.owner), (VideoJob.STATUS_QUEUED, ""))
+
+    def test_progress_of_lost_job_is_not_saved(self):
+        job = self._job(VideoJob.STATUS_RUNNING, "other:1", heartbeat_age=5)
+        reporter = jobs._ProgressReporter(job.id)
+        reporter.interval = 0
+        reporter(10, 100)
+        job.refresh_from_db()
+        self.assertEqual(job.frames_done, 0)
+        # Задача, не взятая этим процессом, им не выполняется
+        jobs.run_video_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.owner), (VideoJob.STATUS_RUNNING, "other:1"))
+
+
+class VideoJobTests(TransactionTestCase):
+    """
+    Задача по видео от запроса до результата: 202 с id задачи, queued -> running -> done
+    с прогрессом, failed с текстом ошибки. Видео синтетическое, модель – заглушка.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        for subdir in ("input_video", "output_video"):
+            os.makedirs(os.path.join(self.media, subdir))
+        self.enterContext(override_settings(MEDIA_ROOT=self.media, YOLO_MODELS=["test-stub"],
+                                            VIDEO_JOB_PROGRESS_INTERVAL=0))
+        registry.register("test-stub", benchmark.StubModel(boxes_per_frame=2, batch_ms=0, frame_ms=0))
+        self.addCleanup(registry.unload, "test-stub")
+        self.source = benchmark.synthetic_video(os.path.join(self.media, "source.mp4"), 160, 120, frames=12)
+
+    def _download(self, video_url, unique_name, target_height=0):
+        path = os.path.join(self.media, "input_video", unique_name)
+        shutil.copyfile(self.source, path)
+        return path
+
+    def _submit(self, **fields):
+        with mock.patch.object(jobs, "submit_video_job") as submit:
+            response = self.client.post("/api/process-video/", {"video_url": "http://example.com/v.mp4",
+                                                                "model": "test-stub", **fields},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 202, response.content)
+        job_id = response.json()["job_id"]
+        submit.assert_called_once_with(job_id)
+        return job_id
+
+    def _status(self, job_id):
+        response = self.client.get(f"/api/video-jobs/{job_id}/")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_job_runs_to_done(self):
+        job_id = self._submit()
+        status = self._status(job_id)
+        self.assertEqual((status["status"], status["frames_done"], status["db_record_id"]), ("queued", 0, None))
+
+        seen = []
+        report = jobs._ProgressReporter.__call__
+
+        def observe(reporter, frames_done, frames_total):
+            report(reporter, frames_done, frames_total)
+            seen.append(self._status(job_id))
+
+        with mock.patch.object(jobs, "download_video", side_effect=self._download), \
+                mock.patch.object(jobs._ProgressReporter, "__call__", observe):
+            jobs.run_video_job(job_id)
+
+        running = [status for status in seen if status["frames_done"]]
+        self.assertTrue(running)
+        self.assertEqual({status["status"] for status in seen}, {"running"})
+        self.assertEqual([status["frames_done"] for status in running],
+                         sorted(status["frames_done"] for status in running))
+        self.assertTrue(all(status["fps"] > 0 and status["frames_total"] == 12 for status in running))
+        self.assertIsNone(running[-1]["output_video_url"])
+
+        status = self._status(job_id)
+        self.assertEqual((status["status"], status["frames_done"], status["frames_total"]), ("done", 12, 12))
+        self.assertGreater(status["fps"], 0)
+        self.assertEqual(status["eta_seconds"], 0.0)
+        self.assertEqual(status["error"], "")
+        record = DetectionHistory.objects.get(pk=status["db_record_id"])
+        self.assertTrue(status["output_video_url"].endswith(record.path))
+        self.assertTrue(os.path.exists(os.path.join(self.media, record.path)))
+        self.assertEqual(Detection.objects.filter(history=record).count(), 24)
+
+    def test_download_error_marks_job_failed(self):
+        job_id = self._submit()
+        with mock.patch.object(jobs, "download_video", side_effect=Exception("Ошибка при загрузке видео: 404")):
+            jobs.run_video_job(job_id)
+        status = self._status(job_id)
+        self.assertEqual(status["status"], "failed")
+        self.assertEqual(status["error"], "Ошибка при загрузке видео: 404")
+        self.assertIsNone(status["db_record_id"])
+        self.assertIsNotNone(status["finished_at"])
+
+    def test_processing_error_discards_partial_results(self):
+        job_id = self._submit()
+
+        def broken(input_path, unique_name, **kwargs):
+            with open(os.path.join(self.media, "output_video", unique_name), "wb") as f:
+                f.write(b"partial")
+            raise ValueError("кадр не декодируется")
+
+        with mock.patch.object(jobs, "download_video", side_effect=self._download), \
+                mock.patch.object(yolo, "process_video_yolo10m", side_effect=broken):
+            jobs.run_video_job(job_id)
+        status = self._status(job_id)
+        self.assertEqual((status["status"], status["error"]), ("failed", "Ошибка обработки видео: кадр не декодируется"))
+        self.assertFalse(DetectionHistory.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media, "output_video")), [])
+        self.assertEqual(os.listdir(os.path.join(self.media, "input_video")), [])
+
+    def test_retaken_job_removes_previous_output(self):
+        job_id = self._submit()
+        previous = DetectionHistory.objects.create(image_name="old.mp4", shape="video", classes_from_img="",
+                                                   path="output_video/old.mp4", input_path="input_video/old.mp4",
+                                                   source_type="video")
+        stale = [os.path.join(self.media, name)
+                 for name in ("output_video/old.mp4", "output_video/old.npz", "input_video/old.mp4")]
+        for path in stale:
+            with open(path, "wb") as f:
+                f.write(b"stale")
+        VideoJob.objects.filter(pk=job_id).update(history=previous)
+
+        with mock.patch.object(jobs, "download_video", side_effect=self._download):
+            jobs.run_video_job(job_id)
+        status = self._status(job_id)
+        self.assertEqual(status["status"], "done")
+        self.assertNotEqual(status["db_record_id"], previous.pk)
+        self.assertFalse(DetectionHistory.objects.filter(pk=previous.pk).exists())
+        self.assertEqual([path for path in stale if os.path.exists(path)], [])
+
+
+class MoveDetailedResultsMigrationTests(TransactionTestCase):
+    """
+    Миграция 0009: перенос detailed_results в Detection и обратно.
+    """
+    before = [("detection", "0008_detection")]
+    after = [("detection", "0009_move_detailed_results")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes("detection"))
+
+    def test_forward_and_reverse(self):
+        old_apps = self.migrate(self.before)
+        History = old_apps.get_model("detection", "DetectionHistory")
+        image_details = [{"class": "person", "confidence": 0.9, "bbox": [1.0, 2.0, 3.0, 4.0]},
+                         {"class": "car", "confidence": 0.5, "bbox": [5.0, 6.0, 7.0, 8.0]}]
+        video_details = [{"frame": 0, "class": "dog", "confidence": 0.7, "bbox": [0.0, 0.0, 10.0, 10.0],
+                          "track_id": 3, "interpolated": False},
+                         {"frame": 1, "class": "dog", "confidence": 0.7, "bbox": [1.0, 1.0, 11.0, 11.0],
+                          "track_id": 3, "interpolated": True}]
+        ids = {}
+        for name, text in [("image", json.dumps(image_details)), ("video", json.dumps(video_details)),
+                           ("empty", "[]"), ("blank", ""), ("broken", "{not json"),
+                           ("object", '{"class": "cat"}'), ("short_bbox", '[{"class": "cat", "bbox": [1, 2]}]'),
+                           ("no_bbox", '[{"class": "cat"}, {"class": "dog", "bbox": [1, 2, 3, 4]}, '
+                                       '{"class": "cat", "bbox": null}]')]:
+            ids[name] = History.objects.create(image_name=name, shape="1x1", classes_from_img="", path="",
+                                               input_path="", detailed_results=text).pk
+
+        with self.assertLogs("detection.migrations.0009_move_detailed_results", "WARNING") as logs:
+            new_apps = self.migrate(self.after)
+        self.assertEqual(logs.output, [f"WARNING:detection.migrations.0009_move_detailed_results:"
+                                       f"Запись истории {ids['no_bbox']}: пропущено детекций без bbox: 2"])
+        History = new_apps.get_model("detection", "DetectionHistory")
+        Detection = new_apps.get_model("detection", "Detection")
+
+        def rows(name):
+            return list(Detection.objects.filter(history_id=ids[name]).order_by("id").values(
+                "frame", "class_name", "confidence", "x1", "y1", "x2", "y2", "track_id", "interpolated"))
+
+        self.assertEqual(rows("image"), [
+            {"frame": None, "class_name": "person", "confidence": 0.9, "x1": 1.0, "y1": 2.0, "x2": 3.0, "y2": 4.0,
+             "track_id": None, "interpolated": False},
+            {"frame": None, "class_name": "car", "confidence": 0.5, "x1": 5.0, "y1": 6.0, "x2": 7.0, "y2": 8.0,
+             "track_id": None, "interpolated": False},
+        ])
+        self.assertEqual([(row["frame"], row["track_id"], row["interpolated"]) for row in rows("video")],
+                         [(0, 3, False), (1, 3, True)])
+        self.assertEqual(rows("empty"), [])
+        # Детекциям без bbox координаты не придумываются: они пропускаются
+        self.assertEqual([(row["class_name"], row["x1"], row["y2"]) for row in rows("no_bbox")], [("dog", 1.0, 4.0)])
+        texts = dict(History.objects.values_list("image_name", "detailed_results"))
+        self.assertEqual(texts["no_bbox"], "")
+        self.assertEqual(texts["image"], "")
+        self.assertEqual(texts["video"], "")
+        self.assertEqual(texts["empty"], "")
+        # Повреждённый JSON и неожиданный формат не теряются: запись остаётся как была
+        for name, text in [("broken", "{not json"), ("object", '{"class": "cat"}'),
+                           ("short_bbox", '[{"class": "cat", "bbox": [1, 2]}]')]:
+            self.assertEqual(texts[name], text)
+            self.assertEqual(rows(name), [])
+
+        old_apps = self.migrate(self.before)
+        History = old_apps.get_model("detection", "DetectionHistory")
+        self.assertFalse(old_apps.get_model("detection", "Detection").objects.exists())
+        texts = dict(History.objects.values_list("image_name", "detailed_results"))
+        self.assertEqual(json.loads(texts["image"]), image_details)
+        self.assertEqual(json.loads(texts["video"]), video_details)
+        self.assertEqual(texts["broken"], "{not json")
+        self.assertEqual(texts["blank"], "")
+
+
+class VideoJobEventsTests(TestCase):
+    @override_settings(VIDEO_STREAM_MAX_CONCURRENT=1, VIDEO_STREAM_MAX_SECONDS=0.2, VIDEO_STREAM_POLL_INTERVAL=0.05)
+    def test_streams_are_capped_in_number_and_duration(self):
+        job = VideoJob.objects.create(video_url="http://example.com/v.mp4", status=VideoJob.STATUS_RUNNING,
+                                      frames_done=0, frames_total=100)
+        url = f"/api/video-jobs/{job.pk}/events/?format=ndjson"
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        busy = self.client.get(url)
+        self.assertEqual(busy.status_code, 429)
+        self.assertIn("Retry-After", busy)
+
+        events = [json.loads(line) for line in b"".join(first.streaming_content).splitlines()]
+        self.assertEqual(events[0]["event"], "progress")
+        self.assertEqual(events[-1], {"event": "timeout", "next_frame": 0})
+        first.close()
+        # Слот освобождается и тогда, когда ответ закрыт, не начав отдавать события
+        second = self.client.get(url)
+        self.assertEqual(second.status_code, 200)
+        second.close()
+        self.assertEqual(event_stream_slots.active, 0)
+
+    def _finished_job(self, frames=5):
+        record = DetectionHistory.objects.create(image_name="v.mp4", shape="64x48", classes_from_img="car")
+        # Кадр 2 без детекций, в кадре 3 две детекции
+        Detection.objects.bulk_create(
+            Detection(history=record, frame=frame, class_name="car", confidence=0.5 + frame / 10,
+                      x1=frame, y1=0, x2=frame + 10, y2=10)
+            for frame in (0, 1, 3, 3, 4)
+        )
+        return VideoJob.objects.create(video_url="http://example.com/v.mp4", status=VideoJob.STATUS_DONE,
+                                       frames_done=frames, frames_total=frames, history=record)
+
+    def _events(self, url, **headers):
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        response.close()
+        return content
+
+    def test_frame_events_in_order_and_resume(self):
+        job = self._finished_job()
+        url = f"/api/video-jobs/{job.pk}/events/?format=ndjson"
+        events = [json.loads(line) for line in self._events(url).splitlines()]
+        self.assertEqual([event["frame"] for event in events[:-1]], [0, 1, 2, 3, 4])
+        self.assertEqual({event["event"] for event in events[:-1]}, {"frame"})
+        self.assertEqual([len(event["detections"]) for event in events[:-1]], [1, 1, 0, 2, 1])
+        self.assertEqual(events[-1], {"event": "done", "frames_done": 5, "db_record_id": job.history_id})
+        self.assertEqual(events[3]["detections"][0]["bbox"], [3.0, 0.0, 13.0, 10.0])
+
+        resumed = [json.loads(line) for line in self._events(url + "&from_frame=3").splitlines()]
+        self.assertEqual([event.get("frame") for event in resumed], [3, 4, None])
+        self.assertEqual(resumed[:-1], events[3:-1])
+        self.assertEqual(resumed[-1]["event"], "done")
+
+    def test_sse_format(self):
+        job = self._finished_job()
+        content = self._events(f"/api/video-jobs/{job.pk}/events/?format=sse", HTTP_LAST_EVENT_ID="3")
+        blocks = content.decode("utf-8").strip().split("\n\n")
+        # Last-Event-ID – номер последнего полученного кадра: продолжение со следующего
+        self.assertEqual(len(blocks), 2)
+        frame_id, frame_event, frame_data = blocks[0].split("\n")
+        self.assertEqual((frame_id, frame_event), ("id: 4", "event: frame"))
+        self.assertEqual(json.loads(frame_data.removeprefix("data: "))["frame"], 4)
+        self.assertTrue(blocks[1].startswith("event: done\ndata: "))
+
+
+class HistoryDetectionsTests(TestCase):
+    """
+    Выгрузка детекций записи: из файла .npz у видео и из таблицы Detection, если файла нет.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+        self.record = DetectionHistory.objects.create(image_name="v.mp4", shape="64x48", classes_from_img="car",
+                                                      path="output_video/v.mp4", source_type="video")
+        os.makedirs(os.path.join(self.media, "output_video"))
+        columns = columnar.DetectionColumns({0: "car", 1: "person"})
+        for frame in range(5):
+            columns.append(frame, columnar.FrameDetections([frame % 2], [0.5], [[frame, 0, frame + 10, 10]]))
+        columns.save(columnar.columns_path(os.path.join(self.media, self.record.path)))
+
+    def _get(self, record, **params):
+        return self.client.get(f"/api/history/{record.pk}/detections/", params)
+
+    def test_frame_range(self):
+        response = self._get(self.record)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 5)
+        cases = [({"from_frame": 2}, [2, 3, 4]), ({"to_frame": 2}, [0, 1]),
+                 ({"from_frame": 1, "to_frame": 3}, [1, 2]), ({"from_frame": 3, "to_frame": 3}, [])]
+        for params, frames in cases:
+            body = self._get(self.record, **params).json()
+            self.assertEqual([detail["frame"] for detail in body["detections"]], frames, params)
+            self.assertEqual(body["count"], len(frames))
+        detail = self._get(self.record, from_frame=1, to_frame=2).json()["detections"][0]
+        self.assertEqual((detail["class"], detail["bbox"]), ("person", [1.0, 0.0, 11.0, 10.0]))
+
+        npz = self._get(self.record, output="npz")
+        self.assertEqual(npz.status_code, 200)
+        self.assertEqual(npz["Content-Type"], "application/octet-stream")
+        npz.close()
+
+    def test_invalid_range(self):
+        cases = [
+            ({"from_frame": "a"}, "from_frame и to_frame должны быть целыми числами."),
+            ({"to_frame": "1.5"}, "from_frame и to_frame должны быть целыми числами."),
+            ({"from_frame": -1}, "from_frame и to_frame не могут быть отрицательными."),
+            ({"from_frame": 3, "to_frame": 2}, "to_frame не может быть меньше from_frame."),
+            ({"output": "csv"}, "output должен быть json или npz."),
+        ]
+        for params, message in cases:
+            response = self._get(self.record, **params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertEqual(response.json()["error"], message)
+        self.assertEqual(self.client.get("/api/history/999999/detections/").status_code, 404)
+
+    def test_record_without_columns_file(self):
+        os.remove(columnar.columns_path(os.path.join(self.media, self.record.path)))
+        Detection.objects.bulk_create(
+            Detection(history=self.record, frame=frame, class_name="car", confidence=0.5,
+                      x1=frame, y1=0, x2=frame + 10, y2=10)
+            for frame in (0, 2, 4)
+        )
+        body = self._get(self.record, from_frame=1, to_frame=4).json()
+        self.assertEqual([detail["frame"] for detail in body["detections"]], [2])
+        self.assertEqual(body["count"], 1)
+        self.assertEqual(self._get(self.record).json()["count"], 3)
+        # .npz нет – выгрузить его нельзя
+        response = self._get(self.record, output="npz")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "Файл детекций .npz есть только у обработанных видео.")
+
+
+class HistoryWriterTests(TransactionTestCase):
+    """
+    Групповая запись истории: одновременные записи уходят общими транзакциями, ошибочная запись
+    не мешает остальным в пачке.
+    """
+
+    def setUp(self):
+        # Первая запись ждёт остальных до 0.5 с: пачки собираются и на одном ядре
+        self.writer = HistoryWriter(max_rows=50, max_delay=0.5, timeout=10)
+        self.addCleanup(self.writer.stop, 10)
+
+    @staticmethod
+    def _record(name, **fields):
+        return DetectionHistory(image_name=name, shape="64x64", classes_from_img="person",
+                                source_type="file", **fields)
+
+    def test_concurrent_saves_share_transactions(self):
+        detail = {"class": "person", "confidence": 0.5, "bbox": [1.0, 2.0, 3.0, 4.0]}
+        saved = []
+
+        def save(n):
+            saved.extend(self.writer.save([(self._record(f"{n}.jpg"), [detail, detail])]))
+
+        threads = [threading.Thread(target=save, args=(n,)) for n in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({record.id for record in saved}), 20)
+        self.assertEqual(DetectionHistory.objects.count(), 20)
+        self.assertEqual(Detection.objects.filter(history__in=[record.id for record in saved]).count(), 40)
+        self.assertLess(self.writer.batches, 20)
+
+    def test_failed_record_does_not_fail_batch(self):
+        with self.assertLogs("detection.persistence", "ERROR"):
+            good = self.writer.submit(self._record("good.jpg"))
+            bad = self.writer.submit(self._record(None))
+            with self.assertRaises(Exception):
+                bad.result(timeout=10)
+        self.assertTrue(DetectionHistory.objects.filter(pk=good.result(timeout=10).id).exists())
+        self.assertEqual(DetectionHistory.objects.count(), 1)
+
+    def test_detection_without_bbox_is_skipped(self):
+        details = [{"class": "person", "confidence": 0.5, "bbox": [1.0, 2.0, 3.0, 4.0]},
+                   {"class": "car", "confidence": 0.4}]
+        with self.assertLogs("detection.models", "WARNING") as logs:
+            record, = self.writer.save([(self._record("nobox.jpg"), details)])
+        self.assertIn("'car' без bbox", logs.output[0])
+        self.assertEqual(record.get_detailed_results(), details[:1])
+
+
+class TilingTests(SimpleTestCase):
+    def test_windows_cover_image_with_overlap(self):
+        windows = tiling.tile_windows(2500, 1300, 1024, 0.2)
+        xs = sorted({x1 for x1, _, _, _ in windows})
+        ys = sorted({y1 for _, y1, _, _ in windows})
+        self.assertEqual(xs, [0, 819, 1476])
+        self.assertEqual(ys, [0, 276])
+        # Все тайлы одного размера, последний прижат к краю, соседние перекрываются не меньше чем на overlap
+        self.assertTrue(all(x2 - x1 == 1024 and y2 - y1 == 1024 for x1, y1, x2, y2 in windows))
+        self.assertEqual(max(x2 for _, _, x2, _ in windows), 2500)
+        self.assertEqual(max(y2 for _, _, _, y2 in windows), 1300)
+        self.assertTrue(all(b - a <= 1024 * 0.8 for a, b in zip(xs, xs[1:])))
+        # Изображение меньше тайла – один тайл по размеру изображения
+        self.assertEqual(tiling.tile_windows(500, 300, 1024, 0.2), [(0, 0, 500, 300)])
+
+    def test_nms_suppresses_by_iou_within_class(self):
+        boxes = np.array([[0, 0, 100, 100], [5, 5, 105, 105], [0, 0, 100, 100], [300, 300, 400, 400]], dtype=np.float32)
+        scores = np.array([0.6, 0.9, 0.5, 0.4])
+        classes = np.array([0, 0, 1, 0])
+        # IoU первых двух ≈ 0.82: остаётся более уверенный; другой класс и далёкий бокс не подавляются
+        self.assertEqual(sorted(tiling.nms(boxes, scores, classes, 0.5)), [1, 2, 3])
+        self.assertEqual(sorted(tiling.nms(boxes, scores, classes, 0.9)), [0, 1, 2, 3])
+        self.assertEqual(len(tiling.nms(np.zeros((0, 4)), np.zeros(0), np.zeros(0))), 0)
+
+    def test_wbf_averages_coordinates_by_score(self):
+        boxes = np.array([[0, 0, 100, 100], [10, 10, 110, 110], [300, 300, 400, 400]], dtype=np.float32)
+        scores = np.array([0.9, 0.3, 0.5])
+        classes = np.array([2, 2, 2])
+        fused, fused_scores, fused_classes = tiling.weighted_boxes_fusion(boxes, scores, classes, 0.5)
+        self.assertEqual(len(fused), 2)
+        np.testing.assert_allclose(fused[0], [2.5, 2.5, 102.5, 102.5])
+        self.assertAlmostEqual(fused_scores[0], 0.6)
+        np.testing.assert_allclose(fused[1], [300, 300, 400, 400])
+        self.assertEqual(list(fused_classes), [2, 2])
+
+    def test_predict_tiled_merges_full_frame_pass(self):
+        stub = benchmark.StubModel(boxes_per_frame=4, batch_ms=0, frame_ms=0)
+        frame = benchmark.synthetic_frame(1800, 1000, seed=4)
+        shapes = []
+
+        def predict(frames):
+            shapes.extend(item.shape[:2] for item in frames)
+            return stub(frames)
+
+        result, info = tiling.predict_tiled(frame, predict, tile_size=1024, overlap=0.2, batch_size=3,
+                                            iou_threshold=0.99, include_full=True)
+        self.assertEqual(info["tiles"], 2)
+        self.assertEqual(shapes, [(1000, 1024)] * 2 + [(1000, 1800)])
+        self.assertEqual(info["raw_detections"], 3 * 4)
+        self.assertEqual(tuple(result.orig_shape), (1000, 1800))
+        # Боксы прохода по всему кадру попадают в итог в координатах кадра
+        merged = result.boxes.data.numpy()
+        for box in stub([frame])[0].boxes.data.numpy():
+            self.assertTrue(np.isclose(merged, box, atol=1e-3).all(axis=1).any())
+
+        shapes.clear()
+        _, info = tiling.predict_tiled(frame, predict, tile_size=1024, overlap=0.2, include_full=False)
+        self.assertEqual(shapes, [(1000, 1024)] * 2)
+        self.assertEqual(info["raw_detections"], 2 * 4)
+
+
+class IoUTrackerTests(SimpleTestCase):
+    @staticmethod
+    def det(cls, x, y, size=40, confidence=0.9):
+        return {"class": cls, "confidence": confidence, "bbox": [x, y, x + size, y + size]}
+
+    def test_iou_matrix(self):
+        ious = iou_matrix([[0, 0, 10, 10], [20, 20, 30, 30]], [[0, 0, 10, 10], [5, 0, 15, 10]])
+        np.testing.assert_allclose(ious, [[1.0, 1 / 3], [0.0, 0.0]], rtol=1e-6)
+        self.assertEqual(iou_matrix([], [[0, 0, 1, 1]]).shape, (0, 1))
+
+    def test_ids_follow_objects_and_boxes_are_extrapolated(self):
+        tracker = IoUTracker(iou_threshold=0.3)
+        first = tracker.update(0, [self.det("car", 100, 100), self.det("person", 300, 100)])
+        car_id, person_id = first[0]["track_id"], first[1]["track_id"]
+        self.assertNotEqual(car_id, person_id)
+        # Машина сместилась на 20 px за 4 кадра: тот же трек, скорость 5 px/кадр
+        second = tracker.update(4, [self.det("person", 302, 100), self.det("car", 120, 100)])
+        self.assertEqual([d["track_id"] for d in second], [person_id, car_id])
+        predicted = {d["track_id"]: d for d in tracker.predict(6)}
+        np.testing.assert_allclose(predicted[car_id]["bbox"], [130, 100, 170, 140])
+        self.assertEqual(predicted[car_id]["class"], "car")
+        # Бокс другого класса на месте трека получает новый id
+        third = tracker.update(8, [self.det("truck", 140, 100)])
+        self.assertNotIn(third[0]["track_id"], (car_id, person_id))
+
+    def test_unconfirmed_tracks_expire_after_max_age(self):
+        tracker = IoUTracker(max_age=1)
+        track_id = tracker.update(0, [self.det("dog", 10, 10)])[0]["track_id"]
+        # Один пропуск трек переживает, но на промежуточных кадрах не показывается
+        tracker.update(2, [])
+        self.assertEqual(tracker.predict(3), [])
+        self.assertEqual(tracker.update(4, [self.det("dog", 10, 10)])[0]["track_id"], track_id)
+        tracker.update(6, [])
+        tracker.update(8, [])
+        self.assertNotEqual(tracker.update(10, [self.det("dog", 10, 10)])[0]["track_id"], track_id)
+
+
+class DetectionColumnsTests(SimpleTestCase):
+    def columns(self):
+        columns = columnar.DetectionColumns({0: "person", 1: "car"})
+        columns.append(0, columnar.FrameDetections([0, 1], [0.9, 0.5], [[0, 0, 10, 10], [5, 5, 20, 20]]))
+        columns.append(1, columnar.FrameDetections.empty())
+        columns.append(2, columnar.FrameDetections([1], [0.7], [[1, 2, 3, 4]], [7], True))
+        columns.append(3, columnar.FrameDetections([1], [0.6], [[2, 3, 4, 5]], [7], False))
+        return columns
+
+    def test_to_details_by_frame_range(self):
+        # Мелкий порог склейки: данные лежат в нескольких блоках
+        with mock.patch.object(columnar, "_CONSOLIDATE_ROWS", 2):
+            columns = self.columns()
+        self.assertEqual(len(columns), 4)
+        details = columns.to_details()
+        self.assertEqual([d["frame"] for d in details], [0, 0, 2, 3])
+        self.assertAlmostEqual(details[2].pop("confidence"), 0.7, places=6)
+        self.assertEqual(details[2], {"frame": 2, "class": "car", "bbox": [1.0, 2.0, 3.0, 4.0],
+                                      "track_id": 7, "interpolated": True})
+        # Без трека track_id и interpolated не выводятся
+        self.assertEqual(sorted(details[0]), ["bbox", "class", "confidence", "frame"])
+        self.assertEqual([d["frame"] for d in columns.to_details(1, 3)], [2])
+        self.assertEqual([d["frame"] for d in columns.to_details(from_frame=2)], [2, 3])
+        self.assertEqual([d["frame"] for d in columns.to_details(to_frame=1)], [0, 0])
+        self.assertEqual(columns.to_details(4, 10), [])
+        self.assertEqual(sorted(columns.classes()), ["car", "person"])
+
+    def test_save_and_load(self):
+        columns = self.columns()
+        with tempfile.TemporaryDirectory() as directory:
+            path = columns.save(os.path.join(directory, "video.npz"))
+            self.assertEqual(os.listdir(directory), ["video.npz"])
+            loaded = columnar.DetectionColumns.load(path)
+            self.assertEqual(loaded.names, {0: "person", 1: "car"})
+            self.assertEqual(len(loaded), 4)
+            self.assertEqual(loaded.to_details(), columns.to_details())
+            # После загрузки можно дописывать кадры
+            loaded.append(4, columnar.FrameDetections([0], [0.8], [[0, 0, 1, 1]]))
+            self.assertEqual([d["frame"] for d in loaded.to_details(3)], [3, 4])
+
+            empty = columnar.DetectionColumns.load(
+                columnar.DetectionColumns({0: "person"}).save(os.path.join(directory, "empty.npz")))
+            self.assertEqual((len(empty), empty.to_details(), empty.classes()), (0, [], []))
+
+
+class StagedPipelineTests(SimpleTestCase):
+    def run_in_thread(self, pipeline):
+        """
+        Запускает pipeline.run() в отдельном потоке; возвращает (поток, словарь с результатом или ошибкой).
+        """
+        outcome = {}
+
+        def target():
+            try:
+                outcome["timings"] = pipeline.run()
+            except Exception as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread, outcome
+
+    def test_order_is_preserved_across_stages(self):
+        output = []
+
+        def square(batch):
+            time.sleep(0.001 * (len(batch) % 3))
+            return [value * value for value in batch]
+
+        pipeline = StagedPipeline(("read", range(200)), [
+            ("square", square, 5),
+            ("shift", lambda batch: [value + 1 for value in batch], 3),
+            ("collect", output.extend, 7),
+        ], queue_size=4)
+        timings = pipeline.run()
+        self.assertEqual(output, [value * value + 1 for value in range(200)])
+        self.assertEqual([timings[name]["items"] for name in ("read", "square", "shift", "collect")], [200] * 4)
+
+    def test_full_queue_blocks_producer(self):
+        produced = []
+        gate = threading.Event()
+
+        def source():
+            for value in range(50):
+                produced.append(value)
+                yield value
+
+        def slow(batch):
+            gate.wait(5)
+
+        thread, outcome = self.run_in_thread(StagedPipeline(("read", source()), [("slow", slow, 1)], queue_size=2))
+        time.sleep(0.3)
+        # Стадия держит 1 элемент, в очереди 2, ещё один источник прочитал и ждёт места
+        self.assertLessEqual(len(produced), 4)
+        gate.set()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(produced), 50)
+        self.assertNotIn("error", outcome)
+
+    def test_stage_error_stops_pipeline_and_is_raised(self):
+        error = RuntimeError("сбой стадии")
+        seen = []
+
+        def explode(batch):
+            seen.extend(batch)
+            if len(seen) >= 20:
+                raise error
+            return batch
+
+        # Бесконечный источник: без остановки по ошибке он висел бы на полной очереди
+        thread, outcome = self.run_in_thread(StagedPipeline(("read", itertools.count()), [
+            ("explode", explode, 4),
+            ("sink", lambda batch: None, 1),
+        ], queue_size=2))
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertIs(outcome.get("error"), error)
+
+
+class VideoAcquisitionTests(SimpleTestCase):
+    """
+    Выбор потока yt-dlp и уменьшение кадров видео после декодирования.
+    """
+
+    def test_ytdlp_format(self):
+        self.assertEqual(jobs.ytdlp_format(0, audio=True), "bv+ba/b")
+        self.assertEqual(jobs.ytdlp_format(720), "wv[height>=720]/bv/w[height>=720]/b")
+        self.assertEqual(jobs.ytdlp_format(720, audio=True), "wv[height>=720]+ba/bv+ba/w[height>=720]/b")
+
+    def test_decode_downscale_keeps_source_coordinates(self):
+        registry.register("test-stub", benchmark.StubModel(boxes_per_frame=20, batch_ms=0, frame_ms=0))
+        self.addCleanup(registry.unload, "test-stub")
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            os.makedirs(os.path.join(media, "output_video"))
+            source = benchmark.synthetic_video(os.path.join(media, "source.mp4"), 1280, 720, frames=6)
+            stats = {}
+            _, _, columns = yolo.process_video_yolo10m(
+                source, "out.mp4", stats=stats, model_name="test-stub", decode_max_size=320)
+            capture = cv2.VideoCapture(os.path.join(media, "output_video", "out.mp4"))
+            written = (capture.get(cv2.CAP_PROP_FRAME_WIDTH), capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            capture.release()
+
+        self.assertEqual((stats["source_size"], stats["processed_size"]), ("1280x720", "320x180"))
+        self.assertEqual(written, (320, 180))
+        xyxy = columns.arrays()["xyxy"]
+        self.assertEqual(len(xyxy), 6 * 20)
+        # Боксы заглушки занимают весь кадр: в исходных координатах они выходят за 320x180
+        self.assertGreater(xyxy[:, 2].max(), 320)
+        self.assertLessEqual(xyxy[:, 2].max(), 1280)
+        self.assertLessEqual(xyxy[:, 3].max(), 720)
+
+
+class _FlakyStub(benchmark.StubModel):
+    """
+    Заглушка, падающая на одном вызове после первых fail_after: в том процессе, который первым удалит marker.
+    При crash процесс завершается аварийно (как при нехватке памяти), а не бросает исключение.
+    """
+
+    def __init__(self, marker, fail_after=0, crash=False, **kwargs):
+        super().__init__(**kwargs)
+        self.marker = marker
+        self.fail_after = fail_after
+        self.crash = crash
+        self.calls = 0
+
+    def __call__(self, source, **kwargs):
+        self.calls += 1
+        if self.calls <= self.fail_after:
+            return super().__call__(source, **kwargs)
+        try:
+            os.remove(self.marker)
+        except FileNotFoundError:
+            return super().__call__(source, **kwargs)
+        if self.crash:
+            os._exit(1)
+        raise RuntimeError("сбой для теста")
+
+
+def flaky_stub_loader(name, threads=None, **kwargs):
+    return _FlakyStub(**kwargs)
+
+
+class SegmentedVideoTests(SimpleTestCase):
+    """
+    Сегментная обработка видео: совпадение с обработкой в одном процессе, повтор и продолжение.
+    """
+
+    stub = {"names": {0: "person", 1: "car"}, "boxes_per_frame": 3, "batch_ms": 0, "frame_ms": 0}
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+        os.makedirs(os.path.join(self.media, "output_video"))
+        self.source = benchmark.synthetic_video(os.path.join(self.media, "source.mp4"), 320, 240, frames=60)
+        self.marker = os.path.join(self.media, "fail-once")
+        registry.register("test-stub", benchmark.StubModel(**self.stub))
+        self.addCleanup(registry.unload, "test-stub")
+        _, _, self.reference = yolo.process_video_yolo10m(self.source, "reference.mp4", model_name="test-stub")
+
+    def _run(self, retries, workers_count=2, fail_after=0, on_frame=None, stats=None, crash=False):
+        return segments.process_video_segmented(
+            self.source, "out.mp4", stats=stats, on_frame=on_frame, model_name="test-stub",
+            workers_count=workers_count, threads=1, segment_seconds=0.4, retries=retries,
+            loader="detection.tests.flaky_stub_loader",
+            loader_kwargs={"marker": self.marker, "fail_after": fail_after, "crash": crash, **self.stub})
+
+    def _assert_matches_reference(self, columns):
+        expected, actual = self.reference.arrays(), columns.arrays()
+        for field in ("frame", "class_id", "confidence", "xyxy"):
+            np.testing.assert_array_equal(actual[field], expected[field])
+        capture = cv2.VideoCapture(os.path.join(self.media, "output_video", "out.mp4"))
+        self.assertEqual(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 60)
+        capture.release()
+        self.assertFalse(os.path.exists(segments.segments_dir("out.mp4")))
+
+    def test_plan_segments(self):
+        self.assertEqual(segments.plan_segments(100, 30, [0, 12, 24, 36, 48, 60, 72, 84, 96]),
+                         [(0, 36), (36, 72), (72, 100)])
+        # Хвост короче половины сегмента присоединяется к предыдущему
+        self.assertEqual(segments.plan_segments(70, 30), [(0, 30), (30, 70)])
+        self.assertEqual(segments.plan_segments(20, 30), [(0, 20)])
+
+    def test_failed_segment_is_retried(self):
+        open(self.marker, "w").close()
+        frames, stats = [], {}
+        _, _, columns = self._run(retries=1, on_frame=lambda idx, det: frames.append(idx), stats=stats)
+        self.assertGreater(stats["segments"], 1)
+        self.assertEqual(stats["segment_retries"], 1)
+        self.assertEqual(frames, list(range(60)))
+        self._assert_matches_reference(columns)
+
+    def test_crashed_process_is_charged_to_its_segment_only(self):
+        open(self.marker, "w").close()
+        stats = {}
+        # Все сегменты в пуле получают BrokenProcessPool, но попытку теряет только тот,
+        # чей процесс погиб; остальные перезапускаются без счёта, и retries=1 хватает
+        _, _, columns = self._run(retries=1, stats=stats, crash=True)
+        self.assertGreater(stats["segments"], 2)
+        self.assertEqual(stats["segment_retries"], 1)
+        self._assert_matches_reference(columns)
+
+    def test_resume_from_finished_segments(self):
+        # Один процесс берёт сегменты по порядку: первый успевает завершиться до сбоя
+        open(self.marker, "w").close()
+        with self.assertRaises(segments.SegmentError):
+            self._run(retries=0, workers_count=1, fail_after=4)
+        with open(os.path.join(segments.segments_dir("out.mp4"), "manifest.json"), encoding="utf-8") as f:
+            finished = sum(segment["status"] == "done" for segment in json.load(f)["segments"])
+
+        self.assertGreaterEqual(finished, 1)
+
+        stats = {}
+        _, _, columns = self._run(retries=0, stats=stats)
+        self.assertEqual(stats["segments_resumed"], finished)
+        self._assert_matches_reference(columns)
+
+
+class LiveStreamTests(SimpleTestCase):
+    """
+    Живой поток на локальном файле, воспроизводимом с реальной скоростью.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+        # 2 секунды при 25 кадрах в секунду
+        self.source = benchmark.synthetic_video(os.path.join(self.media, "live.mp4"), 320, 240, frames=50)
+
+    def _run(self, frame_ms, **kwargs):
+        registry.register("test-stub", benchmark.StubModel(boxes_per_frame=2, batch_ms=0, frame_ms=frame_ms))
+        self.addCleanup(registry.unload, "test-stub")
+        events = []
+        started = time.monotonic()
+        session = live.LiveSession(self.source, model_name="test-stub", realtime=True, idle_timeout=0,
+                                   on_result=events.append, **kwargs).start()
+        self.assertTrue(session.wait(timeout=30))
+        return session.stats(), events, time.monotonic() - started
+
+    def test_slow_model_drops_stale_frames(self):
+        # Модель втрое медленнее источника: обрабатывается примерно каждый третий кадр
+        stats, events, elapsed = self._run(frame_ms=120)
+        frames = [event["frame"] for event in events if event["event"] == "frame"]
+        self.assertGreaterEqual(elapsed, 1.9)
+        self.assertEqual(stats["status"], "ended")
+        self.assertEqual(stats["frames_captured"], 50)
+        self.assertEqual(stats["frames_processed"] + stats["frames_dropped"], 50)
+        self.assertGreater(stats["drop_rate"], 0.3)
+        self.assertEqual(frames, sorted(set(frames)))
+        # Последний кадр источника не теряется, а задержка не копится: не больше двух проходов модели с запасом
+        self.assertEqual(frames[-1], 49)
+        self.assertLess(stats["latency_ms"]["p95"], 500)
+        self.assertEqual(events[-1], {"event": "ended"})
+
+    def test_rolling_segments(self):
+        stats, events, _ = self._run(frame_ms=0, segment_seconds=0.4, keep_segments=2)
+        self.assertLess(stats["drop_rate"], 0.2)
+        segments_done = [event["path"] for event in events if event["event"] == "segment"]
+        self.assertEqual(len(segments_done), 5)
+        self.assertEqual(stats["segments"], segments_done[-2:])
+        for path in segments_done:
+            self.assertEqual(os.path.exists(os.path.join(self.media, path)), path in segments_done[-2:])
+        capture = cv2.VideoCapture(os.path.join(self.media, segments_done[-1]))
+        # Отрезок идёт с реальной скоростью: 0.4 с при 25 кадрах в секунду, даже если кадры отбрасывались
+        self.assertEqual(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 10)
+        capture.release()
+
+
+    def test_invalid_parameters_are_rejected(self):
+        cases = [
+            ({"segment_seconds": "abc"}, "segment_seconds должен быть числом."),
+            ({"decode_max_size": "1.5k"}, "decode_max_size должен быть целым числом."),
+            ({"model": "unknown.pt"}, "Неизвестная модель unknown.pt"),
+        ]
+        for fields, message in cases:
+            response = self.client.post("/api/live-streams/", {"source_url": "rtsp://camera/stream", **fields},
+                                        content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(message, response.json()["error"])
+
+    def test_inference_options_are_applied(self):
+        with mock.patch.object(benchmark.StubModel, "__call__", autospec=True,
+                               side_effect=benchmark.StubModel.__call__) as model_call:
+            _, events, _ = self._run(frame_ms=0, inference={"imgsz": 320, "classes": ["person"], "max_det": 2})
+        frames = [event for event in events if event["event"] == "frame"]
+        self.assertTrue(frames)
+        self.assertEqual({(call.kwargs["imgsz"], tuple(call.kwargs["classes"]), call.kwargs["max_det"])
+                          for call in model_call.call_args_list}, {(320, (0,), 2)})
+        for event in frames:
+            self.assertLessEqual(len(event["detections"]), 2)
+            self.assertEqual({detail["class"] for detail in event["detections"]} - {"person"}, set())
+
+    @override_settings(YOLO_MODELS=["test-stub"])
+    def test_unknown_class_is_rejected(self):
+        registry.register("test-stub", benchmark.StubModel(batch_ms=0, frame_ms=0))
+        self.addCleanup(registry.unload, "test-stub")
+        response = self.client.post("/api/live-streams/", {"source_url": "rtsp://camera/stream", "model": "test-stub",
+                                                           "classes": "unicorn"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(live.sessions, {})
+
+    @override_settings(VIDEO_STREAM_MAX_CONCURRENT=1, VIDEO_STREAM_MAX_SECONDS=0.2)
+    def test_event_streams_are_capped(self):
+        # Сессия не запущена: событий нет, слушатель отключается по VIDEO_STREAM_MAX_SECONDS
+        session = live.LiveSession("rtsp://camera/stream")
+        live.sessions[session.id] = session
+        self.addCleanup(live.sessions.pop, session.id, None)
+        url = f"/api/live-streams/{session.id}/events/?format=ndjson"
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 429)
+        events = [json.loads(line) for line in b"".join(first.streaming_content).splitlines()]
+        self.assertEqual(events, [{"event": "timeout"}])
+        first.close()
+        self.assertEqual(event_stream_slots.active, 0)
+        self.assertEqual(session._subscribers, [])
+
+class InferenceParamsTests(TestCase):
+    """
+    Параметры инференса в запросе: автоматический размер входа и фильтры, применяемые в модели.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        for subdir in ("input_img", "output_img"):
+            os.makedirs(os.path.join(media.name, subdir))
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media.name, YOLO_MODELS=["test-stub"], INPUT_PERSIST_ASYNC=False,
+            HISTORY_WRITE_GROUP_COMMIT=False, YOLO_IMGSZ_AUTO_MAX=640,
+        ))
+        registry.register("test-stub", benchmark.StubModel(boxes_per_frame=30, batch_ms=0, frame_ms=0))
+        self.addCleanup(registry.unload, "test-stub")
+
+    def test_auto_imgsz(self):
+        estimator = resolution.LatencyEstimator()
+        choices = [320, 416, 512, 640, 800]
+        self.assertEqual(resolution.auto_imgsz(200, 150, "m", choices=choices, estimator=estimator), 320)
+        self.assertEqual(resolution.auto_imgsz(500, 375, "m", choices=choices, estimator=estimator), 512)
+        # Крупные изображения уменьшаются, как и раньше, до YOLO_IMGSZ_AUTO_MAX
+        self.assertEqual(resolution.auto_imgsz(4000, 3000, "m", choices=choices, estimator=estimator), 640)
+        # Без замеров бюджет не применяется; 100 мс при 640 -> ~64 мс при 512, ~42 мс при 416, 25 мс при 320
+        self.assertEqual(resolution.auto_imgsz(4000, 3000, "m", 40, estimator, choices), 640)
+        estimator.observe("m", 640, 100.0)
+        self.assertEqual(resolution.auto_imgsz(4000, 3000, "m", 40, estimator, choices), 320)
+        self.assertEqual(resolution.auto_imgsz(4000, 3000, "m", 70, estimator, choices), 512)
+        self.assertEqual(resolution.auto_imgsz(4000, 3000, "other", 40, estimator, choices), 640)
+
+    def _post(self, image, **fields):
+        upload = SimpleUploadedFile("thumb.jpg", image, content_type="image/jpeg")
+        return self.client.post("/api/process-image/", {"image": upload, "model": "test-stub", **fields})
+
+    def test_filters_applied_in_model_and_cached_separately(self):
+        image = benchmark.synthetic_image(240, 180, seed=3)
+        everything = self._post(image)
+        self.assertEqual(everything.status_code, 200, everything.content)
+        # По умолчанию вход прежний – 640; auto выбирается только по запросу
+        self.assertEqual(everything.json()["imgsz"], 640)
+        all_rows = Detection.objects.filter(history_id=everything.json()["db_record_id"])
+
+        filtered = self._post(image, classes="person, car", max_det=3, conf=0.5, imgsz=416)
+        self.assertEqual(filtered.status_code, 200, filtered.content)
+        # Другие параметры – другой ключ кэша
+        self.assertFalse(filtered.json()["cached"])
+        self.assertEqual(filtered.json()["imgsz"], 416)
+        rows = list(Detection.objects.filter(history_id=filtered.json()["db_record_id"]).values("class_name", "confidence"))
+        self.assertLessEqual(len(rows), 3)
+        self.assertTrue(all(row["class_name"] in ("person", "car") and row["confidence"] > 0.5 for row in rows))
+        self.assertLess(len(rows), all_rows.count())
+
+        self.assertTrue(self._post(image, classes="car,person", max_det=3, conf=0.5, imgsz=416).json()["cached"])
+        self.assertTrue(self._post(image).json()["cached"])
+        self.assertTrue(self._post(image, imgsz=640).json()["cached"])
+        # auto на этом изображении – 320: другой фактический вход, другой ключ кэша
+        auto = self._post(image, imgsz="auto").json()
+        self.assertEqual((auto["imgsz"], auto["cached"]), (320, False))
+        self.assertTrue(self._post(image, imgsz=320).json()["cached"])
+        self.assertEqual(self._post(image, imgsz=300).status_code, 400)
+        self.assertEqual(self._post(image, classes="unicorn").status_code, 400)
+
+    def test_auto_imgsz_per_image_in_batch(self):
+        calls = []
+
+        class RecordingStub(benchmark.StubModel):
+            def __call__(self, source, **kwargs):
+                calls.append((len(source), kwargs.get("imgsz")))
+                return super().__call__(source, **kwargs)
+
+        registry.register("test-stub", RecordingStub(boxes_per_frame=30, batch_ms=0, frame_ms=0))
+        small, large = benchmark.synthetic_frame(200, 150, seed=1), benchmark.synthetic_frame(1280, 720, seed=2)
+        together = yolo.process_images_yolo10m([(small, "a.jpg"), (large, "b.jpg")], model_name="test-stub",
+                                               annotate=False, inference={"imgsz": "auto"})
+        alone = yolo.process_images_yolo10m([(small, "a.jpg")], model_name="test-stub",
+                                            annotate=False, inference={"imgsz": "auto"})
+        # Изображения с разным imgsz идут разными проходами; результат не зависит от соседей по пачке
+        self.assertEqual(sorted(calls[:2]), [(1, 320), (1, 640)])
+        self.assertEqual(calls[2], (1, 320))
+        self.assertEqual(together[0], alone[0])
+
+
+class ProcessImagesTests(TestCase):
+    """
+    Пакетный эндпоинт /api/process-images/: файлы и ссылки, ошибки по элементам, кэш.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        for subdir in ("input_img", "output_img"):
+            os.makedirs(os.path.join(media.name, subdir))
+        self.media = media.name
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media.name, YOLO_MODELS=["test-stub"], INPUT_PERSIST_ASYNC=False,
+            HISTORY_WRITE_GROUP_COMMIT=False, RESULT_CACHE_ENABLED=True, YOLO_MAX_BATCH_SIZE=2,
+        ))
+        self.register(benchmark.StubModel(boxes_per_frame=3, batch_ms=0, frame_ms=0))
+        self.addCleanup(registry.unload, "test-stub")
+        self.images = {f"http://images.test/{seed}.jpg": benchmark.synthetic_image(160, 120, seed=seed)
+                       for seed in (1, 2)}
+
+    def register(self, model):
+        registry.register("test-stub", model)
+
+    def fetch(self, url, max_bytes=None):
+        if url not in self.images:
+            raise FetchError(f"Не удалось скачать {url}: 404.")
+        return FetchResult(url, self.images[url])
+
+    def post(self, files, urls):
+        uploads = [SimpleUploadedFile(name, data, content_type="image/jpeg") for name, data in files]
+        with mock.patch.object(fetcher, "fetch", side_effect=self.fetch):
+            return self.client.post("/api/process-images/",
+                                    {"images": uploads, "image_urls": urls, "model": "test-stub"})
+
+    def test_mixed_batch_with_errors_and_cache(self):
+        files = [("a.jpg", benchmark.synthetic_image(200, 150, seed=3)), ("broken.jpg", b"not an image"),
+                 ("b.jpg", benchmark.synthetic_image(120, 90, seed=4))]
+        urls = [*self.images, "http://images.test/missing.jpg"]
+        response = self.post(files, urls)
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()["results"]
+        # Порядок: сначала файлы, затем ссылки; ошибка элемента не прерывает остальные
+        self.assertEqual([item["source"] for item in results], ["a.jpg", "broken.jpg", "b.jpg", *urls])
+        self.assertEqual([("error" in item) for item in results], [False, True, False, False, False, True])
+        self.assertIn("404", results[5]["error"])
+        records = DetectionHistory.objects.in_bulk([item["db_record_id"] for item in results if "error" not in item])
+        self.assertEqual(sorted(record.source_type for record in records.values()), ["file", "file", "url", "url"])
+        for record in records.values():
+            self.assertTrue(os.path.exists(os.path.join(self.media, record.input_path)))
+            self.assertEqual(Detection.objects.filter(history=record).count(), 3)
+
+        again = self.post(files[:1], urls[:1]).json()["results"]
+        self.assertEqual([item["cached"] for item in again], [True, True])
+        self.assertEqual([item["db_record_id"] for item in again],
+                         [results[0]["db_record_id"], results[3]["db_record_id"]])
+        self.assertEqual(DetectionHistory.objects.count(), 4)
+
+    def test_failed_chunk_keeps_other_chunks(self):
+        class FailingSecondCall(benchmark.StubModel):
+            calls = 0
+
+            def __call__(self, source, **kwargs):
+                FailingSecondCall.calls += 1
+                if FailingSecondCall.calls == 2:
+                    raise RuntimeError("сбой модели")
+                return super().__call__(source, **kwargs)
+
+        self.register(FailingSecondCall(boxes_per_frame=3, batch_ms=0, frame_ms=0))
+        files = [(f"{seed}.jpg", benchmark.synthetic_image(100, 80, seed=seed)) for seed in range(10, 15)]
+        response = self.post(files, [])
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()["results"]
+        # Порции по 2 изображения: вторая упала, первая и третья сохранены
+        self.assertEqual([("error" in item) for item in results], [False, False, True, True, False])
+        self.assertIn("сбой модели", results[2]["error"])
+        self.assertEqual(DetectionHistory.objects.count(), 3)
+        saved = set(DetectionHistory.objects.values_list("input_path", flat=True))
+        on_disk = {os.path.join("input_img", name) for name in os.listdir(os.path.join(self.media, "input_img"))}
+        self.assertEqual(on_disk, saved)
+
+
+class RenderTests(TestCase):
+    """
+    Отрисовка по запросу: annotate=false, эндпоинт /api/history/<id>/render/ и дисковый кэш.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        for subdir in ("input_img", "output_img"):
+            os.makedirs(os.path.join(media.name, subdir))
+        self.media = media.name
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media.name, YOLO_MODELS=["test-stub"], INPUT_PERSIST_ASYNC=False,
+            HISTORY_WRITE_GROUP_COMMIT=False, RESULT_CACHE_ENABLED=False,
+        ))
+        self.enterContext(mock.patch.object(render, "render_cache",
+                                            render.RenderCache(os.path.join(media.name, "render_cache"))))
+        registry.register("test-stub", benchmark.StubModel(boxes_per_frame=4, batch_ms=0, frame_ms=0))
+        self.addCleanup(registry.unload, "test-stub")
+
+    def _post(self):
+        upload = SimpleUploadedFile("photo.jpg", benchmark.synthetic_image(320, 240, seed=6), content_type="image/jpeg")
+        response = self.client.post("/api/process-image/", {"image": upload, "model": "test-stub", "annotate": "false"})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_render_from_stored_detections(self):
+        body = self._post()
+        record = DetectionHistory.objects.get(pk=body["db_record_id"])
+        self.assertEqual(record.path, "")
+        self.assertTrue(body["output_image"].endswith(f"/api/history/{record.id}/render/"))
+        self.assertEqual(os.listdir(os.path.join(self.media, "output_img")), [])
+
+        response = self.client.get(f"/api/history/{record.id}/render/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        rendered = cv2.imdecode(np.frombuffer(b"".join(response.streaming_content), np.uint8), cv2.IMREAD_COLOR)
+        response.close()
+        # Боксы берутся из строк Detection и рисуются на сохранённом исходном изображении
+        details = [detection.as_dict() for detection in Detection.objects.filter(history=record)]
+        self.assertEqual(len(details), 4)
+        source = cv2.imread(os.path.join(self.media, record.input_path))
+        _, expected = cv2.imencode(".jpg", render.draw_detections(source, details, render.coco_names()),
+                                   [cv2.IMWRITE_JPEG_QUALITY, 90])
+        np.testing.assert_array_equal(rendered, cv2.imdecode(expected, cv2.IMREAD_COLOR))
+        self.assertGreater(np.abs(rendered.astype(int) - source.astype(int)).max(), 100)
+
+        self.client.get(f"/api/history/{record.id}/render/").close()
+        self.assertEqual(render.render_cache.stats()["hits"], 1)
+
+    def test_missing_input_is_404(self):
+        record = DetectionHistory.objects.get(pk=self._post()["db_record_id"])
+        os.remove(os.path.join(self.media, record.input_path))
+        response = self.client.get(f"/api/history/{record.id}/render/")
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("error", response.json())
+
+    def test_render_cache_evicts_by_bytes(self):
+        cache = render.RenderCache(os.path.join(self.media, "evict"), max_bytes=250)
+        cache.put("a", b"a" * 100)
+        cache.put("b", b"b" * 100)
+        # "a" запрошена недавно, поэтому при переполнении вытесняется "b"
+        self.assertIsNotNone(cache.get("a"))
+        cache.put("c", b"c" * 100)
+        self.assertIsNone(cache.get("b"))
+        self.assertFalse(os.path.exists(cache.path("b")))
+        self.assertIsNotNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (2, 200, 1))
+        # Индекс восстанавливается по каталогу после перезапуска
+        self.assertEqual(render.RenderCache(cache.directory, max_bytes=250).stats()["bytes"], 200)
+
+
+class InputPersistTests(TestCase):
+    """
+    Фоновое сохранение исходного файла: запись в историю создаётся только после него.
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        for subdir in ("input_img", "output_img"):
+            os.makedirs(os.path.join(media.name, subdir))
+        self.media = media.name
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media.name, YOLO_MODELS=["test-stub"], INPUT_PERSIST_ASYNC=True,
+            HISTORY_WRITE_GROUP_COMMIT=False, RESULT_CACHE_ENABLED=False,
+        ))
+        registry.register("test-stub", benchmark.StubModel(boxes_per_frame=5, batch_ms=0, frame_ms=0))
+        self.addCleanup(registry.unload, "test-stub")
+
+    def _post(self):
+        upload = SimpleUploadedFile("thumb.jpg", benchmark.synthetic_image(160, 120, seed=5), content_type="image/jpeg")
+        return self.client.post("/api/process-image/", {"image": upload, "model": "test-stub"})
+
+    def test_history_row_points_to_written_file(self):
+        response = self._post()
+        self.assertEqual(response.status_code, 200, response.content)
+        record = DetectionHistory.objects.get(pk=response.json()["db_record_id"])
+        self.assertTrue(os.path.exists(os.path.join(self.media, record.input_path)))
+
+    def test_failed_write_is_reported(self):
+        with mock.patch.object(storage, "_write_input", side_effect=OSError("No space left on device")), \
+                self.assertLogs("detection.storage", "ERROR"):
+            response = self._post()
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("No space left on device", response.json()["error"])
+        self.assertFalse(DetectionHistory.objects.exists())
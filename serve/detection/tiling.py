@@ -0,0 +1,162 @@
+import time
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+MERGE_METHODS = ("nms", "wbf")
+
+
+def tile_windows(width, height, tile_size, overlap):
+    """
+    Окна тайлов (x1, y1, x2, y2), покрывающие изображение с перекрытием overlap (доля тайла).
+    Последний тайл в ряду/столбце прижимается к краю, так что все тайлы одного размера
+    (кроме случая, когда изображение меньше тайла).
+    """
+    step = max(1, int(tile_size * (1.0 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def box_iou(box, boxes):
+    """
+    IoU одного бокса (4,) со всеми боксами (N, 4).
+    """
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def _groups(boxes, scores, classes, iou_threshold):
+    """
+    Жадная группировка по убыванию уверенности: каждый ещё не занятый бокс забирает
+    в свою группу все оставшиеся боксы того же класса с IoU > iou_threshold.
+    Возвращает список массивов индексов; первый индекс группы – её лидер.
+    Сравнение одного бокса со всеми остальными векторизовано.
+    """
+    order = np.argsort(-scores, kind="stable")
+    boxes, classes = boxes[order], classes[order]
+    free = np.ones(len(order), dtype=bool)
+    groups = []
+    for i in range(len(order)):
+        if not free[i]:
+            continue
+        candidates = np.flatnonzero(free)
+        same = candidates[classes[candidates] == classes[i]]
+        members = same[box_iou(boxes[i], boxes[same]) > iou_threshold]
+        members = np.union1d(members, [i])
+        free[members] = False
+        # Лидер группы – первым
+        members = np.concatenate(([i], members[members != i]))
+        groups.append(order[members])
+    return groups
+
+
+def nms(boxes, scores, classes, iou_threshold=0.5):
+    """
+    NMS по классам; возвращает индексы оставленных боксов.
+    """
+    if not len(boxes):
+        return np.zeros(0, dtype=np.int64)
+    return np.array([group[0] for group in _groups(boxes, scores, classes, iou_threshold)], dtype=np.int64)
+
+
+def weighted_boxes_fusion(boxes, scores, classes, iou_threshold=0.5):
+    """
+    WBF: боксы группы усредняются с весами-уверенностями, уверенность – средняя по группе.
+    Возвращает (boxes, scores, classes) после слияния.
+    """
+    if not len(boxes):
+        return boxes, scores, classes
+    fused_boxes, fused_scores, fused_classes = [], [], []
+    for group in _groups(boxes, scores, classes, iou_threshold):
+        weights = scores[group]
+        fused_boxes.append((boxes[group] * weights[:, None]).sum(axis=0) / weights.sum())
+        fused_scores.append(weights.mean())
+        fused_classes.append(classes[group[0]])
+    return np.array(fused_boxes), np.array(fused_scores), np.array(fused_classes)
+
+
+def merge_detections(boxes, scores, classes, method="nms", iou_threshold=0.5):
+    """
+    Сливает дубли детекций из перекрывающихся тайлов методом nms или wbf.
+    """
+    if method == "wbf":
+        return weighted_boxes_fusion(boxes, scores, classes, iou_threshold)
+    keep = nms(boxes, scores, classes, iou_threshold)
+    return boxes[keep], scores[keep], classes[keep]
+
+
+def iter_tile_batches(frame, windows, batch_size):
+    """
+    Лениво выдаёт тайлы порциями по batch_size: тайл – срез (view) уже декодированного кадра,
+    копия не создаётся, поэтому сверх самого изображения в памяти только текущий батч.
+    """
+    for start in range(0, len(windows), batch_size):
+        chunk = windows[start:start + batch_size]
+        yield chunk, [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in chunk]
+
+
+def predict_tiled(frame, predict, tile_size=1024, overlap=0.2, batch_size=4, merge="nms",
+                  iou_threshold=0.5, include_full=True):
+    """
+    Тайловый инференс для больших изображений.
+    Кадр режется на перекрывающиеся тайлы tile_size x tile_size, тайлы прогоняются через
+    predict(list of frames) -> list of Results батчами по batch_size, боксы переводятся
+    в координаты всего кадра и сливаются merge_detections. При include_full к тайлам
+    добавляется проход по всему кадру – для крупных объектов, не помещающихся в тайл.
+    Возвращает (Results по всему кадру, info).
+    """
+    started = time.perf_counter()
+    height, width = frame.shape[:2]
+    windows = tile_windows(width, height, tile_size, overlap)
+    parts = []
+    names = None
+
+    for chunk, tiles in iter_tile_batches(frame, windows, batch_size):
+        for (x1, y1, _, _), result in zip(chunk, predict(tiles)):
+            names = result.names
+            data = result.boxes.data.cpu().numpy() if result.boxes is not None else np.zeros((0, 6))
+            if len(data):
+                data = data[:, :6].copy()
+                data[:, [0, 2]] += x1
+                data[:, [1, 3]] += y1
+                parts.append(data)
+
+    if include_full and len(windows) > 1:
+        result = predict([frame])[0]
+        names = result.names
+        if result.boxes is not None and len(result.boxes):
+            parts.append(result.boxes.data.cpu().numpy()[:, :6])
+
+    detections = np.concatenate(parts) if parts else np.zeros((0, 6), dtype=np.float32)
+    raw = len(detections)
+    boxes, scores, classes = merge_detections(
+        detections[:, :4], detections[:, 4], detections[:, 5], merge, iou_threshold)
+    merged = np.concatenate([boxes.reshape(-1, 4), scores.reshape(-1, 1), classes.reshape(-1, 1)], axis=1)
+
+    result = Results(frame, path="", names=names or {}, boxes=torch.from_numpy(merged.astype(np.float32)))
+    info = {
+        "tiles": len(windows),
+        "batch_size": batch_size,
+        "raw_detections": raw,
+        "merged_detections": len(merged),
+        "tiling_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    return result, info
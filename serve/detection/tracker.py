@@ -0,0 +1,118 @@
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Матрица IoU между двумя наборами боксов xyxy формы (N, 4) и (M, 4).
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    if not len(boxes_a) or not len(boxes_b):
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.float32)
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0).astype(np.float32)
+
+
+class IoUTracker:
+    """
+    Лёгкий трекер для прореженной детекции видео.
+    На ключевых кадрах (update) детекции сопоставляются с треками жадно по IoU
+    внутри одного класса; по смещению между ключевыми кадрами оценивается
+    скорость бокса (модель постоянной скорости со сглаживанием).
+    На промежуточных кадрах (predict) боксы треков экстраполируются по скорости.
+    Трек удаляется, если не подтверждался детекцией max_age ключевых кадров подряд.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=1, smoothing=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.smoothing = smoothing
+        self._next_id = 1
+        self._tracks = []
+
+    def update(self, frame_idx, detections):
+        """
+        detections: список словарей с ключами class, confidence, bbox.
+        Возвращает те же словари, дополненные track_id.
+        """
+        boxes = np.array([d["bbox"] for d in detections], dtype=np.float32).reshape(-1, 4)
+        predicted = np.array([self._predict_box(t, frame_idx) for t in self._tracks],
+                             dtype=np.float32).reshape(-1, 4)
+        ious = iou_matrix(predicted, boxes)
+        for ti, track in enumerate(self._tracks):
+            for di, detection in enumerate(detections):
+                if track["class"] != detection["class"]:
+                    ious[ti, di] = 0.0
+
+        matched_tracks, matched_dets = set(), set()
+        if ious.size:
+            order = np.dstack(np.unravel_index(np.argsort(-ious, axis=None), ious.shape))[0]
+            for ti, di in order:
+                if ious[ti, di] < self.iou_threshold:
+                    break
+                if ti in matched_tracks or di in matched_dets:
+                    continue
+                matched_tracks.add(ti)
+                matched_dets.add(di)
+                self._correct(self._tracks[ti], frame_idx, boxes[di], detections[di])
+                detections[di]["track_id"] = self._tracks[ti]["id"]
+
+        survivors = []
+        for ti, track in enumerate(self._tracks):
+            if ti not in matched_tracks:
+                track["misses"] += 1
+            if track["misses"] <= self.max_age:
+                survivors.append(track)
+        self._tracks = survivors
+
+        for di, detection in enumerate(detections):
+            if di in matched_dets:
+                continue
+            track = {
+                "id": self._next_id,
+                "class": detection["class"],
+                "confidence": detection["confidence"],
+                "box": boxes[di],
+                "velocity": np.zeros(4, dtype=np.float32),
+                "frame": frame_idx,
+                "misses": 0,
+                "hits": 1,
+            }
+            self._next_id += 1
+            self._tracks.append(track)
+            detection["track_id"] = track["id"]
+        return detections
+
+    def predict(self, frame_idx):
+        """
+        Экстраполированные боксы подтверждённых треков на промежуточном кадре.
+        """
+        return [{
+            "class": track["class"],
+            "confidence": track["confidence"],
+            "bbox": self._predict_box(track, frame_idx).tolist(),
+            "track_id": track["id"],
+        } for track in self._tracks if track["misses"] == 0]
+
+    def _predict_box(self, track, frame_idx):
+        return track["box"] + track["velocity"] * (frame_idx - track["frame"])
+
+    def _correct(self, track, frame_idx, box, detection):
+        gap = frame_idx - track["frame"]
+        if gap > 0:
+            velocity = (box - track["box"]) / gap
+            if track["hits"] > 1:
+                velocity = self.smoothing * track["velocity"] + (1 - self.smoothing) * velocity
+            track["velocity"] = velocity
+        track["box"] = box
+        track["frame"] = frame_idx
+        track["confidence"] = detection["confidence"]
+        track["misses"] = 0
+        track["hits"] += 1
@@ -1,7 +1,23 @@
 from django.urls import path
-from .views import ProcessImageAPIView, ProcessVideoAPIView
+from .views import (
+    CacheStatsAPIView, HistoryDetailAPIView, HistoryDetectionsAPIView, HistoryListAPIView, HistoryRenderAPIView,
+    LiveStreamAPIView, LiveStreamEventsAPIView, LiveStreamsAPIView, ModelRegistryAPIView,
+    ProcessImageAPIView, ProcessImagesAPIView, ProcessVideoAPIView, VideoJobEventsAPIView, VideoJobStatusAPIView,
+)
 
 urlpatterns = [
     path('process-image/', ProcessImageAPIView.as_view(), name='process_image'),
+    path('process-images/', ProcessImagesAPIView.as_view(), name='process_images'),
     path('process-video/', ProcessVideoAPIView.as_view(), name='process_video'),
+    path('history/', HistoryListAPIView.as_view(), name='history'),
+    path('history/<int:record_id>/', HistoryDetailAPIView.as_view(), name='history_detail'),
+    path('history/<int:record_id>/detections/', HistoryDetectionsAPIView.as_view(), name='history_detections'),
+    path('history/<int:record_id>/render/', HistoryRenderAPIView.as_view(), name='history_render'),
+    path('models/', ModelRegistryAPIView.as_view(), name='models'),
+    path('cache-stats/', CacheStatsAPIView.as_view(), name='cache_stats'),
+    path('video-jobs/<int:job_id>/', VideoJobStatusAPIView.as_view(), name='video_job_status'),
+    path('video-jobs/<int:job_id>/events/', VideoJobEventsAPIView.as_view(), name='video_job_events'),
+    path('live-streams/', LiveStreamsAPIView.as_view(), name='live_streams'),
+    path('live-streams/<str:stream_id>/', LiveStreamAPIView.as_view(), name='live_stream'),
+    path('live-streams/<str:stream_id>/events/', LiveStreamEventsAPIView.as_view(), name='live_stream_events'),
 ]
@@ -0,0 +1,146 @@
+import queue
+import threading
+import time
+
+_END = object()
+
+
+class PipelineAborted(Exception):
+    """
+    Конвейер остановлен из-за ошибки в одной из стадий.
+    """
+
+
+class StagedPipeline:
+    """
+    Конвейер из стадий, каждая из которых работает в своём потоке.
+    Стадии связаны ограниченными очередями: если следующая стадия не успевает,
+    предыдущая блокируется на put (обратное давление), так что в памяти
+    одновременно находится не больше queue_size элементов на каждую связь.
+    Каждая стадия обрабатывает элементы строго по порядку, поэтому порядок
+    кадров на выходе совпадает с порядком на входе.
+
+    source: (name, iterable) – источник элементов.
+    stages: список (name, fn, batch_size); fn получает список из 1..batch_size
+    элементов (всё, что уже лежит в очереди, но не больше batch_size) и
+    возвращает список результатов для следующей стадии (у последней стадии – None).
+    """
+
+    def __init__(self, source, stages, queue_size=8):
+        self.source = source
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self._stop = threading.Event()
+        self._error = None
+        self.timings = {}
+
+    def _record(self, name, busy=0.0, wait_in=0.0, wait_out=0.0, items=0):
+        stat = self.timings.setdefault(name, {"busy_s": 0.0, "wait_in_s": 0.0, "wait_out_s": 0.0, "items": 0})
+        stat["busy_s"] += busy
+        stat["wait_in_s"] += wait_in
+        stat["wait_out_s"] += wait_out
+        stat["items"] += items
+
+    def _fail(self, exc):
+        if self._error is None:
+            self._error = exc
+        self._stop.set()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineAborted()
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise PipelineAborted()
+
+    def _run_source(self, name, iterable, q_out):
+        try:
+            iterator = iter(iterable)
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    self._record(name, busy=time.perf_counter() - t0)
+                    break
+                t1 = time.perf_counter()
+                self._put(q_out, item)
+                self._record(name, busy=t1 - t0, wait_out=time.perf_counter() - t1, items=1)
+            self._put(q_out, _END)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _run_stage(self, name, fn, batch_size, q_in, q_out):
+        try:
+            finished = False
+            while not finished:
+                t0 = time.perf_counter()
+                batch = [self._get(q_in)]
+                while len(batch) < batch_size:
+                    try:
+                        batch.append(q_in.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is _END:
+                    batch.pop()
+                    finished = True
+                t1 = time.perf_counter()
+                outputs = fn(batch) if batch else None
+                t2 = time.perf_counter()
+                if q_out is not None:
+                    for item in outputs or ():
+                        self._put(q_out, item)
+                    if finished:
+                        self._put(q_out, _END)
+                self._record(name, busy=t2 - t1, wait_in=t1 - t0,
+                             wait_out=time.perf_counter() - t2, items=len(batch))
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def run(self):
+        """
+        Запускает все стадии и ждёт их завершения.
+        Возвращает self.timings; исключение из любой стадии пробрасывается.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        source_name, iterable = self.source
+        threads = [threading.Thread(
+            target=self._run_source, args=(source_name, iterable, queues[0]),
+            name=f"pipeline-{source_name}", daemon=True,
+        )]
+        for i, (name, fn, batch_size) in enumerate(self.stages):
+            q_out = queues[i + 1] if i + 1 < len(queues) else None
+            threads.append(threading.Thread(
+                target=self._run_stage, args=(name, fn, max(1, int(batch_size)), queues[i], q_out),
+                name=f"pipeline-{name}", daemon=True,
+            ))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.timings["wall_s"] = time.perf_counter() - started
+
+        if self._error is not None:
+            raise self._error
+        for name, stat in self.timings.items():
+            if isinstance(stat, dict):
+                for key in ("busy_s", "wait_in_s", "wait_out_s"):
+                    stat[key] = round(stat[key], 4)
+        self.timings["wall_s"] = round(self.timings["wall_s"], 4)
+        return self.timings
@@ -1,25 +1,37 @@
 import os
 import uuid
-import json
-import requests
+import hashlib
+import datetime
 from urllib.parse import urlparse
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from PIL import Image
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, serializers
+from rest_framework.pagination import CursorPagination
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 
 from drf_spectacular.utils import (
     extend_schema, extend_schema_view, inline_serializer, OpenApiParameter, OpenApiTypes
 )
 
-from .models import DetectionHistory
-from .serializers import DetectionHistorySerializer
-from . import yolo
+from .cache import cache_key, entry_from_record, result_cache
+from .columnar import DetectionColumns, columns_path
+from .fetcher import FetchError, fetcher
+from .models import Detection, DetectionHistory, VideoJob
+from .registry import registry
+from .render import render_cache, render_record
+from .serializers import DetectionHistoryListSerializer, DetectionHistorySerializer, VideoJobSerializer
+from .tiling import MERGE_METHODS
+from .streaming import (EventStreamRenderer, NDJSONRenderer, event_stream_slots, format_ndjson, format_sse,
+                        iter_job_events)
+from . import jobs, live, metrics, persistence, resolution, storage, workers, yolo
 
 def generate_unique_filename(original_name: str) -> str:
     """
@@ -31,6 +43,283 @@ def generate_unique_filename(original_name: str) -> str:
     return f"{uuid.uuid4().hex[:8]}_{original_name}"
 
 
+def read_image_from_url(image_url, prefetched=None):
+    """
+    Скачивает изображение по ссылке в память (fetcher: пул соединений, таймауты, лимит размера,
+    повторная проверка по ETag/Last-Modified). prefetched – уже полученный результат fetch_many.
+    Возвращает (unique_name, байты содержимого); при ошибке бросает ValueError с текстом для клиента.
+    """
+    original_name = os.path.basename(urlparse(image_url).path)
+    unique_name = generate_unique_filename(original_name)
+    if prefetched is not None:
+        result = prefetched
+    else:
+        with metrics.stage("download"):
+            result = fetcher.fetch(image_url)
+    if isinstance(result, FetchError):
+        raise result
+    return unique_name, result.data
+
+
+def read_uploaded_image(uploaded_file):
+    """
+    Читает загруженный файл в память. Возвращает (unique_name, байты содержимого).
+    """
+    unique_name = generate_unique_filename(uploaded_file.name)
+    with metrics.stage("read_upload"):
+        return unique_name, b"".join(uploaded_file.chunks())
+
+
+def parse_annotate(data):
+    """
+    Флаг annotate из запроса; по умолчанию YOLO_ANNOTATE_OUTPUT.
+    """
+    value = data.get('annotate')
+    if value is None or value == '':
+        return getattr(settings, 'YOLO_ANNOTATE_OUTPUT', True)
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def parse_tiling(data):
+    """
+    Параметры тайлового инференса из запроса: tiled, tile_size, tile_overlap, tile_batch_size, tile_merge.
+    Возвращает словарь для yolo.process_image_yolo10m или None, если тайлинг не запрошен;
+    при ошибке бросает ValueError с текстом для клиента.
+    """
+    tiled = str(data.get('tiled', '')).lower() in ('1', 'true', 'yes')
+    if not tiled and not data.get('tile_size'):
+        return None
+    tiling = yolo.default_tiling()
+    try:
+        tiling["tile_size"] = int(data.get('tile_size') or tiling["tile_size"])
+        tiling["overlap"] = float(data.get('tile_overlap', tiling["overlap"]))
+        tiling["batch_size"] = int(data.get('tile_batch_size') or tiling["batch_size"])
+    except (TypeError, ValueError):
+        raise ValueError("tile_size и tile_batch_size должны быть целыми числами, tile_overlap – числом.")
+    max_tile_size = getattr(settings, 'YOLO_TILE_MAX_SIZE', 4096)
+    if not 128 <= tiling["tile_size"] <= max_tile_size:
+        raise ValueError(f"tile_size должен быть от 128 до {max_tile_size}.")
+    if not 0.0 <= tiling["overlap"] <= 0.5:
+        raise ValueError("tile_overlap должен быть от 0 до 0.5.")
+    max_batch_size = getattr(settings, 'YOLO_TILE_MAX_BATCH_SIZE', 16)
+    if not 1 <= tiling["batch_size"] <= max_batch_size:
+        raise ValueError(f"tile_batch_size должен быть от 1 до {max_batch_size}.")
+    tiling["merge"] = data.get('tile_merge') or tiling["merge"]
+    if tiling["merge"] not in MERGE_METHODS:
+        raise ValueError(f"tile_merge должен быть одним из: {', '.join(MERGE_METHODS)}.")
+    return tiling
+
+
+def parse_inference(data):
+    """
+    Параметры инференса из запроса: imgsz (размер входа модели, кратный 32, или auto), conf, iou,
+    classes (имена классов через запятую или списком), max_det, latency_budget_ms (бюджет для imgsz=auto).
+    Недостающие берутся из yolo.default_inference(). При ошибке бросает ValueError с текстом для клиента.
+    """
+    inference = yolo.default_inference()
+    imgsz = data.get('imgsz')
+    if imgsz is not None and imgsz != '':
+        if str(imgsz).lower() == 'auto':
+            inference["imgsz"] = "auto"
+        else:
+            step, max_imgsz = resolution.IMGSZ_STEP, getattr(settings, 'YOLO_IMGSZ_MAX', 1280)
+            try:
+                imgsz = int(imgsz)
+            except (TypeError, ValueError):
+                raise ValueError("imgsz должен быть целым числом или auto.")
+            if not step <= imgsz <= max_imgsz or imgsz % step:
+                raise ValueError(f"imgsz должен быть auto или кратным {step} числом от {step} до {max_imgsz}.")
+            inference["imgsz"] = imgsz
+
+    for field, cast, low, high in (('conf', float, 0.0, 1.0), ('iou', float, 0.0, 1.0),
+                                   ('max_det', int, 1, getattr(settings, 'YOLO_MAX_DET_LIMIT', 1000)),
+                                   ('latency_budget_ms', float, 0.0, 60000.0)):
+        value = data.get(field)
+        if value is None or value == '':
+            continue
+        try:
+            value = cast(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} должен быть {'целым ' if cast is int else ''}числом.")
+        if not low <= value <= high:
+            raise ValueError(f"{field} должен быть от {low} до {high}.")
+        inference[field] = value
+
+    classes = data.getlist('classes') if hasattr(data, 'getlist') else data.get('classes')
+    if isinstance(classes, str):
+        classes = [classes]
+    names = sorted({name.strip() for item in classes or [] for name in str(item).split(',') if name.strip()})
+    inference["classes"] = names or None
+    return inference
+
+
+def cache_params(tiling, inference, imgsz):
+    """
+    Параметры инференса для ключа кэша результатов. imgsz – фактический размер входа модели
+    (imgsz="auto" и бюджет задержки учитываются через него, см. yolo.effective_imgsz).
+    Фильтры, совпадающие со значениями по умолчанию, и imgsz=640 в ключ не входят: ключи запросов
+    без параметров остаются прежними, а их результаты получены именно с входом 640.
+    """
+    params = {}
+    if tiling:
+        params["tiling"] = tiling
+    filters = {name: value for name, value in inference.items() if name not in ("imgsz", "latency_budget_ms")}
+    defaults = {name: value for name, value in yolo.default_inference().items() if name in filters}
+    if filters != defaults:
+        params["inference"] = filters
+    if imgsz != resolution.DEFAULT_IMGSZ:
+        params["imgsz"] = imgsz
+    return params or None
+
+
+def resolve_imgsz(data, inference, model_name, tiling):
+    """
+    Фиксирует imgsz запроса до поиска в кэше: при imgsz="auto" изображение декодируется
+    и размер входа выбирается по нему. Возвращает (inference с числовым imgsz, кадр или None,
+    если изображение ещё не декодировано). Бросает ValueError, если изображение не декодируется.
+    """
+    if inference["imgsz"] != "auto":
+        return {**inference, "imgsz": int(inference["imgsz"])}, None
+    with metrics.stage("decode"):
+        frame = storage.decode_image(data)
+    return {**inference, "imgsz": yolo.effective_imgsz(frame, inference, model_name, tiling)}, frame
+
+
+def parse_video_sizes(data):
+    """
+    target_height и decode_max_size из запроса (по умолчанию VIDEO_DOWNLOAD_TARGET_HEIGHT и VIDEO_DECODE_MAX_SIZE).
+    При ошибке бросает ValueError с текстом для клиента.
+    """
+    values = []
+    for field, setting, default in (('target_height', 'VIDEO_DOWNLOAD_TARGET_HEIGHT', 720),
+                                    ('decode_max_size', 'VIDEO_DECODE_MAX_SIZE', 1280)):
+        value = data.get(field)
+        if value is None or value == '':
+            values.append(getattr(settings, setting, default))
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} должен быть целым числом.")
+        if value != 0 and not 64 <= value <= 8192:
+            raise ValueError(f"{field} должен быть 0 или от 64 до 8192.")
+        values.append(value)
+    return tuple(values)
+
+
+class _EncodedEvents:
+    """
+    Байты потокового ответа из генератора событий. StreamingHttpResponse вызывает close()
+    по окончании ответа, даже если клиент отключился до первого события, – тогда
+    закрывается генератор и вызывается on_close (освобождение слота потока).
+    """
+
+    def __init__(self, events, sse, on_close=None):
+        self.events = events
+        self.sse = sse
+        self.on_close = on_close
+
+    def __iter__(self):
+        for event in self.events:
+            if event is None:
+                yield b": keep-alive\n\n" if self.sse else format_ndjson({"event": "keep-alive"})
+            else:
+                yield format_sse(event) if self.sse else format_ndjson(event)
+
+    def close(self):
+        close = getattr(self.events, 'close', None)
+        if close is not None:
+            close()
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+
+def stream_events(request, events, on_close=None):
+    """
+    Потоковый ответ NDJSON или SSE (по выбранному рендереру) из генератора событий; None – keep-alive.
+    on_close вызывается один раз по окончании ответа.
+    """
+    sse = request.accepted_renderer.format == 'sse'
+    response = StreamingHttpResponse(_EncodedEvents(events, sse, on_close),
+                                     content_type=request.accepted_renderer.media_type)
+    response['Cache-Control'] = 'no-cache'
+    # Отключает буферизацию ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def open_event_stream(request, make_events):
+    """
+    Потоковый ответ событий, если в процессе есть свободный слот (VIDEO_STREAM_MAX_CONCURRENT), иначе 429.
+    Поток держит поток обработки запроса до своего конца, поэтому их число ограничено;
+    слот освобождается по окончании ответа.
+    """
+    if not event_stream_slots.acquire(getattr(settings, 'VIDEO_STREAM_MAX_CONCURRENT', 8)):
+        return Response({"error": "Слишком много открытых потоков событий, повторите запрос позже."},
+                        status=status.HTTP_429_TOO_MANY_REQUESTS, headers={"Retry-After": "5"})
+    return stream_events(request, make_events(), on_close=event_stream_slots.release)
+
+
+def media_url(request, path):
+    """
+    Абсолютный URL файла в MEDIA или None, если файл не сохранялся.
+    """
+    return request.build_absolute_uri(os.path.join(settings.MEDIA_URL, path)) if path else None
+
+
+def output_image_url(request, record_id, path, input_path):
+    """
+    URL аннотированного изображения: файл в MEDIA, а если он не сохранялся (annotate=false) –
+    эндпоинт, отрисовывающий изображение по сохранённым детекциям и исходному файлу.
+    """
+    if path:
+        return media_url(request, path)
+    if input_path:
+        return request.build_absolute_uri(reverse('history_render', args=[record_id]))
+    return None
+
+
+ANNOTATE_HELP = (
+    "Сохранить аннотированное изображение сразу (по умолчанию YOLO_ANNOTATE_OUTPUT). "
+    "При false сохраняются только детекции, а output_image ведёт на /api/history/<id>/render/"
+)
+
+
+# Поля тайлового инференса в схемах запросов на обработку изображений
+TILING_FIELDS = {
+    "tiled": serializers.BooleanField(
+        required=False,
+        help_text="Тайловый инференс: изображение режется на перекрывающиеся тайлы, боксы сливаются. "
+                  "Для больших снимков (дроны, сканы), на которых мелкие объекты теряются при уменьшении"
+    ),
+    "tile_size": serializers.IntegerField(required=False, help_text="Размер тайла, px (включает тайлинг; по умолчанию YOLO_TILE_SIZE)"),
+    "tile_overlap": serializers.FloatField(required=False, help_text="Перекрытие тайлов, доля 0-0.5 (YOLO_TILE_OVERLAP)"),
+    "tile_batch_size": serializers.IntegerField(required=False, help_text="Тайлов в одном проходе модели (YOLO_TILE_BATCH_SIZE)"),
+    "tile_merge": serializers.ChoiceField(choices=MERGE_METHODS, required=False, help_text="Слияние боксов: nms или wbf"),
+}
+
+INFERENCE_FIELDS = {
+    "imgsz": serializers.CharField(
+        required=False,
+        help_text="Размер входа модели, px (кратен 32) или auto – по размеру изображения (не больше YOLO_IMGSZ_AUTO_MAX) "
+                  "и бюджету задержки; по умолчанию YOLO_IMGSZ. Мелкие изображения на малом входе обрабатываются в разы быстрее"
+    ),
+    "conf": serializers.FloatField(required=False, help_text="Минимальная уверенность, 0-1 (YOLO_CONF)"),
+    "iou": serializers.FloatField(required=False, help_text="Порог IoU для NMS, 0-1 (YOLO_IOU)"),
+    "classes": serializers.ListField(
+        child=serializers.CharField(), required=False,
+        help_text="Искать только эти классы (имена, можно через запятую); фильтр применяется в самой модели"
+    ),
+    "max_det": serializers.IntegerField(required=False, help_text="Не больше стольких объектов на изображение (YOLO_MAX_DET)"),
+    "latency_budget_ms": serializers.FloatField(
+        required=False,
+        help_text="Для imgsz=auto: вход уменьшается, пока оценка времени прохода на кадр больше бюджета, мс "
+                  "(YOLO_LATENCY_BUDGET_MS, 0 – без бюджета)"
+    ),
+}
+
+
 @extend_schema_view(
     post=extend_schema(
         summary="Обработка изображения (файл или ссылка)",
@@ -39,19 +328,28 @@ def generate_unique_filename(original_name: str) -> str:
             "Принимает изображение двумя способами:\n"
             "- JSON с полем `image_url` – ссылка на изображение.\n"
             "- multipart/form-data с полем `image` – файл изображения.\n\n"
-            "Скачивает/сохраняет изображение, обрабатывает YOLO, сохраняет результат в БД и возвращает JSON с URL-адресами и ID записи."
+            "Декодирует изображение в памяти, обрабатывает YOLO, сохраняет результат в БД и возвращает JSON с URL-адресами и ID записи. "
+            "Оригинал сохраняется в MEDIA в фоне (`INPUT_PERSIST_ENABLED`, `INPUT_PERSIST_ASYNC`)."
         ),
         request={
             "application/json": inline_serializer(
                 name="ImageJSONRequest",
                 fields={
-                    "image_url": serializers.URLField(required=True, help_text="Ссылка на изображение")
+                    "image_url": serializers.URLField(required=True, help_text="Ссылка на изображение"),
+                    "model": serializers.CharField(required=False, help_text="Имя модели из YOLO_MODELS (по умолчанию YOLO_DEFAULT_MODEL)"),
+                    "annotate": serializers.BooleanField(required=False, help_text=ANNOTATE_HELP),
+                    **TILING_FIELDS,
+                    **INFERENCE_FIELDS,
                 }
             ),
             "multipart/form-data": inline_serializer(
                 name="ImageMultipartRequest",
                 fields={
-                    "image": serializers.ImageField(required=True, help_text="Файл изображения")
+                    "image": serializers.ImageField(required=True, help_text="Файл изображения"),
+                    "model": serializers.CharField(required=False, help_text="Имя модели из YOLO_MODELS (по умолчанию YOLO_DEFAULT_MODEL)"),
+                    "annotate": serializers.BooleanField(required=False, help_text=ANNOTATE_HELP),
+                    **TILING_FIELDS,
+                    **INFERENCE_FIELDS,
                 }
             ),
         },
@@ -59,9 +357,14 @@ def generate_unique_filename(original_name: str) -> str:
             200: inline_serializer(
                 name="ImageProcessSuccessResponse",
                 fields={
-                    "input_image": serializers.URLField(),
-                    "output_image": serializers.URLField(),
+                    "input_image": serializers.URLField(allow_null=True, help_text="null, если оригинал не сохраняется"),
+                    "output_image": serializers.URLField(allow_null=True),
                     "db_record_id": serializers.IntegerField(),
+                    "batch_size": serializers.IntegerField(help_text="Размер батча, в котором обработано изображение"),
+                    "queue_wait_ms": serializers.FloatField(help_text="Время ожидания в очереди инференса, мс"),
+                    "tiles": serializers.IntegerField(allow_null=True, help_text="Число тайлов (null без тайлового инференса)"),
+                    "imgsz": serializers.IntegerField(allow_null=True, help_text="Размер входа модели, px (null для результата из кэша)"),
+                    "cached": serializers.BooleanField(help_text="Результат взят из кэша (изображение уже обрабатывалось)"),
                 }
             ),
             400: inline_serializer(
@@ -89,100 +392,342 @@ class ProcessImageAPIView(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
         source_type = "url" if image_url else "file"
+        annotate = parse_annotate(request.data)
 
-        if image_url:
-            original_name = os.path.basename(urlparse(image_url).path)
-            unique_name = generate_unique_filename(original_name)
-            try:
-                resp = requests.get(image_url)
-                if resp.status_code != 200:
-                    return Response({"error": "Не удалось скачать изображение по ссылке."},
-                                    status=status.HTTP_400_BAD_REQUEST)
-            except Exception as e:
-                return Response({"error": f"Ошибка при скачивании: {str(e)}"},
-                                status=status.HTTP_400_BAD_REQUEST)
-            input_path = os.path.join(settings.MEDIA_ROOT, 'input_img', unique_name)
-            with open(input_path, 'wb') as f:
-                f.write(resp.content)
-        else:
-            original_name = uploaded_file.name
-            unique_name = generate_unique_filename(original_name)
-            input_path = os.path.join(settings.MEDIA_ROOT, 'input_img', unique_name)
-            with open(input_path, 'wb') as f:
-                for chunk in uploaded_file.chunks():
-                    f.write(chunk)
+        try:
+            model_name = yolo.resolve_model_name(request.data.get('model'))
+            tiling = parse_tiling(request.data)
+            inference = parse_inference(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Изображение целиком обрабатывается в памяти: байты декодируются один раз,
+        # а исходный файл сохраняется на диск в фоне параллельно инференсу (storage.persist_input)
         try:
-            with Image.open(input_path) as pil_img:
-                width, height = pil_img.size
-            shape_str = f"{width}x{height}"
-        except Exception as e:
-            return Response({"error": f"Не удалось открыть изображение: {str(e)}"},
-                            status=status.HTTP_400_BAD_REQUEST)
+            if image_url:
+                unique_name, data = read_image_from_url(image_url)
+            else:
+                unique_name, data = read_uploaded_image(uploaded_file)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            yolo.download_model_if_not_exist()
+            inference, frame = resolve_imgsz(data, inference, model_name, tiling)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        content_hash = cache_key(hashlib.sha256(data).hexdigest(), model_name,
+                                 cache_params(tiling, inference, inference["imgsz"]))
+        if getattr(settings, 'RESULT_CACHE_ENABLED', True):
+            with metrics.stage("cache_lookup"):
+                cached = result_cache.get(content_hash)
+            if cached is not None:
+                return Response({
+                    "input_image": media_url(request, cached["input_path"]),
+                    "output_image": output_image_url(request, cached["record_id"], cached["path"], cached["input_path"]),
+                    "db_record_id": cached["record_id"],
+                    "batch_size": None,
+                    "queue_wait_ms": None,
+                    "tiles": None,
+                    "imgsz": None,
+                    "cached": True,
+                }, status=status.HTTP_200_OK)
+
+        try:
+            if frame is None:
+                with metrics.stage("decode"):
+                    frame = storage.decode_image(data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        shape_str = storage.image_shape(frame)
+
+        try:
+            yolo.download_model_if_not_exist(model_name)
         except Exception as e:
             return Response({"error": f"Ошибка загрузки модели: {str(e)}"},
                             status=status.HTTP_400_BAD_REQUEST)
 
+        # Запись исходного файла идёт параллельно инференсу; запись в историю создаётся только после неё
+        input_write = storage.persist_input(os.path.join('input_img', unique_name), data)
+        inference_stats = {}
         try:
-            output_filename, detected_classes, detected_details = yolo.process_image_yolo10m(input_path, unique_name)
+            output_filename, detected_classes, detected_details = yolo.process_image_yolo10m(
+                frame, unique_name, stats=inference_stats, model_name=model_name, annotate=annotate,
+                tiling=tiling, inference=inference)
         except Exception as e:
+            storage.discard_input(input_write)
             return Response({"error": f"Ошибка обработки изображения: {str(e)}"},
                             status=status.HTTP_400_BAD_REQUEST)
 
         classes_str = ", ".join(set(detected_classes)) if detected_classes else ""
-        output_path_relative = os.path.join('output_img', output_filename)
-        detailed_results_json = json.dumps(detected_details, ensure_ascii=False)
-
-        record = DetectionHistory.objects.create(
-            image_name=unique_name,
-            shape=shape_str,
-            classes_from_img=classes_str,
-            detailed_results=detailed_results_json,
-            path=output_path_relative,
-            input_path=os.path.join('input_img', unique_name),
-            source_type=source_type
-        )
+        output_path_relative = os.path.join('output_img', output_filename) if output_filename else ""
+        try:
+            input_path_relative = input_write.result()
+        except OSError as e:
+            return Response({"error": f"Не удалось сохранить исходное изображение: {str(e)}"},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        input_url = request.build_absolute_uri(os.path.join(settings.MEDIA_URL, 'input_img', unique_name))
-        output_url = request.build_absolute_uri(os.path.join(settings.MEDIA_URL, 'output_img', output_filename))
+        with metrics.stage("db_insert"):
+            record, = persistence.save_history([(DetectionHistory(
+                image_name=unique_name,
+                shape=shape_str,
+                classes_from_img=classes_str,
+                path=output_path_relative,
+                input_path=input_path_relative,
+                source_type=source_type,
+                content_hash=content_hash
+            ), detected_details)])
+        result_cache.put(content_hash, entry_from_record(record))
 
         return Response({
-            "input_image": input_url,
-            "output_image": output_url,
-            "db_record_id": record.id
+            "input_image": media_url(request, input_path_relative),
+            "output_image": output_image_url(request, record.id, output_path_relative, input_path_relative),
+            "db_record_id": record.id,
+            "batch_size": inference_stats.get("batch_size"),
+            "queue_wait_ms": inference_stats.get("queue_wait_ms"),
+            "tiles": inference_stats.get("tiles"),
+            "imgsz": inference_stats.get("imgsz"),
+            "cached": False,
         }, status=status.HTTP_200_OK)
 
 
 @extend_schema_view(
     post=extend_schema(
-        summary="Обработка видео целиком (ссылка) с использованием yt-dlp",
+        summary="Пакетная обработка изображений (файлы и/или ссылки)",
+        description=(
+            "**POST /api/process-images/**\n\n"
+            "Принимает несколько изображений за один запрос:\n"
+            "- JSON с полем `image_urls` – список ссылок на изображения.\n"
+            "- multipart/form-data с полями `images` (несколько файлов) и/или `image_urls` (несколько ссылок).\n\n"
+            "Изображения прогоняются через YOLO батчами (не более `YOLO_MAX_BATCH_SIZE` за проход), "
+            "записи в БД создаются одним запросом. Возвращает результат по каждому элементу в порядке передачи: "
+            "сначала файлы, затем ссылки. Ошибка по одному элементу не прерывает обработку остальных."
+        ),
+        request={
+            "application/json": inline_serializer(
+                name="ImagesJSONRequest",
+                fields={
+                    "image_urls": serializers.ListField(child=serializers.URLField(), help_text="Список ссылок на изображения"),
+                    "model": serializers.CharField(required=False, help_text="Имя модели из YOLO_MODELS (по умолчанию YOLO_DEFAULT_MODEL)"),
+                    "annotate": serializers.BooleanField(required=False, help_text=ANNOTATE_HELP),
+                    **TILING_FIELDS,
+                    **INFERENCE_FIELDS,
+                }
+            ),
+            "multipart/form-data": inline_serializer(
+                name="ImagesMultipartRequest",
+                fields={
+                    "images": serializers.ListField(child=serializers.ImageField(), required=False, help_text="Файлы изображений"),
+                    "image_urls": serializers.ListField(child=serializers.URLField(), required=False, help_text="Ссылки на изображения"),
+                    "model": serializers.CharField(required=False, help_text="Имя модели из YOLO_MODELS (по умолчанию YOLO_DEFAULT_MODEL)"),
+                    "annotate": serializers.BooleanField(required=False, help_text=ANNOTATE_HELP),
+                    **TILING_FIELDS,
+                    **INFERENCE_FIELDS,
+                }
+            ),
+        },
+        responses={
+            200: inline_serializer(
+                name="ImagesProcessSuccessResponse",
+                fields={
+                    "results": serializers.ListField(child=inline_serializer(
+                        name="ImagesProcessItem",
+                        fields={
+                            "source": serializers.CharField(),
+                            "input_image": serializers.URLField(required=False, allow_null=True),
+                            "output_image": serializers.URLField(required=False, allow_null=True),
+                            "db_record_id": serializers.IntegerField(required=False),
+                            "found_classes": serializers.ListField(child=serializers.CharField(), required=False),
+                            "cached": serializers.BooleanField(required=False),
+                            "error": serializers.CharField(required=False),
+                        }
+                    )),
+                }
+            ),
+            400: inline_serializer(
+                name="ImagesProcessErrorResponse",
+                fields={"error": serializers.CharField()},
+            ),
+        },
+    )
+)
+class ProcessImagesAPIView(APIView):
+    """
+    Эндпоинт для пакетной обработки изображений.
+    """
+    parser_classes = (JSONParser, MultiPartParser, FormParser)
+
+    def post(self, request, format=None):
+        uploaded_files = request.FILES.getlist('images')
+        if hasattr(request.data, 'getlist'):
+            image_urls = request.data.getlist('image_urls')
+        else:
+            image_urls = request.data.get('image_urls') or []
+        if isinstance(image_urls, str):
+            image_urls = [image_urls]
+
+        total = len(uploaded_files) + len(image_urls)
+        if not total:
+            return Response({"error": "Не передано ни ссылок, ни файлов."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        max_items = getattr(settings, 'YOLO_MAX_IMAGES_PER_REQUEST', 500)
+        if total > max_items:
+            return Response({"error": f"Слишком много изображений в одном запросе (максимум {max_items})."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            model_name = yolo.resolve_model_name(request.data.get('model'))
+            tiling = parse_tiling(request.data)
+            inference = parse_inference(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        annotate = parse_annotate(request.data)
+
+        try:
+            yolo.download_model_if_not_exist(model_name)
+        except Exception as e:
+            return Response({"error": f"Ошибка загрузки модели: {str(e)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        sources = [("file", f.name, f) for f in uploaded_files] + [("url", url, url) for url in image_urls]
+        results = [None] * len(sources)
+        prepared = []  # (index, record, detected_classes, detected_details)
+        use_cache = getattr(settings, 'RESULT_CACHE_ENABLED', True)
+        # Изображения читаются и декодируются порциями по размеру батча модели,
+        # так что в памяти одновременно не больше одного батча декодированных кадров
+        chunk_size = max(1, int(getattr(settings, 'YOLO_MAX_BATCH_SIZE', 8)))
+
+        for start in range(0, len(sources), chunk_size):
+            chunk = []  # (index, source_type, unique_name, frame, data, content_hash, inference)
+            indexes = range(start, min(start + chunk_size, len(sources)))
+            # Ссылки порции скачиваются параллельно
+            url_indexes = [index for index in indexes if sources[index][0] == "url"]
+            with metrics.stage("download"):
+                prefetched = dict(zip(url_indexes, fetcher.fetch_many([sources[index][2] for index in url_indexes])))
+            for index in indexes:
+                source_type, source, payload = sources[index]
+                try:
+                    if source_type == "url":
+                        unique_name, data = read_image_from_url(payload, prefetched[index])
+                    else:
+                        unique_name, data = read_uploaded_image(payload)
+                    item_inference, frame = resolve_imgsz(data, inference, model_name, tiling)
+                    content_hash = cache_key(hashlib.sha256(data).hexdigest(), model_name,
+                                             cache_params(tiling, item_inference, item_inference["imgsz"]))
+                    with metrics.stage("cache_lookup"):
+                        cached = result_cache.get(content_hash) if use_cache else None
+                    if cached is not None:
+                        results[index] = {
+                            "source": source,
+                            "input_image": media_url(request, cached["input_path"]),
+                            "output_image": output_image_url(request, cached["record_id"], cached["path"], cached["input_path"]),
+                            "db_record_id": cached["record_id"],
+                            "found_classes": list(set(cached["detected_classes"])),
+                            "cached": True,
+                        }
+                        continue
+                    if frame is None:
+                        with metrics.stage("decode"):
+                            frame = storage.decode_image(data)
+                except ValueError as e:
+                    results[index] = {"source": source, "error": str(e)}
+                    continue
+                input_write = storage.persist_input(os.path.join('input_img', unique_name), data)
+                chunk.append((index, source_type, unique_name, frame, input_write, content_hash, item_inference))
+            if not chunk:
+                continue
+
+            try:
+                outputs = yolo.process_images_yolo10m(
+                    [(item[3], item[2], item[6]) for item in chunk], max_batch_size=chunk_size,
+                    model_name=model_name, annotate=annotate, tiling=tiling)
+            except Exception as e:
+                # Сбой порции не отменяет уже обработанные порции: её элементы помечаются ошибкой
+                for item in chunk:
+                    storage.discard_input(item[4])
+                    results[item[0]] = {"source": sources[item[0]][1],
+                                        "error": f"Ошибка обработки изображения: {str(e)}"}
+                continue
+
+            for (index, source_type, unique_name, frame, input_write, content_hash, _), output in zip(chunk, outputs):
+                output_filename, detected_classes, detected_details = output
+                # Запись в историю не должна ссылаться на несохранённый исходный файл
+                try:
+                    input_path = input_write.result()
+                except OSError as e:
+                    results[index] = {"source": sources[index][1],
+                                      "error": f"Не удалось сохранить исходное изображение: {str(e)}"}
+                    if output_filename:
+                        storage.remove_media(os.path.join('output_img', output_filename))
+                    continue
+                record = DetectionHistory(
+                    image_name=unique_name,
+                    shape=storage.image_shape(frame),
+                    classes_from_img=", ".join(set(detected_classes)) if detected_classes else "",
+                    path=os.path.join('output_img', output_filename) if output_filename else "",
+                    input_path=input_path,
+                    source_type=source_type,
+                    content_hash=content_hash
+                )
+                prepared.append((index, record, detected_classes, detected_details))
+
+        with metrics.stage("db_insert"):
+            records = persistence.save_history((item[1], item[3]) for item in prepared)
+
+        for (index, _, detected_classes, _), record in zip(prepared, records):
+            result_cache.put(record.content_hash, entry_from_record(record))
+            results[index] = {
+                "source": sources[index][1],
+                "input_image": media_url(request, record.input_path),
+                "output_image": output_image_url(request, record.id, record.path, record.input_path),
+                "db_record_id": record.id,
+                "found_classes": list(set(detected_classes)),
+                "cached": False,
+            }
+
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+@extend_schema_view(
+    post=extend_schema(
+        summary="Постановка видео в очередь на обработку (ссылка) с использованием yt-dlp",
         description=(
             "**POST /api/process-video/**\n\n"
             "Принимает JSON с полем `video_url` – ссылка на видео (например, с Rutube).\n"
-            "Использует yt-dlp для загрузки видео (так как Rutube-страница не предоставляет прямой файл),\n"
-            "затем обрабатывает всё видео кадр за кадром через YOLO, формируя аннотированный ролик.\n"
-            "Сохраняет запись в БД и возвращает JSON с обнаруженными объектами и URL аннотированного видео."
+            "Создаёт фоновую задачу и сразу возвращает её id. Задача в пуле воркеров загружает видео через yt-dlp\n"
+            "(так как Rutube-страница не предоставляет прямой файл), обрабатывает его кадр за кадром через YOLO,\n"
+            "формирует аннотированный ролик и сохраняет запись в БД.\n"
+            "Состояние задачи доступно по `GET /api/video-jobs/<job_id>/`, детекции по мере обработки – "
+            "потоком по `GET /api/video-jobs/<job_id>/events/`."
         ),
         request=inline_serializer(
             name="VideoJSONRequest",
             fields={
-                "video_url": serializers.URLField(required=True, help_text="Ссылка на видео (например, https://rutube.ru/video/...)")
+                "video_url": serializers.URLField(required=True, help_text="Ссылка на видео (например, https://rutube.ru/video/...)"),
+                "frame_stride": serializers.IntegerField(
+                    required=False, default=1, min_value=1,
+                    help_text="Полная детекция на каждом N-м кадре; на промежуточных кадрах боксы переносит трекер "
+                              "(у детекций появляются track_id и interpolated)"
+                ),
+                "adaptive_stride": serializers.BooleanField(
+                    required=False, default=False,
+                    help_text="Запускать детекцию раньше при смене сцены; frame_stride задаёт максимальный шаг"
+                ),
+                "model": serializers.CharField(required=False, help_text="Имя модели из YOLO_MODELS (по умолчанию YOLO_DEFAULT_MODEL)"),
+                "target_height": serializers.IntegerField(
+                    required=False, min_value=0,
+                    help_text="Загрузить самый маленький поток не ниже этой высоты, px; 0 – лучшее качество "
+                              "(по умолчанию VIDEO_DOWNLOAD_TARGET_HEIGHT). Прямые ссылки на файл скачиваются как есть"
+                ),
+                "decode_max_size": serializers.IntegerField(
+                    required=False, min_value=0,
+                    help_text="Уменьшать кадры после декодирования до этого размера по длинной стороне, px; "
+                              "0 – без изменения (по умолчанию VIDEO_DECODE_MAX_SIZE). Боксы – в координатах исходного видео"
+                ),
+                **INFERENCE_FIELDS,
             }
         ),
         responses={
-            200: inline_serializer(
-                name="VideoProcessSuccessResponse",
-                fields={
-                    "db_record_id": serializers.IntegerField(),
-                    "found_classes": serializers.ListField(child=serializers.CharField()),
-                    "detailed_results": serializers.JSONField(),
-                    "output_video_url": serializers.URLField(),
-                    "message": serializers.CharField(),
-                }
-            ),
+            202: VideoJobSerializer,
             400: inline_serializer(
                 name="VideoProcessErrorResponse",
                 fields={"error": serializers.CharField()},
@@ -192,7 +737,7 @@ class ProcessImageAPIView(APIView):
 )
 class ProcessVideoAPIView(APIView):
     """
-    Эндпоинт для обработки видео целиком.
+    Эндпоинт для постановки видео в очередь на обработку.
     """
     parser_classes = (JSONParser,)
 
@@ -202,69 +747,658 @@ class ProcessVideoAPIView(APIView):
             return Response({"error": "Не передано поле video_url."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        original_name = os.path.basename(urlparse(video_url).path)
-        if not original_name:
-            original_name = "video.mp4"
-        unique_name = generate_unique_filename(original_name)
+        try:
+            frame_stride = int(request.data.get('frame_stride', 1))
+        except (TypeError, ValueError):
+            return Response({"error": "frame_stride должен быть целым числом."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        max_stride = getattr(settings, 'VIDEO_MAX_FRAME_STRIDE', 30)
+        if not 1 <= frame_stride <= max_stride:
+            return Response({"error": f"frame_stride должен быть от 1 до {max_stride}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        adaptive_stride = str(request.data.get('adaptive_stride', False)).lower() in ('1', 'true', 'yes')
+        try:
+            model_name = yolo.resolve_model_name(request.data.get('model'))
+            target_height, decode_max_size = parse_video_sizes(request.data)
+            inference = parse_inference(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if inference["classes"]:
+            # Имена классов проверяются сразу, а не в конце загрузки видео
+            try:
+                yolo.download_model_if_not_exist(model_name)
+                yolo.class_ids(inference["classes"], model_name)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except Exception as e:
+                return Response({"error": f"Ошибка загрузки модели: {str(e)}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        job = VideoJob.objects.create(
+            video_url=video_url, frame_stride=frame_stride, adaptive_stride=adaptive_stride,
+            model_name=model_name, target_height=target_height, decode_max_size=decode_max_size,
+            inference=inference
+        )
+        jobs.submit_video_job(job.id)
+
+        data = VideoJobSerializer(job, context={'request': request}).data
+        data["status_url"] = request.build_absolute_uri(reverse('video_job_status', args=[job.id]))
+        data["events_url"] = request.build_absolute_uri(reverse('video_job_events', args=[job.id]))
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Состояние фоновой задачи по видео",
+        description=(
+            "**GET /api/video-jobs/<job_id>/**\n\n"
+            "Возвращает состояние задачи (`queued`, `running`, `done`, `failed`), число обработанных кадров "
+            "из общего числа, скорость обработки (кадров/с) и оценку оставшегося времени. "
+            "После завершения содержит id записи `DetectionHistory` и URL аннотированного видео."
+        ),
+        responses={200: VideoJobSerializer},
+    )
+)
+class VideoJobStatusAPIView(APIView):
+    """
+    Эндпоинт для опроса состояния задачи по видео.
+    """
+
+    def get(self, request, job_id, format=None):
+        job = get_object_or_404(VideoJob.objects.select_related('history'), pk=job_id)
+        return Response(VideoJobSerializer(job, context={'request': request}).data, status=status.HTTP_200_OK)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Отрисовка детекций записи истории",
+        description=(
+            "**GET /api/history/<record_id>/render/**\n\n"
+            "Возвращает JPEG: исходное изображение с боксами из сохранённых детекций. "
+            "Отрисовывается при первом обращении и кэшируется на диске (`RENDER_CACHE_MAX_BYTES`, "
+            "давно не запрошенные изображения вытесняются). Только для изображений, не для видео; "
+            "если исходный файл записи не сохранялся или удалён – 404."
+        ),
+        parameters=[
+            OpenApiParameter('max_size', OpenApiTypes.INT, description="Уменьшить до этого размера по длинной стороне, px"),
+            OpenApiParameter('classes', OpenApiTypes.STR, description="Только эти классы (через запятую)"),
+            OpenApiParameter('conf', OpenApiTypes.FLOAT, description="Минимальная уверенность"),
+        ],
+        responses={
+            (200, 'image/jpeg'): OpenApiTypes.BINARY,
+            400: inline_serializer(
+                name="RenderErrorResponse",
+                fields={"error": serializers.CharField()},
+            ),
+        },
+    )
+)
+class HistoryRenderAPIView(APIView):
+    """
+    Эндпоинт отрисовки аннотированного изображения по сохранённым детекциям.
+    """
+
+    def get(self, request, record_id, format=None):
+        record = get_object_or_404(DetectionHistory.objects.defer('detailed_results'), pk=record_id)
+        if record.source_type == "video":
+            return Response({"error": "Отрисовка доступна только для изображений."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        # Используем yt-dlp для загрузки видео
+        params = request.query_params
         try:
-            import yt_dlp
-        except ImportError:
-            return Response({"error": "Библиотека yt-dlp не установлена. Установите её: pip install yt-dlp."},
+            max_size = int(params.get('max_size') or 0)
+            conf = float(params.get('conf') or 0.0)
+        except ValueError:
+            return Response({"error": "max_size должен быть целым числом, conf – числом."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if max_size < 0 or max_size > getattr(settings, 'RENDER_MAX_SIZE', 4096):
+            return Response({"error": f"max_size должен быть от 0 до {getattr(settings, 'RENDER_MAX_SIZE', 4096)}."},
                             status=status.HTTP_400_BAD_REQUEST)
+        classes = [c.strip() for c in params.get('classes', '').split(',') if c.strip()]
 
-        input_video_path = os.path.join(settings.MEDIA_ROOT, 'input_video', unique_name)
-        ydl_opts = {
-            'outtmpl': input_video_path,
-            'format': 'bestvideo+bestaudio/best',
-            'quiet': True,
-        }
+        # Исходный файл не сохранялся (INPUT_PERSIST_ENABLED = False) или удалён (compact_media)
+        if not record.input_path or not os.path.exists(os.path.join(settings.MEDIA_ROOT, record.input_path)):
+            return Response({"error": "Исходное изображение записи недоступно."}, status=status.HTTP_404_NOT_FOUND)
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([video_url])
-        except Exception as e:
-            return Response({"error": f"Ошибка при загрузке видео через yt-dlp: {str(e)}"},
+            path = render_record(record, max_size=max_size, classes=classes, conf=conf)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+        # Детекции записи не меняются, поэтому результат можно кэшировать и на клиенте
+        response['Cache-Control'] = 'public, max-age=86400'
+        return response
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Детекции записи истории (JSON или .npz)",
+        description=(
+            "**GET /api/history/<record_id>/detections/**\n\n"
+            "Детекции видео хранятся колонками (frame, class_id, confidence, xyxy, track_id, interpolated) "
+            "в файле `.npz` рядом с выходным видео. `output=npz` отдаёт этот файл как есть "
+            "(`numpy.load`; имена классов – JSON в массиве `names`), `output=json` (по умолчанию) – "
+            "список детекций в формате `detailed_results`, при необходимости только кадров "
+            "`from_frame <= frame < to_frame` (отрицательные границы и `to_frame < from_frame` – ответ 400). "
+            "Для изображений доступен только JSON."
+        ),
+        parameters=[
+            OpenApiParameter('output', OpenApiTypes.STR, enum=["json", "npz"], description="Формат ответа"),
+            OpenApiParameter('from_frame', OpenApiTypes.INT, description="Первый кадр (для JSON)"),
+            OpenApiParameter('to_frame', OpenApiTypes.INT, description="Кадр, до которого (не включая) отдавать детекции"),
+        ],
+        responses={
+            200: inline_serializer(
+                name="HistoryDetectionsResponse",
+                fields={
+                    "db_record_id": serializers.IntegerField(),
+                    "count": serializers.IntegerField(),
+                    "detections": serializers.ListField(child=serializers.DictField()),
+                },
+            ),
+            (200, 'application/octet-stream'): OpenApiTypes.BINARY,
+            400: inline_serializer(
+                name="HistoryDetectionsErrorResponse",
+                fields={"error": serializers.CharField()},
+            ),
+        },
+    )
+)
+class HistoryDetectionsAPIView(APIView):
+    """
+    Эндпоинт выгрузки детекций записи истории.
+    """
+
+    def get(self, request, record_id, format=None):
+        record = get_object_or_404(DetectionHistory.objects.defer('detailed_results'), pk=record_id)
+        params = request.query_params
+        output = params.get('output', 'json')
+        if output not in ('json', 'npz'):
+            return Response({"error": "output должен быть json или npz."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            from_frame = int(params['from_frame']) if params.get('from_frame') else None
+            to_frame = int(params['to_frame']) if params.get('to_frame') else None
+        except ValueError:
+            return Response({"error": "from_frame и to_frame должны быть целыми числами."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if (from_frame is not None and from_frame < 0) or (to_frame is not None and to_frame < 0):
+            return Response({"error": "from_frame и to_frame не могут быть отрицательными."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if from_frame is not None and to_frame is not None and to_frame < from_frame:
+            return Response({"error": "to_frame не может быть меньше from_frame."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        if not os.path.exists(input_video_path):
-            return Response({"error": "Видео не было успешно загружено."},
+        path = None
+        if record.source_type == "video" and record.path:
+            path = columns_path(os.path.join(settings.MEDIA_ROOT, record.path))
+            if not os.path.exists(path):
+                path = None
+
+        if output == 'npz':
+            if path is None:
+                return Response({"error": "Файл детекций .npz есть только у обработанных видео."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path),
+                                content_type='application/octet-stream')
+
+        if path is not None:
+            detections = DetectionColumns.load(path).to_details(from_frame, to_frame)
+        else:
+            detections = [
+                detail for detail in record.get_detailed_results()
+                if (from_frame is None or (detail.get("frame") or 0) >= from_frame)
+                and (to_frame is None or (detail.get("frame") or 0) < to_frame)
+            ]
+        return Response({"db_record_id": record.id, "count": len(detections), "detections": detections},
+                        status=status.HTTP_200_OK)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Поток детекций задачи по видео (NDJSON / SSE)",
+        description=(
+            "**GET /api/video-jobs/<job_id>/events/**\n\n"
+            "Отдаёт детекции кадр за кадром, пока видео обрабатывается, не дожидаясь конца задачи. "
+            "Формат выбирается заголовком `Accept` или параметром `format`: `application/x-ndjson` "
+            "(`format=ndjson`, по умолчанию) или `text/event-stream` (`format=sse`).\n\n"
+            "События: `frame` (`frame`, `detections`) – для каждого кадра по порядку; `progress` – при изменении "
+            "прогресса; последним приходит `done` или `failed`. Для SSE id события – номер кадра: "
+            "при переподключении с `Last-Event-ID` поток продолжается со следующего кадра.\n\n"
+            "Поток открыт не дольше `VIDEO_STREAM_MAX_SECONDS`: тогда последним приходит `timeout` с `next_frame`, "
+            "и клиент переподключается с `from_frame=next_frame`. Одновременных потоков в процессе – "
+            "не больше `VIDEO_STREAM_MAX_CONCURRENT`, сверх – ответ 429. Каждый поток занимает поток сервера "
+            "на всё время задачи: нужен ASGI-сервер или WSGI-сервер с потоками (gunicorn --threads)."
+        ),
+        parameters=[
+            OpenApiParameter('from_frame', OpenApiTypes.INT, description="Начать с кадра (по умолчанию 0)"),
+        ],
+        responses={
+            (200, 'application/x-ndjson'): OpenApiTypes.STR,
+            (200, 'text/event-stream'): OpenApiTypes.STR,
+        },
+    )
+)
+class VideoJobEventsAPIView(APIView):
+    """
+    Эндпоинт потоковой выдачи детекций задачи по видео.
+    """
+    renderer_classes = (NDJSONRenderer, EventStreamRenderer)
+
+    def get(self, request, job_id, format=None):
+        get_object_or_404(VideoJob, pk=job_id)
+        sse = request.accepted_renderer.format == 'sse'
+
+        from_frame = request.query_params.get('from_frame')
+        if from_frame is None and sse and request.headers.get('Last-Event-ID'):
+            from_frame = request.headers['Last-Event-ID']
+            from_frame = int(from_frame) + 1 if from_frame.isdigit() else 0
+        try:
+            from_frame = int(from_frame or 0)
+        except ValueError:
+            return Response({"error": "from_frame должен быть целым числом."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Инициализируем модель, если ещё не инициализирована
+        return open_event_stream(request, lambda: iter_job_events(job_id, from_frame))
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Статистика кэша результатов",
+        description=(
+            "**GET /api/cache-stats/**\n\n"
+            "Число попаданий (в памяти и в БД) и промахов кэша результатов по хэшу содержимого, "
+            "а также заполненность LRU-кэша в памяти процесса и дискового кэша отрисовки (`render`)."
+        ),
+        responses={
+            200: inline_serializer(
+                name="CacheStatsResponse",
+                fields={
+                    "hits": serializers.IntegerField(),
+                    "memory_hits": serializers.IntegerField(),
+                    "db_hits": serializers.IntegerField(),
+                    "misses": serializers.IntegerField(),
+                    "hit_ratio": serializers.FloatField(),
+                    "entries": serializers.IntegerField(),
+                    "bytes": serializers.IntegerField(),
+                    "max_bytes": serializers.IntegerField(),
+                    "render": serializers.DictField(help_text="Дисковый кэш отрисованных изображений"),
+                }
+            ),
+        },
+    )
+)
+class CacheStatsAPIView(APIView):
+    """
+    Эндпоинт статистики кэша результатов.
+    """
+
+    def get(self, request, format=None):
+        data = result_cache.stats()
+        data["render"] = render_cache.stats()
+        return Response(data, status=status.HTTP_200_OK)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Реестр моделей",
+        description=(
+            "**GET /api/models/**\n\n"
+            "Список моделей, доступных для выбора параметром `model`, и сведения о загруженных моделях: "
+            "время загрузки и прогрева, прирост RSS процесса при загрузке, размер весов, число обращений. "
+            "Модели сверх бюджета `YOLO_MODEL_MEMORY_BUDGET_MB` выгружаются по LRU. "
+            "При `YOLO_WORKER_POOL_ENABLED` в `worker_pools` – процессы инференса каждой модели."
+        ),
+        responses={
+            200: inline_serializer(
+                name="ModelsResponse",
+                fields={
+                    "default": serializers.CharField(),
+                    "available": serializers.ListField(child=serializers.CharField()),
+                    "models": serializers.ListField(child=serializers.DictField()),
+                    "memory_bytes": serializers.IntegerField(),
+                    "memory_budget_bytes": serializers.IntegerField(),
+                    "evictions": serializers.IntegerField(),
+                    "worker_pools": serializers.ListField(child=serializers.DictField()),
+                }
+            ),
+        },
+    )
+)
+class ModelRegistryAPIView(APIView):
+    """
+    Эндпоинт со сведениями о загруженных моделях.
+    """
+
+    def get(self, request, format=None):
+        data = {
+            "default": yolo.MODEL_NAME,
+            "available": getattr(settings, 'YOLO_MODELS', [yolo.MODEL_NAME]),
+        }
+        data.update(registry.stats())
+        data["worker_pools"] = [pool.stats() for pool in list(workers.pools.values())]
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class HistoryCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация истории от новых к старым (ORDER BY datetime_input DESC, id DESC).
+    Курсор DRF хранит только datetime_input последней записи и смещение среди записей
+    с тем же datetime_input: страница выбирается условием datetime_input < курсора по индексу,
+    а OFFSET применяется лишь к совпадающим моментам (при auto_now_add с микросекундами их почти нет),
+    поэтому время ответа не растёт с глубиной листания. id в ordering только упорядочивает такие совпадения.
+    """
+    ordering = ('-datetime_input', '-id')
+    page_size = getattr(settings, 'HISTORY_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'HISTORY_MAX_PAGE_SIZE', 500)
+
+
+def parse_history_bound(value, name):
+    """
+    Граница диапазона дат из query-параметра: ISO-дата (YYYY-MM-DD) или дата-время.
+    Возвращает (момент, только_дата); при ошибке бросает ValueError с текстом для клиента.
+    """
+    # Сначала дата: parse_datetime (datetime.fromisoformat) принимает и "YYYY-MM-DD" как полночь,
+    # и тогда date_to без времени не включал бы свой день
+    try:
+        day = parse_date(value)
+        moment = parse_datetime(value) if day is None else None
+    except ValueError:
+        moment = day = None
+    if moment is None and day is None:
+        raise ValueError(f"{name} должен быть датой (YYYY-MM-DD) или датой-временем в формате ISO 8601.")
+    if day is not None:
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment, day is not None
+
+
+def filter_history(queryset, params):
+    """
+    Применяет к queryset DetectionHistory фильтры из query-параметров:
+    class (и min_confidence), source_type, date_from, date_to. Бросает ValueError.
+    """
+    class_name = params.get('class')
+    min_confidence = params.get('min_confidence')
+    if min_confidence is not None and not class_name:
+        raise ValueError("min_confidence используется только вместе с class.")
+    if class_name:
+        detections = Detection.objects.filter(history=OuterRef('pk'), class_name=class_name)
+        if min_confidence is not None:
+            try:
+                detections = detections.filter(confidence__gte=float(min_confidence))
+            except ValueError:
+                raise ValueError("min_confidence должен быть числом.")
+        queryset = queryset.filter(Exists(detections))
+
+    source_type = params.get('source_type')
+    if source_type:
+        queryset = queryset.filter(source_type=source_type)
+
+    if params.get('date_from'):
+        moment, _ = parse_history_bound(params['date_from'], 'date_from')
+        queryset = queryset.filter(datetime_input__gte=moment)
+    if params.get('date_to'):
+        moment, date_only = parse_history_bound(params['date_to'], 'date_to')
+        if date_only:
+            # Дата без времени включается целиком: до начала следующего дня
+            queryset = queryset.filter(datetime_input__lt=moment + datetime.timedelta(days=1))
+        else:
+            queryset = queryset.filter(datetime_input__lte=moment)
+    return queryset
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="История обработок",
+        description=(
+            "**GET /api/history/**\n\n"
+            "Записи `DetectionHistory` от новых к старым с курсорной пагинацией: "
+            "следующая страница – по ссылке `next`. По умолчанию записи возвращаются без детекций; "
+            "`include_details=true` добавляет поле `detailed_results`."
+        ),
+        parameters=[
+            OpenApiParameter('class', OpenApiTypes.STR, description="Только записи, где найден этот класс"),
+            OpenApiParameter('min_confidence', OpenApiTypes.FLOAT, description="Минимальная уверенность для class"),
+            OpenApiParameter('source_type', OpenApiTypes.STR, description="Источник: url, file или video"),
+            OpenApiParameter('date_from', OpenApiTypes.STR, description="С даты (YYYY-MM-DD или ISO 8601)"),
+            OpenApiParameter('date_to', OpenApiTypes.STR, description="По дату включительно (YYYY-MM-DD или ISO 8601)"),
+            OpenApiParameter('include_details', OpenApiTypes.BOOL, description="Добавить detailed_results"),
+            OpenApiParameter('page_size', OpenApiTypes.INT, description="Размер страницы"),
+            OpenApiParameter('cursor', OpenApiTypes.STR, description="Курсор из ссылки next/previous"),
+        ],
+        responses={
+            200: inline_serializer(
+                name="HistoryPageResponse",
+                fields={
+                    "next": serializers.URLField(allow_null=True),
+                    "previous": serializers.URLField(allow_null=True),
+                    "results": DetectionHistorySerializer(many=True),
+                }
+            ),
+            400: inline_serializer(
+                name="HistoryErrorResponse",
+                fields={"error": serializers.CharField()},
+            ),
+        },
+    )
+)
+class HistoryListAPIView(APIView):
+    """
+    Эндпоинт для чтения истории обработок.
+    """
+
+    def get(self, request, format=None):
         try:
-            yolo.download_model_if_not_exist()
-        except Exception as e:
-            return Response({"error": f"Ошибка загрузки модели: {str(e)}"},
+            queryset = filter_history(DetectionHistory.objects.all(), request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        include_details = str(request.query_params.get('include_details', '')).lower() in ('1', 'true', 'yes')
+        if include_details:
+            queryset = queryset.prefetch_related('detections')
+            serializer_class = DetectionHistorySerializer
+        else:
+            # Большая JSON-колонка (устаревшая) не читается из БД вовсе
+            queryset = queryset.defer('detailed_results')
+            serializer_class = DetectionHistoryListSerializer
+
+        paginator = HistoryCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        data = serializer_class(page, many=True, context={'request': request}).data
+        return paginator.get_paginated_response(data)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Запись истории",
+        description=(
+            "**GET /api/history/<record_id>/**\n\n"
+            "Запись `DetectionHistory` вместе с детекциями (`detailed_results`)."
+        ),
+        responses={200: DetectionHistorySerializer},
+    )
+)
+class HistoryDetailAPIView(APIView):
+    """
+    Эндпоинт для чтения одной записи истории.
+    """
+
+    def get(self, request, record_id, format=None):
+        record = get_object_or_404(DetectionHistory.objects.prefetch_related('detections'), pk=record_id)
+        return Response(DetectionHistorySerializer(record, context={'request': request}).data, status=status.HTTP_200_OK)
+
+
+def get_live_session(stream_id):
+    session = live.sessions.get(stream_id)
+    if session is None:
+        raise Http404("Живой поток не найден.")
+    return session
+
+
+LIVE_STATS_FIELDS = {
+    "stream_id": serializers.CharField(),
+    "source": serializers.CharField(),
+    "status": serializers.CharField(help_text="starting, running, ended, stopped, failed"),
+    "error": serializers.CharField(),
+    "started_at": serializers.DateTimeField(),
+    "source_fps": serializers.FloatField(),
+    "fps": serializers.FloatField(help_text="Обработано кадров в секунду (по последним 100 кадрам)"),
+    "frames_captured": serializers.IntegerField(),
+    "frames_processed": serializers.IntegerField(),
+    "frames_dropped": serializers.IntegerField(help_text="Кадры, заменённые более новыми до обработки"),
+    "drop_rate": serializers.FloatField(),
+    "latency_ms": serializers.DictField(help_text="p50, p95, max задержки glass-to-result по последним 100 кадрам"),
+    "segments": serializers.ListField(child=serializers.CharField(), help_text="Готовые отрезки в MEDIA"),
+}
+
+
+@extend_schema_view(
+    post=extend_schema(
+        summary="Запуск детекции на живом потоке (RTSP/HTTP)",
+        description=(
+            "**POST /api/live-streams/**\n\n"
+            "Принимает JSON с полем `source_url` – адрес потока (схемы из `LIVE_ALLOWED_SCHEMES`).\n"
+            "Детекция всегда идёт на самом свежем кадре: если модель не успевает, устаревшие кадры отбрасываются, "
+            "и задержка не копится. Детекции публикуются по мере обработки "
+            "(`GET /api/live-streams/<stream_id>/events/`), при `segment_seconds` > 0 аннотированное видео пишется "
+            "скользящими отрезками в MEDIA/live/<stream_id>/ (хранятся `LIVE_KEEP_SEGMENTS` последних).\n"
+            "Состояние, скорость, доля отброшенных кадров и задержка – `GET /api/live-streams/<stream_id>/`, "
+            "остановка – `DELETE` того же адреса. Потоки живут в памяти процесса сервера."
+        ),
+        request=inline_serializer(
+            name="LiveStreamRequest",
+            fields={
+                "source_url": serializers.CharField(help_text="Адрес потока, например rtsp://camera/stream"),
+                "model": serializers.CharField(required=False, help_text="Имя модели из YOLO_MODELS (по умолчанию YOLO_DEFAULT_MODEL)"),
+                "segment_seconds": serializers.FloatField(required=False, help_text="Длина отрезков аннотированного видео, сек (0 – не писать)"),
+                "decode_max_size": serializers.IntegerField(required=False, help_text="Уменьшать кадры до этого размера по длинной стороне, px (по умолчанию LIVE_DECODE_MAX_SIZE)"),
+                **INFERENCE_FIELDS,
+            },
+        ),
+        responses={
+            201: inline_serializer(name="LiveStreamCreatedResponse", fields={
+                **LIVE_STATS_FIELDS,
+                "status_url": serializers.URLField(),
+                "events_url": serializers.URLField(),
+            }),
+            400: inline_serializer(name="LiveStreamErrorResponse", fields={"error": serializers.CharField()}),
+        },
+    )
+)
+class LiveStreamsAPIView(APIView):
+    """
+    Эндпоинт запуска живого потока.
+    """
+    parser_classes = (JSONParser,)
+
+    def post(self, request, format=None):
+        source_url = request.data.get('source_url')
+        if not source_url:
+            return Response({"error": "Не передано поле source_url."}, status=status.HTTP_400_BAD_REQUEST)
+        allowed = getattr(settings, 'LIVE_ALLOWED_SCHEMES', ("rtsp", "rtsps", "rtmp", "http", "https", "srt"))
+        if urlparse(source_url).scheme.lower() not in allowed:
+            return Response({"error": f"Поддерживаются только адреса со схемами: {', '.join(allowed)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            model_name = yolo.resolve_model_name(request.data.get('model'))
+            inference = parse_inference(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            segment_seconds = float(request.data.get('segment_seconds') or 0)
+        except (TypeError, ValueError):
+            return Response({"error": "segment_seconds должен быть числом."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            decode_max_size = int(request.data.get('decode_max_size', getattr(settings, 'LIVE_DECODE_MAX_SIZE', 1280)))
+        except (TypeError, ValueError):
+            return Response({"error": "decode_max_size должен быть целым числом."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        max_segment = getattr(settings, 'LIVE_MAX_SEGMENT_SECONDS', 300)
+        if not 0 <= segment_seconds <= max_segment:
+            return Response({"error": f"segment_seconds должен быть от 0 до {max_segment}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if decode_max_size < 0:
+            return Response({"error": "decode_max_size не может быть отрицательным."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Обрабатываем всё видео кадр за кадром
         try:
-            output_filename, detected_classes, detected_details = yolo.process_video_yolo10m(input_video_path, unique_name)
+            yolo.download_model_if_not_exist(model_name)
         except Exception as e:
-            return Response({"error": f"Ошибка обработки видео: {str(e)}"},
-                            status=status.HTTP_400_BAD_REQUEST)
+            return Response({"error": f"Ошибка загрузки модели: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if inference["classes"]:
+            # Имена классов проверяются сразу, а не на первом кадре потока
+            try:
+                yolo.class_ids(inference["classes"], model_name)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            session = live.start_session(source_url, model_name=model_name, segment_seconds=segment_seconds,
+                                         max_size=decode_max_size, inference=inference)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        classes_str = ", ".join(set(detected_classes)) if detected_classes else ""
-        detailed_results_json = json.dumps(detected_details, ensure_ascii=False)
-        output_path_relative = os.path.join('output_video', output_filename)
-
-        record = DetectionHistory.objects.create(
-            image_name=unique_name,
-            shape="video",
-            classes_from_img=classes_str,
-            detailed_results=detailed_results_json,
-            path=output_path_relative,
-            input_path=os.path.join('input_video', unique_name),
-            source_type="video"
-        )
+        data = session.stats()
+        data["status_url"] = request.build_absolute_uri(reverse('live_stream', args=[session.id]))
+        data["events_url"] = request.build_absolute_uri(reverse('live_stream_events', args=[session.id]))
+        return Response(data, status=status.HTTP_201_CREATED)
 
-        output_video_url = request.build_absolute_uri(os.path.join(settings.MEDIA_URL, 'output_video', output_filename))
 
-        return Response({
-            "db_record_id": record.id,
-            "found_classes": detected_classes,
-            "detailed_results": json.loads(detailed_results_json),
-            "output_video_url": output_video_url,
-            "message": "Видео успешно обработано кадр за кадром."
-        }, status=status.HTTP_200_OK)
+@extend_schema_view(
+    get=extend_schema(
+        summary="Состояние живого потока",
+        description=(
+            "**GET /api/live-streams/<stream_id>/**\n\n"
+            "Скорость обработки, число принятых, обработанных и отброшенных кадров, доля отброшенных, "
+            "задержка от появления кадра до публикации детекций (p50/p95/max) и готовые отрезки видео."
+        ),
+        responses={200: inline_serializer(name="LiveStreamStatsResponse", fields=LIVE_STATS_FIELDS)},
+    ),
+    delete=extend_schema(
+        summary="Остановка живого потока",
+        description="**DELETE /api/live-streams/<stream_id>/**\n\nОстанавливает поток и возвращает итоговое состояние.",
+        responses={200: inline_serializer(name="LiveStreamStoppedResponse", fields=LIVE_STATS_FIELDS)},
+    ),
+)
+class LiveStreamAPIView(APIView):
+    """
+    Эндпоинт состояния и остановки живого потока.
+    """
+
+    def get(self, request, stream_id, format=None):
+        return Response(get_live_session(stream_id).stats(), status=status.HTTP_200_OK)
+
+    def delete(self, request, stream_id, format=None):
+        session = get_live_session(stream_id)
+        session.stop()
+        return Response(session.stats(), status=status.HTTP_200_OK)
+
+
+@extend_schema_view(
+    get=extend_schema(
+        summary="Поток детекций живого потока (NDJSON / SSE)",
+        description=(
+            "**GET /api/live-streams/<stream_id>/events/**\n\n"
+            "События `frame` (`frame` – номер кадра в источнике, `latency_ms`, `detections`) – для каждого "
+            "обработанного кадра; номера идут с пропусками, если кадры отбрасывались. `segment` (`path`) – "
+            "закрыт очередной отрезок видео. Последним приходит `ended`, `stopped` или `failed`. "
+            "Медленный клиент получает только последние `LIVE_SUBSCRIBER_BUFFER` событий. "
+            "Формат и ограничения – как у `/api/video-jobs/<job_id>/events/`: не дольше `VIDEO_STREAM_MAX_SECONDS` "
+            "(затем событие `timeout`, поток продолжает работать – клиент переподключается) и не больше "
+            "`VIDEO_STREAM_MAX_CONCURRENT` потоков событий в процессе вместе с потоками задач, сверх – 429."
+        ),
+        responses={
+            (200, 'application/x-ndjson'): OpenApiTypes.STR,
+            (200, 'text/event-stream'): OpenApiTypes.STR,
+        },
+    )
+)
+class LiveStreamEventsAPIView(APIView):
+    """
+    Эндпоинт потоковой выдачи детекций живого потока.
+    """
+    renderer_classes = (NDJSONRenderer, EventStreamRenderer)
+
+    def get(self, request, stream_id, format=None):
+        session = get_live_session(stream_id)
+        return open_event_stream(request, lambda: live.iter_events(session))
@@ -0,0 +1,413 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+from django.conf import settings
+from ultralytics.engine.results import Results
+
+logger = logging.getLogger(__name__)
+
+# Кадры в разделяемой памяти выравниваются по 64 байта
+_ALIGN = 64
+
+
+class WorkerError(Exception):
+    """
+    Процесс инференса недоступен: не запустился, упал, завис или занят дольше таймаута.
+    """
+
+
+def worker_pool_enabled():
+    return getattr(settings, 'YOLO_WORKER_POOL_ENABLED', False)
+
+
+def available_cpus():
+    """
+    Ядра, на которых разрешено работать процессу.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(workers=0, threads=0, cpus=None):
+    """
+    Число процессов, потоков на процесс и ядра каждого процесса.
+    0 – автоматически: ядра делятся поровну (по умолчанию – процесс на ядро с одним потоком).
+    Ядра назначаются только если процессам хватает ядер без пересечений, иначе – None (без привязки).
+    """
+    cpus = list(cpus) if cpus is not None else available_cpus()
+    if not workers:
+        workers = max(1, len(cpus) // (threads or 1))
+    if not threads:
+        threads = max(1, len(cpus) // workers)
+    if workers * threads > len(cpus):
+        return workers, threads, [None] * workers
+    return workers, threads, [cpus[i * threads:(i + 1) * threads] for i in range(workers)]
+
+
+def _worker_main(conn, shm_name, loader_path, model_name, threads, cpus, warmup_size, loader_kwargs):
+    """
+    Точка входа процесса инференса: загружает модель один раз и обрабатывает сообщения
+    из conn до "stop" или закрытия канала:
+      - ("predict", layout, options) -> ("ok", [массив (N, 6) xyxy, conf, cls на кадр]) или ("error", текст);
+        layout – по кадру ("shm", offset, shape, dtype) (кадр в разделяемой памяти) или ("inline", кадр),
+        options – аргументы вызова модели (imgsz, conf, iou, classes, max_det);
+      - ("ping",) -> ("pong", pid).
+    """
+    # Останавливает процессы родитель; Ctrl+C в терминале не должен ронять их раньше
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+
+    import cv2
+    import django
+    from django.utils.module_loading import import_string
+
+    django.setup()
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        started = time.perf_counter()
+        model = import_string(loader_path)(model_name, threads=threads, **loader_kwargs)
+        load_time = time.perf_counter() - started
+        if warmup_size:
+            model(np.zeros((warmup_size, warmup_size, 3), dtype=np.uint8), verbose=False)
+    except Exception:
+        conn.send(("failed", traceback.format_exc()))
+        shm.close()
+        return
+    conn.send(("ready", {"pid": os.getpid(), "names": dict(model.names), "load_time_s": load_time}))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == "stop":
+            break
+        if message[0] == "ping":
+            conn.send(("pong", os.getpid()))
+            continue
+        frames = results = None
+        try:
+            frames = [
+                np.ndarray(item[2], dtype=item[3], buffer=shm.buf, offset=item[1]) if item[0] == "shm" else item[1]
+                for item in message[1]
+            ]
+            results = model(frames, verbose=False, **message[2])
+            conn.send(("ok", [
+                result.boxes.data.cpu().numpy()[:, :6] if result.boxes is not None else np.zeros((0, 6), np.float32)
+                for result in results
+            ]))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+        finally:
+            # Представления кадров ссылаются на разделяемую память и не должны её переживать
+            del frames, results
+    try:
+        shm.close()
+    except BufferError:
+        # Предиктор ultralytics может держать ссылку на последний батч; память освободит родитель
+        pass
+
+
+class _Worker:
+    def __init__(self, index, cpus, shm):
+        self.index = index
+        self.cpus = cpus
+        self.shm = shm
+        self.process = None
+        self.conn = None
+        self.state = "starting"
+        self.requests = 0
+        self.restarts = 0
+        self.load_time_s = 0.0
+
+    def info(self):
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process is not None else None,
+            "state": self.state,
+            "alive": self.process is not None and self.process.is_alive(),
+            "cpus": self.cpus,
+            "requests": self.requests,
+            "restarts": self.restarts,
+            "load_time_s": round(self.load_time_s, 3),
+        }
+
+
+class WorkerPool:
+    """
+    Пул процессов инференса одной модели.
+    Каждый процесс загружает модель один раз (loader – путь к функции loader(name, threads=...) -> модель,
+    см. engines.load_model), ограничен threads потоками intra-op и, если ядер хватает, привязан к своим ядрам:
+    параллельные запросы не делят одни и те же ядра между несколькими пулами потоков PyTorch.
+    Кадры передаются через блок разделяемой памяти процесса (shm_bytes) без сериализации,
+    по каналу идут только их размеры и смещения, обратно – массивы боксов.
+    Фоновый поток раз в health_interval секунд проверяет свободные процессы ping'ом
+    и перезапускает упавшие и зависшие; запрос, во время которого процесс упал, получает WorkerError.
+    """
+
+    def __init__(self, model_name, workers=0, threads=0, pin_cpus=True, shm_bytes=64 * 1024 * 1024,
+                 timeout=60.0, start_timeout=300.0, health_interval=5.0,
+                 loader="detection.engines.load_model", loader_kwargs=None, warmup_size=640):
+        self.model_name = model_name
+        self.size, self.threads, cpus = plan_workers(workers, threads)
+        if not pin_cpus:
+            cpus = [None] * self.size
+        self.shm_bytes = int(shm_bytes)
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.health_interval = health_interval
+        self.loader = loader
+        self.loader_kwargs = dict(loader_kwargs or {})
+        self.warmup_size = warmup_size
+        self.names = {}
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = [
+            _Worker(index, cpus[index], shared_memory.SharedMemory(create=True, size=self.shm_bytes))
+            for index in range(self.size)
+        ]
+        self._idle = queue.Queue()
+        self._stopped = threading.Event()
+        self._monitor = None
+
+    def start(self):
+        """
+        Запускает процессы и ждёт загрузки модели во всех. Бросает WorkerError, если модель не загрузилась.
+        """
+        for worker in self._workers:
+            self._spawn(worker)
+        for worker in self._workers:
+            self._wait_ready(worker)
+        for worker in self._workers:
+            self._set_idle(worker)
+        self._monitor = threading.Thread(target=self._watch, name=f"worker-pool-{self.model_name}", daemon=True)
+        self._monitor.start()
+        logger.info("Пул инференса %s: %d процесс(ов) по %d поток(а)", self.model_name, self.size, self.threads)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for worker in self._workers:
+            self._terminate(worker, graceful=True)
+            worker.shm.close()
+            worker.shm.unlink()
+
+    def predict(self, frames, options=None):
+        """
+        Прогоняет кадры BGR через модель в свободном процессе и возвращает список Results.
+        Кадры, не помещающиеся в разделяемую память вместе, уходят несколькими вызовами.
+        options – аргументы вызова модели (imgsz, conf, iou, classes, max_det).
+        """
+        frames = frames if isinstance(frames, list) else [frames]
+        results = []
+        for chunk in self._chunks(frames):
+            for frame, data in zip(chunk, self._run(chunk, options or {})):
+                results.append(Results(frame, path="", names=self.names, boxes=torch.from_numpy(data)))
+        return results
+
+    def qsize(self):
+        return sum(1 for worker in self._workers if worker.state == "busy")
+
+    def stats(self):
+        workers = [worker.info() for worker in self._workers]
+        return {
+            "model": self.model_name,
+            "size": self.size,
+            "threads_per_worker": self.threads,
+            "restarts": sum(worker["restarts"] for worker in workers),
+            "workers": workers,
+        }
+
+    def _chunks(self, frames):
+        chunk, used = [], 0
+        for frame in frames:
+            size = -(-frame.nbytes // _ALIGN) * _ALIGN
+            if chunk and used + size > self.shm_bytes:
+                yield chunk
+                chunk, used = [], 0
+            chunk.append(frame)
+            used += size
+        if chunk:
+            yield chunk
+
+    def _run(self, frames, options):
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise WorkerError(f"Нет свободного процесса инференса модели {self.model_name}.")
+        worker.state = "busy"
+        sent = replied = False
+        try:
+            layout, offset = [], 0
+            for frame in frames:
+                if frame.nbytes > self.shm_bytes:
+                    # Кадр больше блока разделяемой памяти – передаётся через канал
+                    layout.append(("inline", np.ascontiguousarray(frame)))
+                    continue
+                np.ndarray(frame.shape, dtype=frame.dtype, buffer=worker.shm.buf, offset=offset)[...] = frame
+                layout.append(("shm", offset, frame.shape, frame.dtype.str))
+                offset += -(-frame.nbytes // _ALIGN) * _ALIGN
+            sent = True
+            worker.conn.send(("predict", layout, options))
+            if not worker.conn.poll(self.timeout):
+                raise WorkerError(f"Процесс инференса {worker.process.pid} не ответил за {self.timeout} с.")
+            kind, payload = worker.conn.recv()
+            replied = True
+        except (EOFError, OSError) as e:
+            raise WorkerError(f"Процесс инференса модели {self.model_name} завершился аварийно.") from e
+        finally:
+            worker.requests += 1
+            if replied or not sent:
+                self._set_idle(worker)
+            else:
+                # Упавший или зависший процесс перезапустит фоновый поток
+                worker.state = "broken"
+        if kind != "ok":
+            raise Exception(f"Ошибка инференса: {payload}")
+        return payload
+
+    def _set_idle(self, worker):
+        worker.state = "idle"
+        self._idle.put(worker)
+
+    def _spawn(self, worker):
+        parent_conn, child_conn = self._context.Pipe()
+        worker.conn = parent_conn
+        worker.state = "starting"
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, worker.shm.name, self.loader, self.model_name, self.threads, worker.cpus,
+                  self.warmup_size, self.loader_kwargs),
+            name=f"yolo-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+
+    def _wait_ready(self, worker):
+        try:
+            ready = worker.conn.poll(self.start_timeout)
+            kind, payload = worker.conn.recv() if ready else ("failed", f"таймаут {self.start_timeout} с")
+        except (EOFError, OSError):
+            kind, payload = "failed", f"процесс завершился с кодом {worker.process.exitcode}"
+        if kind != "ready":
+            worker.state = "broken"
+            raise WorkerError(f"Не удалось запустить процесс инференса модели {self.model_name}: {payload}")
+        self.names = payload["names"]
+        worker.load_time_s = payload["load_time_s"]
+
+    def _terminate(self, worker, graceful=False):
+        if worker.process is None:
+            return
+        if graceful and worker.process.is_alive():
+            try:
+                worker.conn.send(("stop",))
+            except OSError:
+                pass
+            worker.process.join(timeout=5)
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+
+    def _restart(self, worker):
+        logger.warning("Перезапуск процесса инференса %s #%d (pid %s)",
+                       self.model_name, worker.index, worker.process.pid if worker.process else None)
+        self._terminate(worker)
+        worker.restarts += 1
+        self._spawn(worker)
+        try:
+            self._wait_ready(worker)
+        except WorkerError:
+            logger.exception("Процесс инференса %s #%d не перезапустился", self.model_name, worker.index)
+            return
+        self._set_idle(worker)
+
+    def _ping_idle(self):
+        """
+        Проверяет свободные процессы ping'ом; не ответившие помечаются сломанными.
+        """
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in idle:
+            try:
+                worker.conn.send(("ping",))
+                alive = worker.conn.poll(self.timeout) and worker.conn.recv()[0] == "pong"
+            except (EOFError, OSError):
+                alive = False
+            if alive:
+                self._idle.put(worker)
+            else:
+                worker.state = "broken"
+
+    def _watch(self):
+        while not self._stopped.wait(self.health_interval):
+            self._ping_idle()
+            for worker in self._workers:
+                if self._stopped.is_set():
+                    return
+                # Свободные процессы проверены ping'ом, занятые – сломаются на своём запросе
+                if worker.state == "broken":
+                    self._restart(worker)
+
+
+pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_worker_pool(model_name):
+    """
+    Пул процессов инференса модели (создаётся и запускается при первом обращении).
+    """
+    with _pools_lock:
+        pool = pools.get(model_name)
+        if pool is None:
+            pool = WorkerPool(
+                model_name,
+                workers=getattr(settings, 'YOLO_WORKER_POOL_SIZE', 0),
+                threads=getattr(settings, 'YOLO_WORKER_POOL_THREADS', 0),
+                pin_cpus=getattr(settings, 'YOLO_WORKER_POOL_PIN_CPUS', True),
+                shm_bytes=getattr(settings, 'YOLO_WORKER_POOL_SHM_MB', 64) * 1024 * 1024,
+                timeout=getattr(settings, 'YOLO_WORKER_POOL_TIMEOUT', 60.0),
+                start_timeout=getattr(settings, 'YOLO_WORKER_POOL_START_TIMEOUT', 300.0),
+                health_interval=getattr(settings, 'YOLO_WORKER_POOL_HEALTH_INTERVAL', 5.0),
+                loader=getattr(settings, 'YOLO_WORKER_POOL_LOADER', "detection.engines.load_model"),
+                warmup_size=getattr(settings, 'YOLO_WARMUP_IMAGE_SIZE', 640),
+            )
+            try:
+                pool.start()
+            except Exception:
+                pool.stop()
+                raise
+            pools[model_name] = pool
+    return pool
+
+
+@atexit.register
+def shutdown_pools():
+    """
+    Останавливает процессы и освобождает разделяемую память всех пулов.
+    """
+    with _pools_lock:
+        for pool in pools.values():
+            pool.stop()
+        pools.clear()
@@ -1,75 +1,520 @@
+import logging
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
 import cv2
+import numpy as np
 from django.conf import settings
-from PIL import Image
-from ultralytics import YOLO
 
-MODEL_NAME = "yolov10m.pt"
+from . import metrics, resolution, storage, workers
+from .columnar import DetectionColumns, FrameDetections, columns_path
+from .registry import registry
+from .render import draw_detections
+from .tiling import predict_tiled
+from .tracker import IoUTracker
+from .video_pipeline import StagedPipeline
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = getattr(settings, 'YOLO_DEFAULT_MODEL', "yolov10m.pt")
+# Модель по умолчанию; оставлено для совместимости, модели хранятся в registry
 model_instance = None
 
-def download_model_if_not_exist():
+def resolve_model_name(model_name=None):
+    """
+    Возвращает имя модели для запроса: MODEL_NAME, если не задано.
+    Бросает ValueError, если модели нет в YOLO_MODELS.
+    """
+    if not model_name:
+        return MODEL_NAME
+    allowed = getattr(settings, 'YOLO_MODELS', [MODEL_NAME])
+    if model_name not in allowed:
+        raise ValueError(f"Неизвестная модель {model_name}. Доступные модели: {', '.join(allowed)}.")
+    return model_name
+
+def _predict(source, model_name=None, options=None):
+    """
+    Прогоняет source (путь, кадр или список кадров) через модель под её блокировкой:
+    предиктор ultralytics не потокобезопасен, а к одной модели обращаются
+    планировщик изображений и фоновые задачи по видео.
+    options – аргументы вызова модели (imgsz, conf, iou, classes, max_det, см. resolve_inference);
+    без них действуют значения модели по умолчанию. Время прохода на кадр при известном imgsz
+    учитывается в resolution.latency_estimator (по нему imgsz="auto" укладывается в бюджет задержки).
+    При YOLO_WORKER_POOL_ENABLED кадры уходят в пул процессов инференса (workers.py).
+    """
+    options = options or {}
+    model_name = model_name or MODEL_NAME
+    frames_count = len(source) if isinstance(source, list) else 1
+    if workers.worker_pool_enabled():
+        frames = source if isinstance(source, list) else [source]
+        started = time.perf_counter()
+        results = workers.get_worker_pool(model_name).predict([_load_frame(f) for f in frames], options)
+        _observe_latency(model_name, options, started, frames_count)
+        return results
+    loaded = registry.get(model_name)
+    with loaded.lock:
+        started = time.perf_counter()
+        results = loaded.model(source, **options)
+        _observe_latency(model_name, options, started, frames_count)
+    return results
+
+def _observe_latency(model_name, options, started, frames_count):
+    if options.get("imgsz") and frames_count:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        resolution.latency_estimator.observe(model_name, options["imgsz"], elapsed_ms / frames_count)
+
+def _options_key(options):
+    """
+    Хэшируемый ключ аргументов вызова модели: в один батч планировщика попадают только кадры
+    с одинаковыми параметрами инференса.
+    """
+    return tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                        for name, value in (options or {}).items()))
+
+def download_model_if_not_exist(model_name=None):
     """
-    Инициализирует модель YOLO через ultralytics.
+    Инициализирует модель YOLO через ultralytics (через реестр моделей).
     Если веса не скачаны, они будут загружены автоматически.
     """
     global model_instance
-    if model_instance is None:
-        model_instance = YOLO(MODEL_NAME)
+    model_name = model_name or MODEL_NAME
+    if workers.worker_pool_enabled():
+        # Модель загружается в процессах пула, а не в этом процессе
+        workers.get_worker_pool(model_name)
+        return True
+    loaded = registry.get(model_name)
+    if model_name == MODEL_NAME:
+        model_instance = loaded.model
     return True
 
-def process_image_yolo10m(input_path, unique_name):
+def preload_models():
+    """
+    Загружает и прогревает модели из YOLO_PRELOAD_MODELS (вызывается при старте приложения).
+    """
+    names = getattr(settings, 'YOLO_PRELOAD_MODELS', [MODEL_NAME])
+    if not workers.worker_pool_enabled():
+        registry.preload(names)
+        return
+    for name in names:
+        try:
+            workers.get_worker_pool(name)
+        except Exception:
+            logger.exception("Не удалось запустить пул инференса модели %s", name)
+
+class InferenceScheduler:
+    """
+    Динамический микробатчинг для одновременных запросов.
+    Запросы складываются в очередь; фоновый поток забирает их пачкой, как только
+    набралось max_batch_size кадров или первый кадр в пачке прождал max_wait_ms,
+    делает один проход модели и отдаёт каждому вызывающему его собственный результат.
+    threads – число потоков, собирающих батчи независимо (по числу процессов в пуле инференса).
+    """
+    def __init__(self, model_name=None, max_batch_size=8, max_wait_ms=10, max_queue_size=64, threads=1):
+        self.model_name = model_name
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._threads = [None] * max(1, int(threads))
+        self._lock = threading.Lock()
+
+    def submit(self, frame, options=None):
+        """
+        Ставит кадр в очередь и возвращает Future с парой (result, info),
+        где info = {"batch_size": ..., "queue_wait_ms": ...}.
+        options – аргументы вызова модели (см. resolve_inference).
+        """
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((frame, future, time.monotonic(), options or {}))
+        except queue.Full:
+            raise Exception("Очередь инференса переполнена, повторите запрос позже.")
+        return future
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        with self._lock:
+            for index, thread in enumerate(self._threads):
+                if thread is None or not thread.is_alive():
+                    thread = self._threads[index] = threading.Thread(
+                        target=self._run, name=f"yolo-scheduler-{index}", daemon=True)
+                    thread.start()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Кадры с разными параметрами инференса (imgsz, фильтры) идут разными проходами модели
+            groups = {}
+            for item in self._collect_batch():
+                groups.setdefault(_options_key(item[3]), []).append(item)
+            for group in groups.values():
+                self._predict_group(group)
+
+    def _predict_group(self, group):
+        started = time.monotonic()
+        try:
+            results = _predict([frame for frame, _, _, _ in group], self.model_name, group[0][3])
+        except Exception as e:
+            for _, future, _, _ in group:
+                future.set_exception(e)
+            return
+        for (_, future, enqueued, _), result in zip(group, results):
+            future.set_result((result, {
+                "batch_size": len(group),
+                "queue_wait_ms": round((started - enqueued) * 1000, 2),
+            }))
+
+
+schedulers = {}
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(model_name=None):
+    """
+    Возвращает общий для процесса планировщик инференса модели (создаётся при первом обращении).
+    В один батч попадают только запросы к одной и той же модели.
+    """
+    model_name = model_name or MODEL_NAME
+    with _scheduler_lock:
+        scheduler = schedulers.get(model_name)
+        if scheduler is None:
+            scheduler = schedulers[model_name] = InferenceScheduler(
+                model_name=model_name,
+                max_batch_size=getattr(settings, 'YOLO_SCHEDULER_MAX_BATCH_SIZE', 8),
+                max_wait_ms=getattr(settings, 'YOLO_SCHEDULER_MAX_WAIT_MS', 10),
+                max_queue_size=getattr(settings, 'YOLO_SCHEDULER_MAX_QUEUE_SIZE', 64),
+                threads=workers.get_worker_pool(model_name).size if workers.worker_pool_enabled() else 1,
+            )
+    return scheduler
+
+def class_names(model_name=None):
+    """
+    Словарь {id: имя класса} модели.
+    """
+    if workers.worker_pool_enabled():
+        return workers.get_worker_pool(model_name or MODEL_NAME).names
+    return registry.get(model_name or MODEL_NAME).model.names
+
+def default_inference():
+    """
+    Параметры инференса по умолчанию: imgsz (размер входа модели или "auto", YOLO_IMGSZ),
+    conf (YOLO_CONF), iou (YOLO_IOU), classes (None – все классы), max_det (YOLO_MAX_DET)
+    и latency_budget_ms – бюджет времени прохода на кадр для imgsz="auto" (YOLO_LATENCY_BUDGET_MS, 0 – без бюджета).
+    """
+    return {
+        "imgsz": getattr(settings, 'YOLO_IMGSZ', resolution.DEFAULT_IMGSZ),
+        "conf": getattr(settings, 'YOLO_CONF', 0.25),
+        "iou": getattr(settings, 'YOLO_IOU', 0.7),
+        "classes": None,
+        "max_det": getattr(settings, 'YOLO_MAX_DET', 300),
+        "latency_budget_ms": getattr(settings, 'YOLO_LATENCY_BUDGET_MS', 0),
+    }
+
+def class_ids(classes, model_name=None):
+    """
+    id классов модели по именам. Бросает ValueError, если такого класса у модели нет.
+    """
+    ids = {name: idx for idx, name in class_names(model_name).items()}
+    unknown = [name for name in classes if name not in ids]
+    if unknown:
+        raise ValueError(f"Неизвестные классы: {', '.join(unknown)}.")
+    return sorted(ids[name] for name in classes)
+
+def resolve_inference(inference, width, height, model_name=None):
+    """
+    Аргументы вызова модели (imgsz, conf, iou, classes, max_det) для кадров размера width x height.
+    inference – словарь параметров (недостающие берутся из default_inference()).
+    imgsz="auto" выбирается по размеру кадра и бюджету задержки (resolution.auto_imgsz).
+    Имена классов переводятся в id модели: фильтр применяется в самой модели до NMS,
+    так что отброшенные классы не занимают места в max_det и не попадают в результат.
+    """
+    inference = {**default_inference(), **(inference or {})}
+    return {
+        "imgsz": _resolve_imgsz(inference, width, height, model_name),
+        "conf": float(inference["conf"]),
+        "iou": float(inference["iou"]),
+        "classes": class_ids(inference["classes"], model_name) if inference["classes"] else None,
+        "max_det": int(inference["max_det"]),
+    }
+
+def _resolve_imgsz(inference, width, height, model_name=None):
+    if inference["imgsz"] == "auto":
+        return resolution.auto_imgsz(width, height, model_name or MODEL_NAME, inference["latency_budget_ms"])
+    return int(inference["imgsz"])
+
+def _input_size(frame, tiling=None):
+    """
+    Размер (ширина, высота) изображения, подаваемого в модель: кадра или, при тайлинге, тайла.
+    """
+    height, width = frame.shape[:2]
+    if tiling:
+        width, height = min(width, tiling["tile_size"]), min(height, tiling["tile_size"])
+    return width, height
+
+def _frame_options(frame, inference, model_name, tiling=None):
+    """
+    Аргументы вызова модели для кадра; при тайлинге imgsz подбирается по размеру тайла.
+    """
+    return resolve_inference(inference, *_input_size(frame, tiling), model_name)
+
+def effective_imgsz(frame, inference=None, model_name=None, tiling=None):
+    """
+    Размер входа модели, с которым будет обработан кадр: imgsz="auto" разрешается по размеру кадра
+    (или тайла, в том числе при автоматическом тайлинге) и бюджету задержки.
+    Оценка задержки меняется от вызова к вызову, поэтому вызывающий, которому imgsz нужен заранее
+    (ключ кэша результатов), передаёт полученное значение дальше в inference.
+    """
+    inference = {**default_inference(), **(inference or {})}
+    return _resolve_imgsz(inference, *_input_size(frame, _tiling_for(frame, tiling)), model_name)
+
+def _extract_detections(result):
+    """
+    Извлекает из результата YOLO список классов и список словарей с деталями
+    (класс, уверенность, bounding box) для каждого найденного объекта.
+    Классы, уверенности и боксы переносятся с устройства массивами (FrameDetections.from_result),
+    а не бокс за боксом.
+    """
+    if result is None:
+        return [], []
+    with metrics.stage("extract"):
+        detected_details = FrameDetections.from_result(result).to_details(result.names)
+    return [detail["class"] for detail in detected_details], detected_details
+
+def _save_annotated_image(result, unique_name):
+    """
+    Сохраняет аннотированное изображение в MEDIA/output_img и возвращает имя файла:
+    unique_name с расширением формата OUTPUT_IMAGE_FORMAT (см. storage.encode_output).
+    """
+    with metrics.stage("annotate"):
+        annotated_image = result.plot()
+    with metrics.stage("encode"):
+        data, extension = storage.encode_output(annotated_image)
+    output_filename = os.path.splitext(unique_name)[0] + extension
+    storage.write_file(os.path.join(settings.MEDIA_ROOT, 'output_img', output_filename), data)
+    return output_filename
+
+def _load_frame(source):
+    """
+    Кадр BGR: source как есть, если это уже массив, иначе – прочитанный с диска файл.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+    frame = cv2.imread(source)
+    if frame is None:
+        raise Exception(f"Не удалось прочитать изображение {source}.")
+    return frame
+
+def default_tiling():
+    """
+    Параметры тайлового инференса по умолчанию (YOLO_TILE_*).
+    """
+    return {
+        "tile_size": getattr(settings, 'YOLO_TILE_SIZE', 1024),
+        "overlap": getattr(settings, 'YOLO_TILE_OVERLAP', 0.2),
+        "batch_size": getattr(settings, 'YOLO_TILE_BATCH_SIZE', 4),
+        "merge": getattr(settings, 'YOLO_TILE_MERGE', "nms"),
+    }
+
+def _tiling_for(frame, tiling):
+    """
+    Параметры тайлинга для кадра: заданные явно, а если не заданы – параметры по умолчанию
+    для изображений с длинной стороной от YOLO_TILE_AUTO_MIN_SIDE (0 – автоматически не включается).
+    """
+    if tiling:
+        return tiling
+    auto_min_side = getattr(settings, 'YOLO_TILE_AUTO_MIN_SIDE', 0)
+    if auto_min_side and max(frame.shape[:2]) >= auto_min_side:
+        return default_tiling()
+    return None
+
+def _predict_tiled(frame, model_name, tiling, options=None):
+    """
+    Тайловый инференс кадра (см. tiling.predict_tiled); tiling – словарь параметров
+    tile_size, overlap, batch_size, merge; options – аргументы вызова модели.
+    """
+    return predict_tiled(
+        frame, lambda tiles: _predict(tiles, model_name, options),
+        tile_size=tiling["tile_size"], overlap=tiling["overlap"], batch_size=tiling["batch_size"],
+        merge=tiling["merge"],
+        iou_threshold=getattr(settings, 'YOLO_TILE_MERGE_IOU', 0.5),
+        include_full=getattr(settings, 'YOLO_TILE_INCLUDE_FULL_IMAGE', True),
+    )
+
+def process_image_yolo10m(input_path, unique_name, stats=None, model_name=None, annotate=True, tiling=None,
+                          inference=None):
     """
     Обрабатывает одно изображение с помощью YOLO.
+    Если включён YOLO_SCHEDULER_ENABLED, изображение проходит через общий
+    планировщик и может попасть в один батч с параллельными запросами.
+    При annotate=False аннотированное изображение не рисуется и не сохраняется
+    (его можно отрисовать позже по сохранённым детекциям, см. render.py).
+    input_path – путь к файлу или уже декодированный кадр BGR (numpy), тогда файл не читается.
+    tiling (словарь tile_size, overlap, batch_size, merge) включает тайловый инференс
+    для больших изображений (без него – автоматически от YOLO_TILE_AUTO_MIN_SIDE);
+    планировщик в этом режиме не используется.
     Возвращает:
-      - output_filename,
+      - output_filename (None, если annotate=False),
       - detected_classes (список найденных классов),
       - detected_details (список словарей с информацией о каждом найденном объекте)
+    inference – параметры инференса imgsz, conf, iou, classes, max_det (см. resolve_inference).
+    В словарь stats (если передан) записываются batch_size, queue_wait_ms, imgsz (и сведения о тайлах).
+    model_name – имя модели из YOLO_MODELS (по умолчанию MODEL_NAME).
     """
-    global model_instance
-    if model_instance is None:
-        raise Exception("Модель не инициализирована. Сначала вызовите download_model_if_not_exist().")
-
-    results = model_instance(input_path)
-    detected_classes = []
-    detected_details = []
-
-    if results and results[0].boxes is not None:
-        for box in results[0].boxes:
-            class_idx = int(box.cls[0])
-            class_name = model_instance.names[class_idx]
-            confidence = float(box.conf[0]) if hasattr(box, 'conf') else None
-            bbox = box.xyxy[0].tolist() if hasattr(box, 'xyxy') else []
-            detected_classes.append(class_name)
-            detected_details.append({
-                "class": class_name,
-                "confidence": confidence,
-                "bbox": bbox
-            })
-
-    output_filename = unique_name
-    output_path = os.path.join(settings.MEDIA_ROOT, 'output_img', output_filename)
-    annotated_image = results[0].plot()
-    img = Image.fromarray(annotated_image)
-    img.save(output_path)
+    frame = _load_frame(input_path)
+    tiling = _tiling_for(frame, tiling)
+    options = _frame_options(frame, inference, model_name, tiling)
+    started = time.perf_counter()
+    if tiling:
+        result, info = _predict_tiled(frame, model_name, tiling, options)
+        info["queue_wait_ms"] = 0.0
+    elif getattr(settings, 'YOLO_SCHEDULER_ENABLED', True):
+        result, info = get_scheduler(model_name).submit(frame, options).result()
+    else:
+        results = _predict(frame, model_name, options)
+        result = results[0] if results else None
+        info = {"batch_size": 1, "queue_wait_ms": 0.0}
+    # Проход модели выполняется в потоке планировщика: время инференса – за вычетом ожидания в очереди
+    queue_wait = info["queue_wait_ms"] / 1000
+    metrics.observe_stage("queue_wait", queue_wait)
+    metrics.observe_stage("infer", max(0.0, time.perf_counter() - started - queue_wait))
+    if stats is not None:
+        stats.update(info)
+        stats["imgsz"] = options["imgsz"]
+
+    detected_classes, detected_details = _extract_detections(result)
+    output_filename = _save_annotated_image(result, unique_name) if annotate else None
 
     return output_filename, detected_classes, detected_details
 
-def process_video_yolo10m(input_video_path, unique_name):
+def process_images_yolo10m(items, max_batch_size=None, model_name=None, annotate=True, tiling=None,
+                           inference=None):
+    """
+    Обрабатывает несколько изображений батчами: вместо отдельного прохода модели
+    на каждый файл изображения группируются по max_batch_size и подаются
+    в модель одним списком.
+    items: список пар (input_path, unique_name) или троек (input_path, unique_name, inference изображения);
+    input_path – путь или кадр BGR (numpy).
+    Возвращает список кортежей (output_filename, detected_classes, detected_details)
+    в том же порядке, что и items; output_filename равен None при annotate=False.
+    При tiling каждое изображение обрабатывается тайлами (батчи составляются из его тайлов).
+    inference – параметры инференса (см. resolve_inference). imgsz="auto" разрешается для каждого
+    изображения отдельно, и в один проход модели попадают только изображения с одинаковыми
+    аргументами: результат изображения не зависит от того, с какими изображениями оно пришло.
+    """
+    if max_batch_size is None:
+        max_batch_size = getattr(settings, 'YOLO_MAX_BATCH_SIZE', 8)
+    max_batch_size = max(1, int(max_batch_size))
+
+    outputs = []
+    for start in range(0, len(items), max_batch_size):
+        chunk = items[start:start + max_batch_size]
+        # Для списка путей ultralytics читает файлы по одному (batch=1),
+        # а список массивов всегда идёт одним батчем.
+        frames = [_load_frame(item[0]) for item in chunk]
+
+        tilings = [_tiling_for(frame, tiling) for frame in frames]
+        options = [
+            _frame_options(frame, item[2] if len(item) > 2 else inference, model_name, frame_tiling)
+            for item, frame, frame_tiling in zip(chunk, frames, tilings)
+        ]
+        results = [None] * len(frames)
+        groups = {}
+        with metrics.stage("infer"):
+            for index, (frame, frame_tiling, frame_options) in enumerate(zip(frames, tilings, options)):
+                if frame_tiling:
+                    results[index] = _predict_tiled(frame, model_name, frame_tiling, frame_options)[0]
+                else:
+                    groups.setdefault(_options_key(frame_options), []).append(index)
+            for indexes in groups.values():
+                group_results = _predict([frames[index] for index in indexes], model_name, options[indexes[0]])
+                for index, result in zip(indexes, group_results):
+                    results[index] = result
+        for (_, unique_name, *_), result in zip(chunk, results):
+            detected_classes, detected_details = _extract_detections(result)
+            output_filename = _save_annotated_image(result, unique_name) if annotate else None
+            outputs.append((output_filename, detected_classes, detected_details))
+
+    return outputs
+
+def _read_frames(cap, start_frame=0, end_frame=None):
     """
-    Обрабатывает всё видео кадр за кадром:
-      - Считывает каждый кадр.
-      - Прогоняет YOLO, наносит bounding boxes.
-      - Записывает аннотированные кадры в выходной видеофайл (MP4).
-      - Собирает детальную информацию по каждому кадру.
+    Генератор кадров видео с их порядковыми номерами (нумерация от start_frame, до end_frame не включая).
+    """
+    frame_idx = start_frame
+    while end_frame is None or frame_idx < end_frame:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield frame_idx, frame
+        frame_idx += 1
+
+def _frame_signature(frame):
+    """
+    Уменьшенная серая копия кадра для оценки смены сцены.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (64, 36), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+def _downscaled_frames(frames, size):
+    """
+    Кадры (frame_idx, frame), уменьшенные до size = (ширина, высота) сразу после декодирования.
+    """
+    for frame_idx, frame in frames:
+        yield frame_idx, cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+def process_video_yolo10m(input_video_path, unique_name, progress_callback=None, stats=None,
+                          frame_stride=1, adaptive_stride=False, model_name=None, on_frame=None,
+                          decode_max_size=0, start_frame=0, end_frame=None, inference=None):
+    """
+    Обрабатывает всё видео кадр за кадром конвейером из четырёх стадий,
+    работающих параллельно и связанных ограниченными очередями:
+      - decode: считывает кадры (cv2.VideoCapture);
+      - infer: прогоняет YOLO батчами до VIDEO_INFERENCE_BATCH_SIZE кадров;
+      - annotate: наносит bounding boxes и собирает детальную информацию по кадру;
+      - encode: записывает аннотированные кадры в выходной видеофайл (MP4).
+    Порядок кадров сохраняется.
+    При frame_stride > 1 полная детекция выполняется только на каждом frame_stride-м кадре,
+    а на промежуточных кадрах боксы переносятся трекером (IoUTracker) и помечаются
+    interpolated=True; у каждой детекции в этом режиме есть track_id.
+    При adaptive_stride=True ключевой кадр назначается раньше, если сцена заметно
+    изменилась (VIDEO_ADAPTIVE_STRIDE_THRESHOLD); frame_stride тогда задаёт максимальный шаг.
+    При decode_max_size кадры больше этого размера по длинной стороне уменьшаются сразу после
+    декодирования: модель, отрисовка и выходное видео работают с уменьшенными кадрами,
+    а боксы детекций переводятся обратно в координаты исходного видео.
+    start_frame / end_frame ограничивают обработку отрезком кадров [start_frame, end_frame):
+    кадры нумеруются так же, как во всём видео (так обрабатываются сегменты, см. segments.py).
+    inference – параметры инференса (см. resolve_inference); imgsz="auto" подбирается по размеру
+    обработанных кадров один раз на всё видео.
+    Детекции извлекаются из результата модели массивами и копятся в колоночном виде (DetectionColumns);
+    по окончании они сохраняются рядом с выходным видео в MEDIA/output_video/<имя>.npz.
     Возвращает:
       - output_filename: имя выходного видеофайла,
       - unique_classes: список уникальных обнаруженных классов,
-      - all_detected_details: список словарей с данными для каждого обнаруженного объекта с указанием номера кадра.
+      - columns: DetectionColumns со всеми детекциями (словари – columns.to_details()).
+    progress_callback(frames_done, frames_total), если передан, вызывается после каждого записанного кадра
+    (frames_total = 0, если контейнер не сообщает число кадров).
+    on_frame(frame_idx, detections), если передан, получает FrameDetections каждого кадра по порядку
+    сразу после его записи.
+    В словарь stats (если передан) записываются время работы каждой стадии, число кадров, итоговый fps
+    размеры исходных и обработанных кадров и imgsz.
     """
-    global model_instance
-    if model_instance is None:
-        raise Exception("Модель не инициализирована. Сначала вызовите download_model_if_not_exist().")
-
     cap = cv2.VideoCapture(input_video_path)
     if not cap.isOpened():
         raise Exception("Не удалось открыть входное видео.")
@@ -77,42 +522,123 @@ def process_video_yolo10m(input_video_path, unique_name):
     fps = cap.get(cv2.CAP_PROP_FPS)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frames_total = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+    if end_frame is not None:
+        frames_total = min(frames_total, end_frame) if frames_total else end_frame
+    frames_total = max(0, frames_total - start_frame)
+    if start_frame:
+        # Позиционирование точное: FFmpeg переходит к ближайшему ключевому кадру и декодирует до нужного
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    frames = _read_frames(cap, start_frame, end_frame)
+    out_width, out_height = width, height
+    if decode_max_size and max(width, height) > decode_max_size:
+        scale = decode_max_size / max(width, height)
+        out_width, out_height = max(1, round(width * scale)), max(1, round(height * scale))
+        frames = _downscaled_frames(frames, (out_width, out_height))
+    # Перевод боксов из координат обработанного кадра в исходные
+    box_scale = (width / out_width, height / out_height) if (out_width, out_height) != (width, height) else None
 
     output_filename = unique_name  # используем то же имя
     output_path = os.path.join(settings.MEDIA_ROOT, 'output_video', output_filename)
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    out = cv2.VideoWriter(output_path, fourcc, fps, (out_width, out_height))
 
-    all_detected_classes = []
-    all_detected_details = []
-    frame_idx = 0
+    names = class_names(model_name)
+    class_ids = {name: idx for idx, name in names.items()}
+    columns = DetectionColumns(names)
+    options = resolve_inference(inference, out_width, out_height, model_name)
+    frames_done = 0
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    frame_stride = max(1, int(frame_stride))
+    tracker = IoUTracker() if frame_stride > 1 else None
+    scene_threshold = getattr(settings, 'VIDEO_ADAPTIVE_STRIDE_THRESHOLD', 12.0)
+    last_key = {"idx": None, "signature": None}
+    keyframes_done = 0
 
-        results = model_instance(frame)
-        annotated_frame = results[0].plot()
-        if results and results[0].boxes is not None:
-            for box in results[0].boxes:
-                class_idx = int(box.cls[0])
-                class_name = model_instance.names[class_idx]
-                confidence = float(box.conf[0]) if hasattr(box, 'conf') else None
-                bbox = box.xyxy[0].tolist() if hasattr(box, 'xyxy') else []
-                all_detected_classes.append(class_name)
-                all_detected_details.append({
-                    "frame": frame_idx,
-                    "class": class_name,
-                    "confidence": confidence,
-                    "bbox": bbox
-                })
-
-        out.write(annotated_frame)
-        frame_idx += 1
+    def is_keyframe(frame_idx, frame):
+        if tracker is None:
+            return True
+        if last_key["idx"] is None or frame_idx - last_key["idx"] >= frame_stride:
+            keyframe = True
+        elif adaptive_stride:
+            signature = _frame_signature(frame)
+            keyframe = float(np.mean(np.abs(signature - last_key["signature"]))) > scene_threshold
+        else:
+            keyframe = False
+        if keyframe:
+            last_key["idx"] = frame_idx
+            if adaptive_stride:
+                last_key["signature"] = _frame_signature(frame)
+        return keyframe
+
+    def infer(batch):
+        nonlocal keyframes_done
+        keys = [i for i, (frame_idx, frame) in enumerate(batch) if is_keyframe(frame_idx, frame)]
+        keyframes_done += len(keys)
+        results = _predict([batch[i][1] for i in keys], model_name, options) if keys else []
+        by_position = dict(zip(keys, results))
+        return [(frame_idx, frame, by_position.get(i)) for i, (frame_idx, frame) in enumerate(batch)]
+
+    def annotate(batch):
+        annotated = []
+        for frame_idx, frame, result in batch:
+            if tracker is None:
+                annotated.append((frame_idx, result.plot(), FrameDetections.from_result(result)))
+                continue
+
+            if result is not None:
+                _, detected_details = _extract_detections(result)
+                detected_details = tracker.update(frame_idx, detected_details)
+                interpolated = False
+            else:
+                detected_details = tracker.predict(frame_idx)
+                interpolated = True
+            annotated.append((
+                frame_idx,
+                draw_detections(frame, detected_details, names),
+                FrameDetections.from_details(detected_details, class_ids, interpolated),
+            ))
+        return annotated
+
+    def encode(batch):
+        nonlocal frames_done
+        for frame_idx, annotated_frame, detections in batch:
+            out.write(annotated_frame)
+            if box_scale is not None:
+                detections = detections.scaled(*box_scale)
+            columns.append(frame_idx, detections)
+            if on_frame is not None:
+                on_frame(frame_idx, detections)
+            frames_done += 1
+            if progress_callback is not None:
+                progress_callback(frames_done, frames_total)
+
+    pipeline = StagedPipeline(
+        source=("decode", frames),
+        stages=[
+            ("infer", infer, getattr(settings, 'VIDEO_INFERENCE_BATCH_SIZE', 4)),
+            ("annotate", annotate, 1),
+            ("encode", encode, 1),
+        ],
+        queue_size=getattr(settings, 'VIDEO_PIPELINE_QUEUE_SIZE', 8),
+    )
+    try:
+        timings = pipeline.run()
+    finally:
+        cap.release()
+        out.release()
+    columns.save(columns_path(output_path))
 
-    cap.release()
-    out.release()
+    if stats is not None:
+        stats["keyframes"] = keyframes_done
+        stats["source_size"] = f"{width}x{height}"
+        stats["processed_size"] = f"{out_width}x{out_height}"
+        stats["imgsz"] = options["imgsz"]
+        stats["stages"] = {name: stat for name, stat in timings.items() if isinstance(stat, dict)}
+        stats["frames"] = frames_done
+        stats["detections"] = len(columns)
+        stats["wall_s"] = timings["wall_s"]
+        stats["fps"] = round(frames_done / timings["wall_s"], 2) if timings["wall_s"] else 0.0
 
-    unique_classes = list(set(all_detected_classes))
-    return output_filename, unique_classes, all_detected_details
+    return output_filename, columns.classes(), columns
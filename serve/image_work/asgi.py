@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_work.settings')
+# Процесс обслуживает запросы: приложение detection загрузит модели при старте
+os.environ.setdefault('DETECTION_SERVING', '1')
 
 application = get_asgi_application()
+
+# Возобновляем фоновые задачи по видео, прерванные перезапуском сервера
+from detection.jobs import resume_pending_jobs  # noqa: E402
+
+resume_pending_jobs()
@@ -57,6 +57,8 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    # Первым: учитывает полное время запроса (detection_request_seconds, Server-Timing)
+    'detection.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,6 +96,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Постоянные соединения (сек) с проверкой перед повторным использованием:
+        # PRAGMA из init_command и открытие файла выполняются один раз на соединение, а не на запрос
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Сколько секунд ждать освобождения блокировки, прежде чем вернуть "database is locked"
+            'timeout': 20,
+            # Транзакции с записью сразу берут блокировку записи (BEGIN IMMEDIATE): без этого
+            # две транзакции, начавшие с чтения, не могут обе перейти к записи, и одна падает сразу, не дожидаясь timeout
+            'transaction_mode': 'IMMEDIATE',
+            # WAL: чтения не блокируют запись и наоборот; synchronous=NORMAL в режиме WAL не повреждает базу
+            # при сбое питания, но может потерять последние транзакции (fsync при checkpoint, а не на каждый commit)
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+        },
     }
 }
 
@@ -143,6 +159,240 @@ os.makedirs(os.path.join(MEDIA_ROOT, 'output_img'), exist_ok=True)
 os.makedirs(os.path.join(MEDIA_ROOT, 'input_video'), exist_ok=True)
 os.makedirs(os.path.join(MEDIA_ROOT, 'output_video'), exist_ok=True)
 
+# Модели YOLO
+# Модель по умолчанию и список моделей, которые можно выбрать параметром `model` в запросе
+YOLO_DEFAULT_MODEL = "yolov10m.pt"
+YOLO_MODELS = ["yolov10n.pt", "yolov10s.pt", "yolov10m.pt"]
+# Модели, которые загружаются и прогреваются при старте приложения
+# (только в процессах, обслуживающих запросы: wsgi.py/asgi.py или manage.py runserver)
+YOLO_PRELOAD_ON_START = True
+YOLO_PRELOAD_MODELS = ["yolov10m.pt"]
+# Размер пустого кадра для прогрева модели (0 – без прогрева)
+YOLO_WARMUP_IMAGE_SIZE = 640
+# Бюджет памяти под загруженные модели (МБ); при превышении выгружаются
+# давно не использовавшиеся модели. 0 – без ограничения
+YOLO_MODEL_MEMORY_BUDGET_MB = 1024
+
+# Движок инференса: "torch" (ultralytics/PyTorch), "onnx" (ONNX Runtime) или "openvino".
+# Для onnx/openvino веса экспортируются один раз и кэшируются в YOLO_EXPORT_DIR;
+# нужен установленный пакет onnxruntime или openvino соответственно
+YOLO_BACKEND = "torch"
+YOLO_EXPORT_DIR = os.path.join(BASE_DIR, 'model_cache')
+YOLO_EXPORT_IMGSZ = 640
+# Число потоков инференса на процесс (0 – все ядра)
+YOLO_INFERENCE_THREADS = 0
+
+# Параметры инференса по умолчанию (в запросе: imgsz, conf, iou, classes, max_det, latency_budget_ms).
+# YOLO_IMGSZ – размер входа модели (640 – как у ultralytics по умолчанию) или "auto": наименьший из YOLO_IMGSZ_CHOICES, не меньший длинной
+# стороны изображения, но не больше YOLO_IMGSZ_AUTO_MAX; при бюджете YOLO_LATENCY_BUDGET_MS (мс на кадр,
+# 0 – без бюджета) вход уменьшается, пока оценка времени прохода больше бюджета. Оценка – скользящее
+# среднее измеренных проходов (YOLO_LATENCY_EMA_ALPHA), до первых замеров – YOLO_LATENCY_PRIOR_MS
+# на кадр при imgsz=640 (0 – неизвестно, бюджет не применяется)
+YOLO_IMGSZ = 640
+YOLO_IMGSZ_CHOICES = [320, 416, 512, 640, 800, 960, 1280]
+YOLO_IMGSZ_AUTO_MAX = 640
+# Максимальный imgsz, который можно запросить явно
+YOLO_IMGSZ_MAX = 1280
+YOLO_LATENCY_BUDGET_MS = 0
+YOLO_LATENCY_PRIOR_MS = 0.0
+YOLO_LATENCY_EMA_ALPHA = 0.2
+YOLO_CONF = 0.25
+YOLO_IOU = 0.7
+YOLO_MAX_DET = 300
+# Максимальный max_det в запросе
+YOLO_MAX_DET_LIMIT = 1000
+
+# Пакетная обработка изображений (/api/process-images/)
+# Максимальное число изображений в одном проходе модели
+YOLO_MAX_BATCH_SIZE = 8
+# Максимальное число изображений в одном запросе
+YOLO_MAX_IMAGES_PER_REQUEST = 500
+
+# Микробатчинг одиночных запросов (/api/process-image/)
+# Запросы копятся в очереди и уходят в модель одним батчем, когда набралось
+# YOLO_SCHEDULER_MAX_BATCH_SIZE кадров или истекло YOLO_SCHEDULER_MAX_WAIT_MS
+YOLO_SCHEDULER_ENABLED = True
+YOLO_SCHEDULER_MAX_BATCH_SIZE = 8
+YOLO_SCHEDULER_MAX_WAIT_MS = 10
+# Максимальная глубина очереди; при переполнении запрос отклоняется
+YOLO_SCHEDULER_MAX_QUEUE_SIZE = 64
+
+# Пул процессов инференса: YOLO_WORKER_POOL_SIZE процессов (0 – по процессу на ядро), в каждом
+# своя копия модели и YOLO_WORKER_POOL_THREADS потоков (0 – ядра делятся поровну); при
+# YOLO_WORKER_POOL_PIN_CPUS процесс привязывается к своим ядрам. Кадры передаются через разделяемую
+# память (YOLO_WORKER_POOL_SHM_MB на процесс). Выключен по умолчанию: каждая копия модели – своя память
+YOLO_WORKER_POOL_ENABLED = False
+YOLO_WORKER_POOL_SIZE = 0
+YOLO_WORKER_POOL_THREADS = 0
+YOLO_WORKER_POOL_PIN_CPUS = True
+YOLO_WORKER_POOL_SHM_MB = 64
+# Ожидание свободного процесса и ответа на запрос; не ответивший процесс перезапускается
+YOLO_WORKER_POOL_TIMEOUT = 60.0
+YOLO_WORKER_POOL_START_TIMEOUT = 300.0
+# Период проверки процессов (ping свободных, перезапуск упавших), сек
+YOLO_WORKER_POOL_HEALTH_INTERVAL = 5.0
+# Функция загрузки модели в процессе: loader(name, threads=...) -> модель
+YOLO_WORKER_POOL_LOADER = "detection.engines.load_model"
+
+# Тайловый инференс больших изображений (параметры tiled/tile_* запроса)
+# Изображение режется на перекрывающиеся тайлы YOLO_TILE_SIZE px с перекрытием YOLO_TILE_OVERLAP
+# (доля тайла), тайлы идут в модель батчами по YOLO_TILE_BATCH_SIZE, дубли на стыках сливаются
+# методом YOLO_TILE_MERGE ("nms" или "wbf") с порогом IoU YOLO_TILE_MERGE_IOU
+YOLO_TILE_SIZE = 1024
+YOLO_TILE_OVERLAP = 0.2
+YOLO_TILE_BATCH_SIZE = 4
+YOLO_TILE_MERGE = "nms"
+YOLO_TILE_MERGE_IOU = 0.5
+# Дополнительный проход по всему изображению – для крупных объектов, не помещающихся в тайл
+YOLO_TILE_INCLUDE_FULL_IMAGE = True
+# Включать тайлинг автоматически, если длинная сторона изображения не меньше этого значения (0 – только по запросу)
+YOLO_TILE_AUTO_MIN_SIDE = 0
+# Ограничения параметров запроса
+YOLO_TILE_MAX_SIZE = 4096
+YOLO_TILE_MAX_BATCH_SIZE = 16
+
+# Кэш результатов по хэшу содержимого входного изображения
+# Повторное изображение (файл или ссылка) не прогоняется через модель
+RESULT_CACHE_ENABLED = True
+# Лимит LRU-кэша в памяти процесса (байт); 0 – только поиск по БД
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Размер пачки bulk_create при сохранении детекций в таблицу Detection
+DETECTION_BULK_CHUNK_SIZE = 1000
+
+# Групповая запись истории (persistence.py): записи всех запросов сохраняет один поток,
+# по транзакции на всё, что накопилось за время предыдущей (не больше HISTORY_WRITE_MAX_ROWS записей;
+# первая ждёт остальных не дольше HISTORY_WRITE_MAX_DELAY сек). Запрос ждёт фиксации своей записи
+# не дольше HISTORY_WRITE_TIMEOUT сек; в очереди не бывает больше HISTORY_WRITE_MAX_ROWS записей.
+# False – каждый запрос пишет своей транзакцией
+HISTORY_WRITE_GROUP_COMMIT = True
+HISTORY_WRITE_MAX_ROWS = 200
+HISTORY_WRITE_MAX_DELAY = 0.0
+HISTORY_WRITE_TIMEOUT = 30.0
+
+# История обработок (/api/history/): размер страницы по умолчанию и максимальный page_size
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Загрузка входных файлов по ссылкам (image_url, image_urls, video_url)
+# Таймауты на соединение и на чтение (сек)
+FETCH_CONNECT_TIMEOUT = 5.0
+FETCH_READ_TIMEOUT = 30.0
+# Максимальный размер изображения и видео по ссылке (байт)
+FETCH_MAX_BYTES = 50 * 1024 * 1024
+FETCH_MAX_VIDEO_BYTES = 2 * 1024 * 1024 * 1024
+# Соединений в пуле на один хост, число хостов с открытыми сессиями, повторы при сбое соединения
+FETCH_POOL_SIZE = 10
+FETCH_MAX_HOSTS = 64
+FETCH_RETRIES = 2
+# Кэш загруженных файлов с ETag/Last-Modified (байт): повторная ссылка проверяется
+# условным запросом и при ответе 304 не скачивается заново
+FETCH_CACHE_BYTES = 64 * 1024 * 1024
+# Число потоков параллельной загрузки ссылок в /api/process-images/
+FETCH_PREFETCH_WORKERS = 4
+
+# Исходные изображения декодируются в памяти; сохранение оригинала в MEDIA/input_img
+# можно отключить (тогда недоступны input_image и отрисовка /api/history/<id>/render/)
+INPUT_PERSIST_ENABLED = True
+# Сохранять оригинал в фоне параллельно инференсу и число потоков записи;
+# запись в историю создаётся только после успешного сохранения файла (иначе ответ 500)
+INPUT_PERSIST_ASYNC = True
+INPUT_PERSIST_WORKERS = 2
+
+# Сохранять ли аннотированное изображение при детекции (параметр annotate запроса по умолчанию).
+# При False сохраняются только детекции, изображение отрисовывается по запросу
+# /api/history/<id>/render/ и кэшируется на диске в RENDER_CACHE_DIR
+YOLO_ANNOTATE_OUTPUT = True
+RENDER_CACHE_DIR = os.path.join(MEDIA_ROOT, 'render_cache')
+# Лимит дискового кэша отрисовки (байт); давно не запрошенные изображения удаляются
+RENDER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RENDER_JPEG_QUALITY = 90
+# Максимальный max_size для отрисовки, px
+RENDER_MAX_SIZE = 4096
+
+# Формат сохраняемых аннотированных изображений: "jpeg", "webp" или "avif", качество 1-100.
+# При OUTPUT_PREVIEW_MAX_SIZE > 0 сохраняется уменьшенная копия (длинная сторона, px),
+# полноразмерное изображение отрисовывается по запросу /api/history/<id>/render/
+OUTPUT_IMAGE_FORMAT = "jpeg"
+OUTPUT_IMAGE_QUALITY = 75
+OUTPUT_PREVIEW_MAX_SIZE = 0
+
+# Сжатие MEDIA (manage.py compact_media): файлы записей старше MEDIA_RETENTION_DAYS дней
+# перекодируются в MEDIA_COMPACT_FORMAT с качеством MEDIA_COMPACT_QUALITY,
+# аннотированные изображения при этом уменьшаются до MEDIA_COMPACT_MAX_SIZE (0 – без изменения)
+MEDIA_RETENTION_DAYS = 30
+MEDIA_COMPACT_FORMAT = "webp"
+MEDIA_COMPACT_QUALITY = 75
+MEDIA_COMPACT_MAX_SIZE = 1280
+
+# Фоновые задачи по видео (/api/process-video/)
+# Число потоков, одновременно обрабатывающих видео
+VIDEO_JOB_WORKERS = 2
+# Как часто (в секундах) сохранять прогресс задачи в БД
+VIDEO_JOB_PROGRESS_INTERVAL = 1.0
+# Аренда задачи: процесс, выполняющий задачу, раз в VIDEO_JOB_HEARTBEAT_INTERVAL секунд обновляет
+# VideoJob.heartbeat_at. Задачу в состоянии running другой процесс забирает себе при старте
+# (resume_pending_jobs), только если её не продлевали дольше VIDEO_JOB_LEASE_SECONDS
+VIDEO_JOB_HEARTBEAT_INTERVAL = 10.0
+VIDEO_JOB_LEASE_SECONDS = 60.0
+# Конвейер обработки видео: число кадров в одном проходе модели
+# и ёмкость очередей между стадиями decode -> infer -> annotate -> encode
+VIDEO_INFERENCE_BATCH_SIZE = 4
+VIDEO_PIPELINE_QUEUE_SIZE = 8
+# Прореживание детекции (frame_stride): максимально допустимый шаг и порог
+# смены сцены (средняя разница яркости уменьшенных кадров, 0-255) для adaptive_stride
+VIDEO_MAX_FRAME_STRIDE = 30
+VIDEO_ADAPTIVE_STRIDE_THRESHOLD = 12.0
+# Загрузка через yt-dlp: самый маленький поток не ниже VIDEO_DOWNLOAD_TARGET_HEIGHT px (0 – лучшее качество);
+# звук загружается только при VIDEO_DOWNLOAD_AUDIO (выходное видео пишется без звука)
+VIDEO_DOWNLOAD_TARGET_HEIGHT = 720
+VIDEO_DOWNLOAD_AUDIO = False
+# Кадры больше VIDEO_DECODE_MAX_SIZE px по длинной стороне уменьшаются сразу после декодирования
+# (модель всё равно работает на 640); боксы переводятся в координаты исходного видео. 0 – без уменьшения
+VIDEO_DECODE_MAX_SIZE = 1280
+# Сегментная обработка одного видео (segments.py): видео делится по ключевым кадрам на отрезки
+# не короче VIDEO_SEGMENT_SECONDS секунд, отрезки обрабатываются в VIDEO_SEGMENT_WORKERS процессах
+# (0 – по процессу на ядро) по VIDEO_SEGMENT_THREADS потоков (0 – ядра делятся поровну) и склеиваются
+# по порядку. Упавший отрезок повторяется до VIDEO_SEGMENT_RETRIES раз; после перезапуска сервера
+# задача продолжается с готовых отрезков. В каждом процессе своя копия модели: VIDEO_SEGMENT_LOADER –
+# путь к загрузчику (name, threads) -> модель, пусто – обычная загрузка через реестр. Выключено по умолчанию
+VIDEO_SEGMENT_PARALLEL_ENABLED = False
+VIDEO_SEGMENT_WORKERS = 0
+VIDEO_SEGMENT_THREADS = 0
+VIDEO_SEGMENT_SECONDS = 10.0
+VIDEO_SEGMENT_RETRIES = 2
+VIDEO_SEGMENT_LOADER = ""
+# Поток детекций (/api/video-jobs/<job_id>/events/): пауза между опросами БД (сек),
+# число кадров, читаемых за один запрос, и интервал keep-alive при отсутствии событий (сек)
+VIDEO_STREAM_POLL_INTERVAL = 0.5
+VIDEO_STREAM_WINDOW_FRAMES = 100
+VIDEO_STREAM_KEEPALIVE = 15.0
+# Поток событий (задачи по видео или живого потока) держит поток обработки запроса до своего конца
+# (нужен ASGI-сервер или WSGI с потоками): наибольшая длительность одного потока, сек (затем событие timeout –
+# клиент переподключается), и число одновременных потоков событий в процессе, сверх – 429 (0 – без ограничений)
+VIDEO_STREAM_MAX_SECONDS = 600
+VIDEO_STREAM_MAX_CONCURRENT = 8
+
+# Живые потоки (/api/live-streams/, live.py): детекция всегда на самом свежем кадре, устаревшие отбрасываются.
+# Допустимые схемы адресов источника и максимум одновременных потоков в процессе
+LIVE_ALLOWED_SCHEMES = ("rtsp", "rtsps", "rtmp", "http", "https", "srt")
+LIVE_MAX_STREAMS = 4
+# Кадры больше LIVE_DECODE_MAX_SIZE px по длинной стороне уменьшаются перед моделью (0 – без изменения)
+LIVE_DECODE_MAX_SIZE = 1280
+# Аннотированное видео пишется отрезками не длиннее LIVE_MAX_SEGMENT_SECONDS сек, хранятся LIVE_KEEP_SEGMENTS последних
+LIVE_MAX_SEGMENT_SECONDS = 300
+LIVE_KEEP_SEGMENTS = 6
+# Оборванный поток переоткрывается через LIVE_RECONNECT_DELAY сек; без новых кадров дольше
+# LIVE_IDLE_TIMEOUT сек поток завершается
+LIVE_RECONNECT_DELAY = 1.0
+LIVE_IDLE_TIMEOUT = 10.0
+# Событий в буфере одного слушателя /events/: медленный клиент теряет старые
+LIVE_SUBSCRIBER_BUFFER = 32
+
+# Заголовок Server-Timing с длительностью стадий (download, decode, infer, annotate, encode, db_insert, ...)
+# в каждом ответе API; гистограммы стадий отдаются на /metrics независимо от этой настройки
+SERVER_TIMING_ENABLED = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
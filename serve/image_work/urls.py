@@ -19,6 +19,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from detection.metrics import metrics_view
+
 urlpatterns = [
     # path('admin/', admin.site.urls),
     # Наш API
@@ -27,6 +29,9 @@ urlpatterns = [
     # drf-spectacular: схема и Swagger UI
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+
+    # Метрики для Prometheus
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG: